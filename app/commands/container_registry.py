@@ -12,12 +12,6 @@ from app.services.output_manager.message_handler import SrvOutPutHandler
 from app.utils.aggregated import doc
 
 
-@click.command()
-def cli():
-    """Container Registry Actions."""
-    pass
-
-
 @click.command()
 @doc(help_page.cr_help_page(help_page.ContainerRegistryHELP.LIST_PROJECTS))
 def list_projects():
@@ -5,7 +5,6 @@
 # You may not use this file except in compliance with the License.
 
 import click
-import questionary
 
 import app.services.output_manager.help_page as dataset_help
 import app.services.output_manager.message_handler as message_handler
@@ -15,12 +14,6 @@ from app.services.dataset_manager.dataset_list import SrvDatasetListManager
 from app.utils.aggregated import doc
 
 
-@click.command()
-def cli():
-    """Dataset Actions."""
-    pass
-
-
 @click.command(name='list')
 @click.option(
     '--all',
@@ -43,6 +36,8 @@ def cli():
 )
 @doc(dataset_help.dataset_help_page(dataset_help.DatasetHELP.DATASET_LIST))
 def dataset_list(all_considering_admin_role, page, page_size, detached):
+    import questionary
+
     filter_by_creator = not all_considering_admin_role
     if detached:
         dataset_mgr = SrvDatasetListManager()
@@ -86,6 +81,8 @@ def dataset_list(all_considering_admin_role, page, page_size, detached):
 )
 @doc(dataset_help.dataset_help_page(dataset_help.DatasetHELP.DATASET_SHOW_DETAIL))
 def dataset_show_detail(code, page, page_size, detached):
+    import questionary
+
     if detached:
         detail_mgr = SrvDatasetDetailManager()
         detail_mgr.dataset_detail(code, page, page_size)
@@ -4,29 +4,36 @@
 # Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
 # You may not use this file except in compliance with the License.
 
+import importlib
+
 import click
 
 from app.services.user_authentication.decorator import require_config
 from app.services.user_authentication.decorator import require_login_session
 
-from .container_registry import create_project
-from .container_registry import get_secret
-from .container_registry import invite_member
-from .container_registry import list_projects
-from .container_registry import list_repositories
-from .dataset import dataset_download
-from .dataset import dataset_list
-from .dataset import dataset_show_detail
-from .file import file_check_manifest
-from .file import file_download
-from .file import file_export_manifest
-from .file import file_list
-from .file import file_put
-from .file import file_resume
-from .project import project_list_all
-from .use_config import set_env
-from .user import login
-from .user import logout
+
+class LazyGroup(click.Group):
+    """
+    Summary:
+        The command group which imports its commands on demand. The
+        commands are given as `module:function`, so listing the group only
+        needs the names, and the command module with its services is
+        imported once the command is used or its help is shown.
+    """
+
+    def __init__(self, *args, lazy_commands: dict = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in self.lazy_commands:
+            module_name, command_name = self.lazy_commands[cmd_name].split(':')
+            module = importlib.import_module(module_name)
+            self.add_command(getattr(module, command_name), cmd_name)
+        return super().get_command(ctx, cmd_name)
 
 
 def command_groups():
@@ -39,59 +46,78 @@ def entry_point():
     pass
 
 
-@entry_point.group(name='project')
+@entry_point.group(name='project', cls=LazyGroup, lazy_commands={'list': 'app.commands.project:project_list_all'})
 @require_config
 @require_login_session
 def project_group():
+    """Project Actions."""
     pass
 
 
-@entry_point.group(name='dataset')
+@entry_point.group(
+    name='dataset',
+    cls=LazyGroup,
+    lazy_commands={
+        'list': 'app.commands.dataset:dataset_list',
+        'show-detail': 'app.commands.dataset:dataset_show_detail',
+        'download': 'app.commands.dataset:dataset_download',
+    },
+)
 @require_config
 @require_login_session
 def dataset_group():
+    """Dataset Actions."""
     pass
 
 
-@entry_point.group(name='file')
+@entry_point.group(
+    name='file',
+    cls=LazyGroup,
+    lazy_commands={
+        'upload': 'app.commands.file:file_put',
+        'attribute-list': 'app.commands.file:file_check_manifest',
+        'attribute-export': 'app.commands.file:file_export_manifest',
+        'list': 'app.commands.file:file_list',
+        'sync': 'app.commands.file:file_download',
+        'resume': 'app.commands.file:file_resume',
+    },
+)
 @require_config
 @require_login_session
 def file_group():
+    """File Actions."""
     pass
 
 
-@entry_point.group(name='user')
+@entry_point.group(
+    name='user',
+    cls=LazyGroup,
+    lazy_commands={'login': 'app.commands.user:login', 'logout': 'app.commands.user:logout'},
+)
 @require_config
 def user_group():
+    """User Actions."""
     pass
 
 
-@entry_point.group(name='use_config')
+@entry_point.group(name='use_config', cls=LazyGroup, lazy_commands={'set-env': 'app.commands.use_config:set_env'})
 def config_group():
+    """Config Actions."""
     pass
 
 
-@entry_point.group(name='container_registry')
+@entry_point.group(
+    name='container_registry',
+    cls=LazyGroup,
+    lazy_commands={
+        'list-projects': 'app.commands.container_registry:list_projects',
+        'list-repositories': 'app.commands.container_registry:list_repositories',
+        'create-project': 'app.commands.container_registry:create_project',
+        'get-secret': 'app.commands.container_registry:get_secret',
+        'invite-member': 'app.commands.container_registry:invite_member',
+    },
+)
 @require_config
 def cr_group():
+    """Container Registry Actions."""
     pass
-
-
-file_group.add_command(file_put)
-file_group.add_command(file_check_manifest)
-file_group.add_command(file_export_manifest)
-file_group.add_command(file_list)
-file_group.add_command(file_download)
-file_group.add_command(file_resume)
-project_group.add_command(project_list_all)
-user_group.add_command(login)
-user_group.add_command(logout)
-dataset_group.add_command(dataset_list)
-dataset_group.add_command(dataset_show_detail)
-dataset_group.add_command(dataset_download)
-cr_group.add_command(list_projects)
-cr_group.add_command(list_repositories)
-cr_group.add_command(create_project)
-cr_group.add_command(get_secret)
-cr_group.add_command(invite_member)
-config_group.add_command(set_env)
@@ -14,13 +14,18 @@ import app.services.output_manager.help_page as file_help
 import app.services.output_manager.message_handler as message_handler
 from app.configs.app_config import AppConfig
 from app.configs.user_config import UserConfig
+from app.services.file_manager.file_download.batch_download import download_items_in_parallel
 from app.services.file_manager.file_download.download_client import SrvFileDownload
+from app.services.file_manager.file_download.download_sink import BandwidthLimiter
 from app.services.file_manager.file_list import SrvFileList
 from app.services.file_manager.file_manifests import SrvFileManifests
 from app.services.file_manager.file_upload.file_upload import assemble_path
 from app.services.file_manager.file_upload.file_upload import resume_upload
 from app.services.file_manager.file_upload.file_upload import simple_upload
+from app.services.file_manager.file_upload.folder_zip import ARCHIVE_FORMATS
+from app.services.file_manager.file_upload.folder_zip import zstd_available
 from app.services.file_manager.file_upload.upload_validator import UploadEventValidator
+from app.services.file_manager.path_resolver import PathResolver
 from app.services.output_manager.error_handler import ECustomizedError
 from app.services.output_manager.error_handler import SrvErrorHandler
 from app.services.output_manager.error_handler import customized_error_msg
@@ -29,13 +34,24 @@ from app.utils.aggregated import doc
 from app.utils.aggregated import get_file_info_by_geid
 from app.utils.aggregated import get_zone
 from app.utils.aggregated import identify_target_folder
-from app.utils.aggregated import search_item
+from app.utils.metadata_cache import MetadataCache
 
 
-@click.command()
-def cli():
-    """File Actions."""
-    pass
+class ThreadParamType(click.ParamType):
+    """The number of upload thread, or `auto` to adjust it by the upload throughput."""
+
+    name = 'integer|auto'
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, str) and value.lower() == 'auto':
+            return 'auto'
+        try:
+            num_of_thread = int(value)
+        except (TypeError, ValueError):
+            self.fail(f'{value!r} is not a valid integer or auto', param, ctx)
+        if num_of_thread < 1:
+            self.fail(f'{value!r} should be at least 1', param, ctx)
+        return num_of_thread
 
 
 @click.command(name='upload')
@@ -97,12 +113,29 @@ def cli():
     help=file_help.file_help_page(file_help.FileHELP.FILE_UPLOAD_ZIP),
     show_default=True,
 )
+@click.option(
+    '--zip-level',
+    default=AppConfig.Env.upload_zip_level,
+    type=click.IntRange(0, 9),
+    required=False,
+    help=file_help.file_help_page(file_help.FileHELP.FILE_UPLOAD_ZIP_LEVEL),
+    show_default=True,
+)
+@click.option(
+    '--zip-format',
+    default='zip',
+    type=click.Choice(ARCHIVE_FORMATS),
+    required=False,
+    help=file_help.file_help_page(file_help.FileHELP.FILE_UPLOAD_ZIP_FORMAT),
+    show_default=True,
+)
 @click.option(
     '--thread',
     '-td',
     default=1,
+    type=ThreadParamType(),
     required=False,
-    help='The number of thread for upload a file',
+    help='The number of thread for upload a file, or auto to adjust it by the upload throughput',
     show_default=True,
 )
 @click.option(
@@ -113,6 +146,14 @@ def cli():
     help='The output path for the manifest file of resumable upload',
     show_default=True,
 )
+@click.option(
+    '--no-cache',
+    default=False,
+    required=False,
+    is_flag=True,
+    help=file_help.file_help_page(file_help.FileHELP.FILE_NO_CACHE),
+    show_default=True,
+)
 @doc(file_help.file_help_page(file_help.FileHELP.FILE_UPLOAD))
 def file_put(**kwargs):  # noqa: C901
     """"""
@@ -125,9 +166,13 @@ def file_put(**kwargs):  # noqa: C901
     source_file = kwargs.get('source_file')
     pipeline = kwargs.get('pipeline')
     zipping = kwargs.get('zip')
+    zip_level = kwargs.get('zip_level')
+    zip_format = kwargs.get('zip_format')
     attribute = kwargs.get('attribute')
     thread = kwargs.get('thread')
     output_path = kwargs.get('output_path')
+    if kwargs.get('no_cache'):
+        MetadataCache().enabled = False
 
     user = UserConfig()
     zone = get_zone(zone) if zone else AppConfig.Env.green_zone.lower()
@@ -138,6 +183,9 @@ def file_put(**kwargs):  # noqa: C901
     if len(paths) == 0:
         SrvErrorHandler.customized_handle(ECustomizedError.INVALID_PATHS, True)
 
+    if zipping and zip_format == 'tar.zst' and not zstd_available():
+        SrvErrorHandler.customized_handle(ECustomizedError.ZSTD_UNAVAILABLE, True)
+
     if os.path.exists(output_path):
         click.confirm(customized_error_msg(ECustomizedError.MANIFEST_OF_FOLDER_FILE_EXIST) % (output_path), abort=True)
 
@@ -167,6 +215,7 @@ def file_put(**kwargs):  # noqa: C901
             upload_message = AppConfig.Env.default_upload_message
 
     paths = set(paths)
+    resolver = PathResolver(zone)
     for f in paths:
         current_folder_node, parent_folder, create_folder_flag, result_file = assemble_path(
             f,
@@ -174,6 +223,8 @@ def file_put(**kwargs):  # noqa: C901
             project_code,
             zone,
             zipping,
+            resolver,
+            zip_format,
         )
 
         upload_event = {
@@ -187,6 +238,8 @@ def file_put(**kwargs):  # noqa: C901
             'parent_folder_id': parent_folder.get('id'),
             'create_folder_flag': create_folder_flag,
             'compress_zip': zipping,
+            'compress_format': zip_format,
+            'compress_level': zip_level,
             'attribute': attribute,
         }
         if pipeline:
@@ -205,8 +258,9 @@ def file_put(**kwargs):  # noqa: C901
     '--thread',
     '-td',
     default=1,
+    type=ThreadParamType(),
     required=False,
-    help='The number of thread for upload a file',
+    help='The number of thread for upload a file, or auto to adjust it by the upload throughput',
     show_default=True,
 )
 @click.option(
@@ -217,6 +271,14 @@ def file_put(**kwargs):  # noqa: C901
     help='The manifest file for resumable upload',
     show_default=True,
 )
+@click.option(
+    '--trust-hash-cache',
+    default=False,
+    required=False,
+    is_flag=True,
+    help='Trust the local hash cache of uploaded chunks instead of hashing them again',
+    show_default=True,
+)
 @doc(file_help.file_help_page(file_help.FileHELP.FILE_RESUME))
 def file_resume(**kwargs):  # noqa: C901
     """
@@ -224,8 +286,9 @@ def file_resume(**kwargs):  # noqa: C901
         Resume upload file. Now split the logic of resumable upload and
         normal file upload to make the code more clear.
     Parameters:
-        - thread: The number of thread for upload a file
+        - thread: The number of thread for upload a file, or auto
         - resumable_file: The manifest file for resumable upload
+        - trust_hash_cache: Trust the local hash cache of uploaded chunks
     """
 
     thread = kwargs.get('thread')
@@ -238,7 +301,7 @@ def file_resume(**kwargs):  # noqa: C901
         resumable_manifest = json.load(f)
         validate_upload_event(resumable_manifest)
 
-    resume_upload(resumable_manifest, thread)
+    resume_upload(resumable_manifest, thread, kwargs.get('trust_hash_cache'), resumable_manifest_file)
 
 
 def validate_upload_event(event):
@@ -321,9 +384,19 @@ def file_export_manifest(project_code, attribute_name):
     help='whether run in detached mode',
     show_default=True,
 )
+@click.option(
+    '--no-cache',
+    default=False,
+    required=False,
+    is_flag=True,
+    help=file_help.file_help_page(file_help.FileHELP.FILE_NO_CACHE),
+    show_default=True,
+)
 @require_valid_token()
 @doc(file_help.file_help_page(file_help.FileHELP.FILE_LIST))
-def file_list(paths, zone, page, page_size, detached):
+def file_list(paths, zone, page, page_size, detached, no_cache):
+    if no_cache:
+        MetadataCache().enabled = False
     zone = get_zone(zone) if zone else 'greenroom'
     if not zone:
         SrvErrorHandler.customized_handle(ECustomizedError.INVALID_ZONE, True)
@@ -336,6 +409,41 @@ def file_list(paths, zone, page, page_size, detached):
         srv_list.list_files_with_pagination(paths, zone, page, page_size)
 
 
+def resolve_download_items(paths: list[str], zone: str) -> list[dict]:
+    """
+    Summary:
+        The function is to resolve the project paths of file sync into
+        items, in the same format as the items of get_file_info_by_geid.
+    Parameter:
+        - paths(list of str): the paths as `<project_code>/<path>`.
+        - zone(str): the zone of paths.
+    return:
+        - list of dict: the items with status, result and geid.
+    """
+    lookups = []
+    for path in paths:
+        project_code = path.strip('/').split('/')[0]
+        target_path = '/'.join(path.split('/')[1::])
+        lookups.append((project_code, target_path, ''))
+
+    item_res = []
+    for path, item in zip(paths, PathResolver(zone).resolve_many(lookups)):
+        if item.get('code') == 200 and item.get('result'):
+            item_status = 'success'
+            item_result = item.get('result')
+            item_geid = item.get('result').get('id')
+        elif item.get('code') == 403 and item.get('error_msg'):
+            item_status = item.get('error_msg')
+            item_result = {}
+            item_geid = path
+        else:
+            item_status = 'File Not Exist'
+            item_result = {}
+            item_geid = path
+        item_res.append({'status': item_status, 'result': item_result, 'geid': item_geid})
+    return item_res
+
+
 @click.command(name='sync')
 @click.argument('paths', type=click.STRING, nargs=-1)
 @click.argument('output_path', type=click.Path(exists=True), nargs=1)
@@ -364,6 +472,31 @@ def file_list(paths, zone, page, page_size, detached):
     help=file_help.file_help_page(file_help.FileHELP.FILE_SYNC_I),
     show_default=True,
 )
+@click.option(
+    '--parallel',
+    '-p',
+    default=1,
+    type=click.IntRange(min=1),
+    required=False,
+    help=file_help.file_help_page(file_help.FileHELP.FILE_SYNC_PARALLEL),
+    show_default=True,
+)
+@click.option(
+    '--bandwidth-limit',
+    default=0,
+    type=click.FloatRange(min=0),
+    required=False,
+    help=file_help.file_help_page(file_help.FileHELP.FILE_SYNC_BANDWIDTH),
+    show_default=True,
+)
+@click.option(
+    '--no-cache',
+    default=False,
+    required=False,
+    is_flag=True,
+    help=file_help.file_help_page(file_help.FileHELP.FILE_NO_CACHE),
+    show_default=True,
+)
 @require_valid_token()
 @doc(file_help.file_help_page(file_help.FileHELP.FILE_SYNC))
 def file_download(**kwargs):
@@ -372,8 +505,13 @@ def file_download(**kwargs):
     zone = kwargs.get('zone')
     zipping = kwargs.get('zip')
     geid = kwargs.get('geid')
+    num_of_parallel = kwargs.get('parallel')
+    bandwidth_limit = kwargs.get('bandwidth_limit')
     zone = get_zone(zone) if zone else AppConfig.Env.green_zone
     interactive = False if len(paths) > 1 else True
+    limiter = BandwidthLimiter(bandwidth_limit * 1024 * 1024) if bandwidth_limit else None
+    if kwargs.get('no_cache'):
+        MetadataCache().enabled = False
 
     if zone.lower() == AppConfig.Env.green_zone.lower():
         SrvErrorHandler.customized_handle(ECustomizedError.INVALID_ZONE, True)
@@ -382,29 +520,16 @@ def file_download(**kwargs):
     if geid:
         item_res = get_file_info_by_geid(paths)
     else:
-        item_res = []
-        for path in paths:
-            project_code = path.strip('/').split('/')[0]
-            target_path = '/'.join(path.split('/')[1::])
-            item = search_item(project_code, zone, target_path, '')
-            if item.get('code') == 200 and item.get('result'):
-                item_status = 'success'
-                item_result = item.get('result')
-                item_geid = item.get('result').get('id')
-            elif item.get('code') == 403 and item.get('error_msg'):
-                item_status = item.get('error_msg')
-                item_result = {}
-                item_geid = path
-            else:
-                item_status = 'File Not Exist'
-                item_result = {}
-                item_geid = path
-            item_res.append({'status': item_status, 'result': item_result, 'geid': item_geid})
+        item_res = resolve_download_items(paths, zone)
 
     if zipping and len(paths) > 1:
         srv_download = SrvFileDownload(zone, interactive)
+        srv_download.bandwidth_limiter = limiter
         srv_download.batch_download_file(output_path, item_res)
+    elif num_of_parallel > 1 and len(item_res) > 1:
+        download_items_in_parallel(output_path, item_res, zone, num_of_parallel, limiter)
     else:
         for item in item_res:
             srv_download = SrvFileDownload(zone, interactive)
+            srv_download.bandwidth_limiter = limiter
             srv_download.simple_download_file(output_path, [item])
@@ -5,7 +5,6 @@
 # You may not use this file except in compliance with the License.
 
 import click
-import questionary
 
 import app.services.output_manager.help_page as project_help
 import app.services.output_manager.message_handler as mhandler
@@ -13,12 +12,6 @@ from app.services.project_manager.project import SrvProjectManager
 from app.utils.aggregated import doc
 
 
-@click.command()
-def cli():
-    """Project Actions."""
-    pass
-
-
 @click.command(name='list')
 @click.option('--page', default=0, required=False, help=' The page to be listed', show_default=True)
 @click.option('--page-size', default=10, required=False, help='number of objects per page', show_default=True)
@@ -49,6 +42,8 @@ def cli():
 )
 @doc(project_help.project_help_page(project_help.ProjectHELP.PROJECT_LIST))
 def project_list_all(page, page_size, order, order_by, detached):
+    import questionary
+
     if detached:
         project_mgr = SrvProjectManager()
         projects = project_mgr.list_projects(page, page_size, order, order_by)
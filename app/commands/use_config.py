@@ -11,12 +11,6 @@ from app.services.user_authentication.user_set_config import set_config
 from app.utils.aggregated import doc
 
 
-@click.command()
-def cli():
-    """Config Actions."""
-    pass
-
-
 @click.command()
 @click.argument('path', type=click.Path(exists=True), nargs=1)
 @click.option(
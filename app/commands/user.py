@@ -15,12 +15,6 @@ from app.services.user_authentication.user_login_logout import validate_user_dev
 from app.utils.aggregated import doc
 
 
-@click.command()
-def cli():
-    """User Actions."""
-    pass
-
-
 @click.command()
 @doc(user_help.user_help_page(user_help.UserHELP.USER_LOGIN))
 def login():
@@ -15,17 +15,116 @@ class AppConfig:
         msg_path = ConfigClass.custom_path
         user_config_file = f'{user_config_path}/config.ini'
         token_warn_need_refresh = 250
-        token_refresh_interval = 120
+        # the seconds to wait before refreshing the token again if it failed
+        token_refresh_retry_delay = 10
 
         chunk_size = 1024 * 1024 * 20  # MB
         resilient_retry = 3
         resilient_backoff = 1
-        resilient_retry_interval = 1
-        resilient_retry_code = [502, 503, 504, 404, 401]
+        resilient_backoff_max = 30
+        resilient_retry_after_max = 120
+        resilient_retry_code = [429, 502, 503, 504]
+        # the ratio of retries to requests for each request class
+        resilient_retry_budget = {'default': 0.2, 'presign': 0.2, 'chunk': 0.1, 'finalize': 0.5}
+        resilient_retry_budget_reserve = 10
+        # the chunk is retried with a new presigned url, which also replaces an expired one(403)
+        chunk_retry_code = [403, 429, 500, 502, 503, 504]
+        http_max_connections = ConfigClass.http_max_connections
+        http_max_keepalive_connections = ConfigClass.http_max_keepalive_connections
+        http_keepalive_expiry = ConfigClass.http_keepalive_expiry
+        http2 = ConfigClass.http2
+        # the in-flight requests of each class in the async transfer engine
+        transfer_engine_limits = {
+            'default': 64,
+            'upload': 64,
+            'presign': 64,
+            'chunk': 64,
+            'finalize': 16,
+            'status': 64,
+            'download': 16,
+        }
+        # the upload service does not have the batch endpoint yet
+        presigned_url_batch = False
+        presigned_url_batch_path = '/v1/files/chunks/presigned/batch'
+        presigned_url_window = 16
+        presigned_url_prefetch_workers = 4
+        presigned_url_ttl = 3600
+        presigned_url_expiry_margin = 60
+        # the project paths are searched with batch endpoint if supported, else in parallel.
+        # the bff does not have the batch endpoint yet
+        search_batch = False
+        search_batch_path = '/search/batch'
+        search_batch_size = 100
+        search_workers = 8
         pipeline_straight_upload = f'{project}cli_upload'
         default_upload_message = f'{project}cli straight uploaded'
         session_duration = 3600.0
+        # the last active time is only written to config when it moved by more seconds
+        session_active_granularity = 60
         upload_batch_size = 100
+        upload_pre_upload_workers = 4
+        # the threads to verify uploaded chunks when resuming, 0 means cpu count
+        upload_hash_workers = 0
+        upload_hash_cache_path = f'{user_config_path}/chunk_hash.db'
+        # the found items of search and geid query are cached locally for a while,
+        # the other users can change them, so the time is short
+        metadata_cache = True
+        metadata_cache_path = f'{user_config_path}/metadata_cache.db'
+        metadata_cache_ttl = 60
+        upload_finalize_workers = 4
+        # the zip of `--zip` is uploaded while compressing, instead of a temporary zip
+        upload_zip_stream = True
+        # the members of zip are deflated by processes, 0 means cpu count
+        upload_zip_workers = 0
+        upload_zip_level = 6
+        upload_zip_segment_size = 1024 * 1024 * 4
+        # the files already compressed are stored in zip as they are
+        upload_zip_stored_extensions = [
+            '.gz',
+            '.tgz',
+            '.bz2',
+            '.xz',
+            '.zst',
+            '.zip',
+            '.7z',
+            '.rar',
+            '.jpg',
+            '.jpeg',
+            '.png',
+            '.gif',
+            '.webp',
+            '.mp3',
+            '.mp4',
+            '.mov',
+            '.mkv',
+        ]
+        # the single chunk files are uploaded as coroutines of the transfer engine.
+        # it saves a thread per file, but is slower than the thread pool for now
+        upload_async_small_files = False
+        # the bounds of in-flight chunks for `--thread auto`
+        upload_thread_auto_initial = 4
+        upload_thread_auto_min = 1
+        upload_thread_auto_max = 32
+        upload_thread_auto_decrease = 0.5
+        upload_thread_auto_tolerance = 0.1
+        # the files downloaded in parallel are coroutines of the transfer engine
+        download_async = True
+        # the parallel range requests of a download, 1 means single stream
+        download_segments = 4
+        download_segment_min_size = 1024 * 1024 * 8
+        # the data is written and the progress is updated once per buffer
+        download_buffer_size = 1024 * 1024 * 4
+        download_progress_interval = 0.2
+        # the downloaded bytes of segment are recorded in journal of part file every interval
+        download_journal_interval = 1024 * 1024 * 8
+        # the preparation status is checked with backoff, or long-polled if it is above 0 seconds
+        download_prepare_initial_delay = 0.05
+        download_prepare_max_delay = 2
+        download_prepare_long_poll = 0
+        # the seconds to wait for preparation, the dataset download gave up after about a minute
+        # before the shared waiter, while the file download had no bound for the large zips
+        download_prepare_timeout = 3600
+        dataset_prepare_timeout = 60
         harbor_client_secret = ConfigClass.harbor_client_secret
         core_zone = 'core'
         green_zone = 'greenroom'
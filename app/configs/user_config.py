@@ -13,15 +13,24 @@ from app.models.singleton import Singleton
 from app.services.crypto.crypto import decryption
 from app.services.crypto.crypto import encryption
 from app.services.crypto.crypto import generate_secret
+from app.utils.file_lock import FileLock
 
 from .app_config import AppConfig
 
+# the fields identifying a login session, the other fields belong to it
+SESSION_FIELDS = ['secret', 'session_id']
+
 
 class UserConfig(metaclass=Singleton):
     """The class to maintain the user access/fresh token Note here: the base class is Singleton, meaning no matter how
     code initializes the class.
 
     This user config is global.
+
+    The config file is shared by all the pilotcli processes, so the save
+    only writes the fields changed by this process, under a file lock and
+    by replacing the file, and a save that only moves `last_active` a
+    little is skipped.
     """
 
     def __init__(self):
@@ -31,6 +40,11 @@ class UserConfig(metaclass=Singleton):
             Path.touch(Path(AppConfig.Env.user_config_file))
         self.config = configparser.ConfigParser()
         self.config.read(AppConfig.Env.user_config_file)
+        # the USER section as it is in config file, to find the changed fields
+        self.saved = dict(self.config['USER']) if self.config.has_section('USER') else {}
+        # the decrypted value of each encrypted field. it is keyed by
+        # field name and stores the ciphertext it was decrypted from
+        self.decrypted_cache = {}
         if not self.config.has_section('USER'):
             self.config['USER'] = {
                 'username': '',
@@ -44,8 +58,101 @@ class UserConfig(metaclass=Singleton):
             self.save()
 
     def save(self):
-        with open(AppConfig.Env.user_config_file, 'w') as configfile:
-            self.config.write(configfile)
+        """
+        Summary:
+            The function is to write the changed fields into config file.
+            The file is read again under the lock, so the fields written by
+            other processes of the same session eg. the refreshed tokens are
+            kept. A login or logout of this process starts a new session,
+            its section is written as a whole. If other process has started
+            a new session, the changes of this process belong to the session
+            replaced, so they are dropped and the new session is read.
+            The file is written into a temporary file and renamed, so it is
+            never seen half written.
+        """
+        changed = {field: val for field, val in self.config['USER'].items() if self.saved.get(field) != val}
+        if not changed or self.is_coalesced(changed):
+            return
+
+        config_file = AppConfig.Env.user_config_file
+        with FileLock(f'{config_file}.lock'):
+            current = configparser.ConfigParser()
+            current.read(config_file)
+            if current.has_section('USER') and not self.is_new_session(changed):
+                if not self.is_same_session(current['USER']):
+                    self.config = current
+                    self.saved = dict(self.config['USER'])
+                    self.decrypted_cache.clear()
+                    return
+                self.config['USER'] = {**current['USER'], **changed}
+
+            temp_file = f'{config_file}.tmp'
+            with open(temp_file, 'w') as configfile:
+                self.config.write(configfile)
+                configfile.flush()
+                os.fsync(configfile.fileno())
+            os.replace(temp_file, config_file)
+
+        self.saved = dict(self.config['USER'])
+        self.decrypted_cache.clear()
+
+    def is_new_session(self, changed: dict) -> bool:
+        """The login changes the session id and the logout changes the secret."""
+        return any(field in changed for field in SESSION_FIELDS)
+
+    def is_same_session(self, section: configparser.SectionProxy) -> bool:
+        return all(section.get(field) == self.saved.get(field) for field in SESSION_FIELDS)
+
+    def reload(self) -> None:
+        """Read the config file again for the fields written by other processes, the unsaved changes are dropped."""
+        config = configparser.ConfigParser()
+        config.read(AppConfig.Env.user_config_file)
+        if not config.has_section('USER'):
+            return
+        self.config = config
+        self.saved = dict(self.config['USER'])
+        self.decrypted_cache.clear()
+
+    def is_coalesced(self, changed: dict) -> bool:
+        """The change is only `last_active` within `session_active_granularity`, no need to write it."""
+        if list(changed) != ['last_active'] or not self.saved.get('last_active'):
+            return False
+        elapsed = int(changed['last_active']) - int(self.saved['last_active'])
+        return 0 <= elapsed < AppConfig.Env.session_active_granularity
+
+    def get_decrypted(self, field: str) -> str:
+        """
+        Summary:
+            The function is to return the plain text of an encrypted field.
+            The result is cached until the field is set again or the config
+            is saved/cleared, so the decryption only happens once.
+        Parameter:
+            - field(str): the field name in USER section.
+        return:
+            - str: the decrypted value.
+        """
+        encrypted = self.config['USER'][field]
+        cached = self.decrypted_cache.get(field)
+        if cached and cached[0] == encrypted:
+            return cached[1]
+
+        decrypted = decryption(encrypted, self.secret)
+        if decrypted is not None:
+            self.decrypted_cache[field] = (encrypted, decrypted)
+        return decrypted
+
+    def set_encrypted(self, field: str, val: str) -> None:
+        """
+        Summary:
+            The function is to encrypt the value into the field and
+            refresh the cached plain text.
+        Parameter:
+            - field(str): the field name in USER section.
+            - val(str): the plain text value.
+        """
+        encrypted = encryption(val, self.secret)
+        self.config['USER'][field] = encrypted
+        self.decrypted_cache[field] = (encrypted, val)
 
     def clear(self):
         self.config['USER'] = {
@@ -61,35 +168,35 @@ class UserConfig(metaclass=Singleton):
 
     @property
     def username(self):
-        return decryption(self.config['USER']['username'], self.secret)
+        return self.get_decrypted('username')
 
     @username.setter
     def username(self, val):
-        self.config['USER']['username'] = encryption(val, self.secret)
+        self.set_encrypted('username', val)
 
     @property
     def password(self):
-        return decryption(self.config['USER']['password'], self.secret)
+        return self.get_decrypted('password')
 
     @password.setter
     def password(self, val):
-        self.config['USER']['password'] = encryption(val, self.secret)
+        self.set_encrypted('password', val)
 
     @property
     def access_token(self):
-        return decryption(self.config['USER']['access_token'], self.secret)
+        return self.get_decrypted('access_token')
 
     @access_token.setter
     def access_token(self, val):
-        self.config['USER']['access_token'] = encryption(val, self.secret)
+        self.set_encrypted('access_token', val)
 
     @property
     def refresh_token(self):
-        return decryption(self.config['USER']['refresh_token'], self.secret)
+        return self.get_decrypted('refresh_token')
 
     @refresh_token.setter
     def refresh_token(self, val):
-        self.config['USER']['refresh_token'] = encryption(val, self.secret)
+        self.set_encrypted('refresh_token', val)
 
     @property
     def secret(self):
@@ -98,6 +205,7 @@ class UserConfig(metaclass=Singleton):
     @secret.setter
     def secret(self, val):
         self.config['USER']['secret'] = val
+        self.decrypted_cache.clear()
 
     @property
     def last_active(self):
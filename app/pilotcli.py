@@ -4,16 +4,15 @@
 # Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
 # You may not use this file except in compliance with the License.
 
+import sys
 from multiprocessing import freeze_support
 
 import click
-import requests
 
 import app.services.output_manager.error_handler as error_handler
 from app.commands.entry_point import command_groups
 from app.commands.entry_point import entry_point
 from app.services.output_manager.help_page import update_message
-from app.utils.aggregated import doc
 
 
 class ComplexCLI(click.MultiCommand):
@@ -23,19 +22,31 @@ class ComplexCLI(click.MultiCommand):
         return rv
 
     def get_command(self, ctx, name):
-        try:
-            mod = __import__(f'app.commands.{name}', None, None, ['cli'])
-        except ImportError:
-            return
-        return mod.cli
-
-
-@click.command(cls=ComplexCLI)
-@doc(update_message)
+        # the group only lists its commands, they are imported on demand
+        return entry_point.get_command(ctx, name)
+
+
+def connection_errors() -> tuple:
+    """
+    Summary:
+        The connection errors of http clients, the clients are imported by
+        the commands on demand, so only the imported ones can raise.
+    return:
+        - tuple: the exception classes.
+    """
+    errors = []
+    if 'requests' in sys.modules:
+        errors.append(sys.modules['requests'].exceptions.ConnectionError)
+    if 'httpx' in sys.modules:
+        errors.append(sys.modules['httpx'].ConnectError)
+    return tuple(errors)
+
+
+@click.command(cls=ComplexCLI, help=update_message)
 def cli():
     try:
         entry_point()
-    except requests.exceptions.ConnectionError:
+    except connection_errors():
         error_handler.SrvErrorHandler.customized_handle(error_handler.ECustomizedError.ERROR_CONNECTION, True)
     except Exception as e:
         error_handler.SrvErrorHandler.default_handle(e, True)
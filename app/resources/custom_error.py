@@ -69,6 +69,7 @@ class Error:
             'Please to double check the file content.'
         ),
         'UNSUPPORT_TAG_MANIFEST': 'Tagging and manifest attaching are not supported for folder type.',
+        'ZSTD_UNAVAILABLE': 'The tar.zst format requires the zstandard package. Please install it or use zip.',
         'INVALID_INPUT': 'Invalid input. Please try again.',
         'UNSUPPORTED_PROJECT': 'This function is not supported in the given Project %s',
         'CREATE_FOLDER_IF_NOT_EXIST': 'Target folder does not exist. Would you like to create a new folder?',
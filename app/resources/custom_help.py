@@ -40,6 +40,9 @@ class HelpPage:
             'FILE_SYNC_ZIP': 'Download files as a zip.',
             'FILE_SYNC_I': 'Enable downloading by geid.',
             'FILE_SYNC_Z': 'Target Zone (i.e., core/greenroom)',
+            'FILE_SYNC_PARALLEL': 'The number of files/folders to download at the same time.',
+            'FILE_SYNC_BANDWIDTH': 'The limit of total download bandwidth in MB/s, 0 means no limit.',
+            'FILE_NO_CACHE': 'Query the file/folder information from Platform instead of the local cache.',
             'FILE_UPLOAD_P': 'Project folder path starting from Project code. (i.e., indoctestproject/user/folder)',
             'FILE_UPLOAD_A': 'File Attribute Template used for annotating files during upload.',
             'FILE_UPLOAD_T': (
@@ -51,6 +54,13 @@ class HelpPage:
                 "The processed pipeline of your processed files. [only used with '--source' option]"
             ),
             'FILE_UPLOAD_ZIP': 'Upload folder as a compressed zip file.',
+            'FILE_UPLOAD_ZIP_LEVEL': (
+                'The compression level of --zip from 0(stored) to 9(smallest). '
+                'For tar.zst, 0 means the default level of zstd.'
+            ),
+            'FILE_UPLOAD_ZIP_FORMAT': (
+                'The archive format of --zip. tar.zst is faster but requires the zstandard package.'
+            ),
         },
         'config': {
             'SET_CONFIG': 'Chose config file and set for cli.',
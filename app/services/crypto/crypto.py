@@ -6,6 +6,7 @@
 
 import base64
 import os
+from functools import lru_cache
 
 from cryptography.fernet import Fernet
 from cryptography.hazmat.backends import default_backend
@@ -25,13 +26,14 @@ def generate_secret():
     return secret_token
 
 
-def encryption(message_to_encrypt, secret):
+@lru_cache(maxsize=8)
+def derive_key(secret):
     """
-    encrypt string message into byte
-    message_to_encrypt: a string that need to encrypt
-    secret: the secret key used to encrypt the string,
-    generated by generate_secret
-    return: encrypted string
+    derive the fernet key from the secret with PBKDF2. The derivation
+    is deliberately slow(100,000 iterations) so the result is cached
+    per process and keyed by the secret
+    secret: the string type secret key generated by generate_secret
+    return: urlsafe base64 encoded key for Fernet
     """
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
@@ -40,7 +42,18 @@ def encryption(message_to_encrypt, secret):
         iterations=100000,
         backend=default_backend(),
     )
-    key = base64.urlsafe_b64encode(kdf.derive(b'SECRETKEYPASSWORD'))
+    return base64.urlsafe_b64encode(kdf.derive(b'SECRETKEYPASSWORD'))
+
+
+def encryption(message_to_encrypt, secret):
+    """
+    encrypt string message into byte
+    message_to_encrypt: a string that need to encrypt
+    secret: the secret key used to encrypt the string,
+    generated by generate_secret
+    return: encrypted string
+    """
+    key = derive_key(secret)
     message_encode = message_to_encrypt.encode()
     f = Fernet(key)
     encrypt_message = f.encrypt(message_encode)
@@ -57,14 +70,7 @@ def decryption(encrypted_message, secret, interactive=True):
     """
     if encrypted_message:
         try:
-            kdf = PBKDF2HMAC(
-                algorithm=hashes.SHA256(),
-                length=32,
-                salt=base64.b64decode(secret),
-                iterations=100000,
-                backend=default_backend(),
-            )
-            key = base64.urlsafe_b64encode(kdf.derive(b'SECRETKEYPASSWORD'))
+            key = derive_key(secret)
             f = Fernet(key)
             decrypted = f.decrypt(base64.b64decode(encrypted_message))
             return decrypted.decode()
@@ -6,7 +6,6 @@
 
 import datetime as dt
 import os
-import time
 from typing import Any
 
 import requests
@@ -17,6 +16,10 @@ from app.configs.app_config import AppConfig
 from app.configs.user_config import UserConfig
 from app.models.service_meta_class import MetaService
 from app.services.dataset_manager.model import EFileStatus
+from app.services.file_manager.file_download.download_sink import DownloadSink
+from app.services.file_manager.file_download.download_sink import ThrottledProgress
+from app.services.file_manager.file_download.preparation_waiter import PreparationWaiter
+from app.services.file_manager.file_download.segmented_download import download_in_ranges
 from app.services.output_manager.error_handler import ECustomizedError
 from app.services.output_manager.error_handler import SrvErrorHandler
 from app.services.output_manager.message_handler import SrvOutPutHandler
@@ -73,10 +76,14 @@ class SrvDatasetDownloadManager(metaclass=MetaService):
         return response.json()
 
     @require_valid_token()
-    def download_status(self, hash_code: str) -> EFileStatus:
+    def download_status(self, hash_code: str, wait: float = 0) -> EFileStatus:
         url = AppConfig.Connections.url_download_core + f'v1/download/status/{hash_code}'
         try:
-            response = requests.get(url)
+            # the server holds the request up to wait seconds if it supports long polling
+            if wait:
+                response = requests.get(url, params={'wait': wait}, timeout=wait + 10)
+            else:
+                response = requests.get(url)
             response.raise_for_status()
         except requests.HTTPError as e:
             response = e.response
@@ -87,37 +94,31 @@ class SrvDatasetDownloadManager(metaclass=MetaService):
         return EFileStatus(status)
 
     def check_download_preparing_status(self, hash_code: str) -> EFileStatus:
-        max_retries = 15
-        retries = 1
-        backoff = 1
-        start = time.monotonic()
-        while retries < max_retries:
-            status = self.download_status(hash_code)
-            if status not in [EFileStatus.RUNNING, EFileStatus.WAITING]:
-                return status
-
-            logger.info(f'Waiting for download preparation to complete. Try again in {backoff} second(s)...')
-            time.sleep(backoff)
-            retries += 1
-            backoff = min(backoff * 2, 5)
-
-        logger.error('Download preparation timed out.')
-        raise TimeoutError(f'Download preparation did not complete in {int(time.monotonic() - start)} seconds.')
+        waiter = PreparationWaiter(timeout=AppConfig.Env.dataset_prepare_timeout)
+        return waiter.wait(lambda wait: self.download_status(hash_code, wait), 'preparing download')
 
     @require_valid_token()
     def send_download_request(self):
-        filename = f'{self.dataset_code}'
+        # the part file is named without timestamp, so the next run can find
+        # and continue it. it is renamed to the timestamped name when completed
+        part_name = f'{self.dataset_code}'
         if self.version:
-            filename += f'_{self.version}'
-        filename += f'_{dt.datetime.now(tz=dt.timezone.utc).isoformat(sep="_")}.zip'
+            part_name += f'_{self.version}'
+        local_filename = self.output.rstrip('/') + '/' + part_name + '.zip'
+
+        filename = part_name + f'_{dt.datetime.now(tz=dt.timezone.utc).isoformat(sep="_")}.zip'
         output_path = self.avoid_duplicate_file_name(self.output.rstrip('/') + '/' + filename)
 
         logger.info('Start downloading...')
+        if download_in_ranges(self.download_url, local_filename, final_filename=output_path):
+            return output_path
+
+        part_filename = f'{local_filename}.part'
         with requests.get(self.download_url, stream=True, allow_redirects=True) as r:
             r.raise_for_status()
 
             total_size = int(r.headers.get('Content-length'))
-            with open(output_path, 'wb') as file, tqdm(
+            with open(part_filename, 'wb', buffering=0) as file, tqdm(
                 desc=f'Downloading {filename}',
                 unit='iB',
                 unit_scale=True,
@@ -125,9 +126,15 @@ class SrvDatasetDownloadManager(metaclass=MetaService):
                 unit_divisor=1024,
                 bar_format='{desc} |{bar:30} {percentage:3.0f}% {remaining}',
             ) as bar:
-                for data in r.iter_content(chunk_size=1024):
-                    size = file.write(data)
-                    bar.update(size)
+                progress = ThrottledProgress(bar)
+                sink = DownloadSink.to_file(file, progress.update)
+                # read into the buffer directly unless the content needs decoding
+                if r.headers.get('Content-Encoding', 'identity') == 'identity':
+                    sink.readfrom(r.raw)
+                else:
+                    sink.write_all(r.iter_content(chunk_size=AppConfig.Env.download_buffer_size))
+                progress.flush()
+        os.replace(part_filename, output_path)
         return output_path
 
     def avoid_duplicate_file_name(self, filename):
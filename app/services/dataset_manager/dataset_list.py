@@ -30,7 +30,7 @@ class SrvDatasetListManager(metaclass=MetaService):
         if filter_by_creator:
             params['creator'] = self.user.username
         try:
-            response = resilient_session().get(url, headers=headers, params=params)
+            response = resilient_session(url).get(url, headers=headers, params=params)
             if response.status_code == 200:
                 res_to_dict = response.json()['result']
                 if self.interactive:
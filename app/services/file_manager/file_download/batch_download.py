@@ -0,0 +1,131 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import asyncio
+import concurrent.futures
+from typing import Any
+
+from tqdm import tqdm
+
+import app.services.logger_services.log_functions as logger
+import app.services.output_manager.message_handler as mhandler
+from app.configs.app_config import AppConfig
+from app.services.file_manager.file_download.download_client import SrvFileDownload
+from app.services.file_manager.file_download.download_sink import BandwidthLimiter
+from app.services.file_manager.file_download.download_sink import ThrottledProgress
+from app.utils.transfer_engine import TransferEngine
+
+
+def item_label(item: dict[str, Any]) -> str:
+    return item.get('result', {}).get('name') or item.get('geid')
+
+
+def download_item(
+    output_path: str, item: dict[str, Any], zone: str, progress: ThrottledProgress, limiter: BandwidthLimiter
+) -> str:
+    """Download one item with its own download client, return the saved filename or None if failed."""
+    srv_download = SrvFileDownload(zone, interactive=False)
+    srv_download.progress = progress
+    srv_download.bandwidth_limiter = limiter
+    return srv_download.simple_download_file(output_path, [item])
+
+
+async def download_items_async(
+    output_path: str,
+    item_res: list[dict[str, Any]],
+    zone: str,
+    num_of_parallel: int,
+    progress: ThrottledProgress,
+    limiter: BandwidthLimiter = None,
+) -> list[tuple[str, str]]:
+    """The coroutine to download the items in transfer engine, at most `num_of_parallel` at same time."""
+    semaphore = asyncio.Semaphore(num_of_parallel)
+    results = []
+
+    async def download(item: dict[str, Any]) -> None:
+        label = item_label(item)
+        async with semaphore:
+            srv_download = SrvFileDownload(zone, interactive=False)
+            srv_download.progress = progress
+            srv_download.bandwidth_limiter = limiter
+            try:
+                results.append((label, await srv_download.simple_download_file_async(output_path, [item])))
+            except (Exception, SystemExit) as e:
+                logger.error(f'Error downloading {label}: {e}')
+                results.append((label, None))
+
+    await asyncio.gather(*[download(item) for item in item_res])
+    return results
+
+
+def download_items_in_parallel(
+    output_path: str,
+    item_res: list[dict[str, Any]],
+    zone: str,
+    num_of_parallel: int,
+    limiter: BandwidthLimiter = None,
+) -> list[tuple[str, str]]:
+    """
+    Summary:
+        The function is to download the items with at most `num_of_parallel`
+        items in progress. The preparation polling of one item overlaps
+        with the transfer of others. All the transfers share one progress
+        bar and the bandwidth limiter. The failure of an item does not stop
+        the others, the result of each item is printed at the end.
+    Parameter:
+        - output_path(str): the local folder to save.
+        - item_res(list of dict): the items to download, from search_item
+            or get_file_info_by_geid.
+        - zone(str): the zone of items.
+        - num_of_parallel(int): the number of items in progress at same time.
+        - limiter(BandwidthLimiter): optional, the cap of total bandwidth.
+    return:
+        - list of tuple: the label and the saved filename of each item. the
+            filename is None if the item failed.
+    """
+    with tqdm(
+        desc=f'Downloading {len(item_res)} items',
+        total=0,
+        unit='iB',
+        unit_scale=True,
+        unit_divisor=1024,
+        bar_format='{desc} |{bar:30} {percentage:3.0f}% {n_fmt}/{total_fmt} {rate_fmt}',
+    ) as bar:
+        progress = ThrottledProgress(bar)
+        if AppConfig.Env.download_async:
+            results = TransferEngine().run(
+                download_items_async(output_path, item_res, zone, num_of_parallel, progress, limiter)
+            )
+        else:
+            results = download_items_in_threads(output_path, item_res, zone, num_of_parallel, progress, limiter)
+        progress.flush()
+
+    mhandler.SrvOutPutHandler.download_summary(results)
+    return results
+
+
+def download_items_in_threads(
+    output_path: str,
+    item_res: list[dict[str, Any]],
+    zone: str,
+    num_of_parallel: int,
+    progress: ThrottledProgress,
+    limiter: BandwidthLimiter = None,
+) -> list[tuple[str, str]]:
+    """Download the items in a thread pool of `num_of_parallel` workers."""
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_of_parallel) as executor:
+        futures = {
+            executor.submit(download_item, output_path, item, zone, progress, limiter): item for item in item_res
+        }
+        for future in concurrent.futures.as_completed(futures):
+            label = item_label(futures[future])
+            try:
+                results.append((label, future.result()))
+            except (Exception, SystemExit) as e:
+                logger.error(f'Error downloading {label}: {e}')
+                results.append((label, None))
+    return results
@@ -4,14 +4,12 @@
 # Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
 # You may not use this file except in compliance with the License.
 
-import concurrent.futures
+import asyncio
 import os
-import time
+from functools import partial
 
 import click
-import httpx
 import jwt
-from tqdm import tqdm
 
 import app.services.logger_services.log_functions as logger
 import app.services.output_manager.message_handler as mhandler
@@ -21,9 +19,15 @@ from app.models.service_meta_class import MetaService
 from app.services.output_manager.error_handler import ECustomizedError
 from app.services.output_manager.error_handler import SrvErrorHandler
 from app.services.user_authentication.decorator import require_valid_token
+from app.services.user_authentication.token_provider import TokenProvider
 from app.utils.aggregated import resilient_session
+from app.utils.transfer_engine import TransferEngine
 
+from .download_sink import DownloadSink
+from .download_sink import progress_bar
 from .model import EFileStatus
+from .preparation_waiter import PreparationWaiter
+from .segmented_download import download_in_ranges
 
 
 class SrvFileDownload(metaclass=MetaService):
@@ -37,22 +41,12 @@ class SrvFileDownload(metaclass=MetaService):
         self.total_size = ''
         self.interactive = interactive
         self.url = ''
-        self.check_point = False
         self.core = self.appconfig.Env.core_zone
         self.green = self.appconfig.Env.green_zone
         self.zone = zone
-
-    def print_prepare_msg(self, message):
-        space_width = len(message)
-        finished_msg = message.replace('ing', 'ed')
-        while True:
-            if self.check_point:
-                click.secho(f"{finished_msg}{' '*space_width}\r", fg='white', nl=False)
-                break
-            click.secho(f"{message}{' '*space_width}\r", fg='white', nl=False)
-            for i in range(5):
-                time.sleep(1)
-                click.secho(f"{message}{'.'*i}\r", fg='white', nl=False)
+        # the shared progress and bandwidth cap when downloading items in parallel
+        self.progress = None
+        self.bandwidth_limiter = None
 
     def get_download_url(self, zone):
         if zone == 'greenroom':
@@ -63,12 +57,21 @@ class SrvFileDownload(metaclass=MetaService):
 
     def pre_download(self):
         pre_status, file_path = self.prepare_download()
-
-        self.check_point = False
         return pre_status, file_path
 
     @require_valid_token()
     def prepare_download(self):
+        request = self.prepare_request()
+        res = resilient_session(request['url']).post(**request)
+        return self.handle_prepare_response(res)
+
+    @require_valid_token()
+    async def prepare_download_async(self):
+        request = self.prepare_request()
+        res = await TransferEngine().request('POST', request_class='status', **request)
+        return self.handle_prepare_response(res)
+
+    def prepare_request(self):
         files = []
         for f in self.file_geid:
             files.append({'id': f})
@@ -80,14 +83,15 @@ class SrvFileDownload(metaclass=MetaService):
             'container_type': 'project',
         }
         headers = {
-            'Authorization': 'Bearer ' + self.user.access_token,
+            'Authorization': TokenProvider().bearer(),
             'Refresh-token': self.user.refresh_token,
             'Session-ID': self.session_id,
         }
         url = self.appconfig.Connections.url_v2_download_pre % (self.project_code)
-        res = resilient_session().post(url, headers=headers, json=payload)
+        return {'url': url, 'headers': headers, 'json': payload}
+
+    def handle_prepare_response(self, res):
         res_json = res.json().get('result')
-        self.check_point = True
 
         if res.status_code == 200:
             self.hash_code = res_json.get('payload', {}).get('hash_code')
@@ -104,9 +108,25 @@ class SrvFileDownload(metaclass=MetaService):
         return pre_status, file_path
 
     @require_valid_token()
-    def download_status(self):
+    def download_status(self, wait: float = 0):
+        request = self.status_request(wait)
+        res = resilient_session(request['url']).get(**request)
+        return self.handle_status_response(res)
+
+    @require_valid_token()
+    async def download_status_async(self, wait: float = 0):
+        request = self.status_request(wait)
+        res = await TransferEngine().request('GET', request_class='status', **request)
+        return self.handle_status_response(res)
+
+    def status_request(self, wait: float = 0):
         url = self.url + f'v1/download/status/{self.hash_code}'
-        res = resilient_session().get(url)
+        if wait:
+            # the server holds the request up to wait seconds if it supports long polling
+            return {'url': url, 'params': {'wait': wait}, 'timeout': wait + 10}
+        return {'url': url}
+
+    def handle_status_response(self, res):
         res_json = res.json().get('result')
         if res.status_code == 200:
             status = EFileStatus(res_json.get('status'))
@@ -134,60 +154,96 @@ class SrvFileDownload(metaclass=MetaService):
                     break
         return filename
 
-    def get_download_preparing_status(self):
-        while True:
-            time.sleep(1)
-            status = self.download_status()
-            if status == EFileStatus.SUCCEED:
-                self.check_point = True
-                break
-            elif status == EFileStatus.FAILED:
-                self.check_point = True
-                SrvErrorHandler.customized_handle(ECustomizedError.DOWNLOAD_FAIL, self.interactive)
+    def check_download_preparing_status(self):
+        # the items downloaded in parallel share one progress instead of spinners
+        message = 'checking status' if self.progress is None else None
+        status = PreparationWaiter().wait(self.download_status, message)
+        if status == EFileStatus.FAILED:
+            SrvErrorHandler.customized_handle(ECustomizedError.DOWNLOAD_FAIL, self.interactive)
         return status
 
-    def check_download_preparing_status(self):
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-            f1 = executor.submit(self.print_prepare_msg, 'checking status')
-            f2 = executor.submit(self.get_download_preparing_status)
-            for _ in concurrent.futures.wait([f1, f2], return_when='FIRST_COMPLETED'):
-                status = f2.result()
+    async def check_download_preparing_status_async(self):
+        status = await PreparationWaiter().wait_async(self.download_status_async)
+        if status == EFileStatus.FAILED:
+            SrvErrorHandler.customized_handle(ECustomizedError.DOWNLOAD_FAIL, self.interactive)
         return status
 
+    def split_in_ranges(self) -> bool:
+        """The file is downloaded in ranges unless it is known to be smaller than a segment, which skips the probe."""
+        return not self.total_size or self.total_size >= AppConfig.Env.download_segment_min_size
+
     @require_valid_token()
     def download_file(self, url, local_filename, download_mode='single'):
         logger.info('start downloading...')
         filename = local_filename.split('/')[-1]
         try:
-            with httpx.stream('GET', url) as r:
+            # continue the partial file of previous run if server supports ranges
+            if self.split_in_ranges() and download_in_ranges(
+                url, local_filename, progress=self.progress, limiter=self.bandwidth_limiter
+            ):
+                logger.info('Download complete')
+                return local_filename
+
+            # the file is only visible once it is completed
+            part_filename = f'{local_filename}.part'
+            with resilient_session(url).stream('GET', url) as r:
                 r.raise_for_status()
                 if r.headers.get('Content-Type') == 'application/zip' or download_mode == 'batch':
                     size = r.headers.get('Content-length')
                     self.total_size = int(size) if size else self.total_size
-                if self.total_size:
-                    with open(local_filename, 'wb') as file, tqdm(
-                        desc=f'Downloading {filename}',
-                        total=self.total_size,
-                        unit='iB',
-                        unit_scale=True,
-                        unit_divisor=1024,
-                        bar_format='{desc} |{bar:30} {percentage:3.0f}% {remaining}',
-                    ) as bar:
-                        for data in r.iter_bytes(chunk_size=1024):
-                            size = file.write(data)
-                            bar.update(size)
+                # the data is written once per buffer, so the file is not buffered again
+                if self.total_size or self.progress is not None:
+                    with open(part_filename, 'wb', buffering=0) as file, progress_bar(
+                        f'Downloading {filename}', self.total_size or 0, shared=self.progress
+                    ) as progress:
+                        sink = DownloadSink.to_file(file, progress.update, limiter=self.bandwidth_limiter)
+                        sink.write_all(r.iter_bytes())
                 else:
-                    with open(local_filename, 'wb') as file:
-                        part = 0
-                        for data in r.iter_bytes(chunk_size=1024):
-                            size = file.write(data)
-                            progress = '.' * part
-                            click.echo(f'Downloading{progress}\r', nl=False)
-                            if part > 5:
-                                part = 0
-                            else:
-                                part += 1
+                    with open(part_filename, 'wb', buffering=0) as file:
+                        part = [0]
+
+                        def print_progress(_):
+                            click.echo(f"Downloading{'.' * part[0]}\r", nl=False)
+                            part[0] = 0 if part[0] > 5 else part[0] + 1
+
+                        sink = DownloadSink.to_file(file, print_progress, limiter=self.bandwidth_limiter)
+                        sink.write_all(r.iter_bytes())
                         logger.info('Download complete')
+            os.replace(part_filename, local_filename)
+        except Exception as e:
+            logger.error(f'Error downloading: {e}')
+        return local_filename
+
+    async def download_file_async(self, url, local_filename):
+        """
+        Summary:
+            The coroutine of download_file for the presigned file. The file
+            smaller than `download_segment_min_size` is streamed in transfer
+            engine, the larger one is downloaded in ranges by download_file
+            in the default executor, where the segments are threads anyway.
+        """
+        if self.split_in_ranges():
+            return await asyncio.get_running_loop().run_in_executor(None, self.download_file, url, local_filename)
+
+        logger.info('start downloading...')
+        filename = local_filename.split('/')[-1]
+        part_filename = f'{local_filename}.part'
+        loop = asyncio.get_running_loop()
+        try:
+            async with TransferEngine().stream('GET', url) as r:
+                r.raise_for_status()
+                # the file is written in the default executor, not to block the loop
+                file = await loop.run_in_executor(None, partial(open, part_filename, 'wb', buffering=0))
+                try:
+                    with progress_bar(f'Downloading {filename}', self.total_size, shared=self.progress) as progress:
+                        sink = DownloadSink.to_file(file, progress.update, limiter=self.bandwidth_limiter)
+                        async for data in r.aiter_bytes():
+                            await sink.write_async(data)
+                        await sink.flush_async()
+                finally:
+                    await loop.run_in_executor(None, file.close)
+            await loop.run_in_executor(None, os.replace, part_filename, local_filename)
+            logger.info('Download complete')
         except Exception as e:
             logger.error(f'Error downloading: {e}')
         return local_filename
@@ -254,10 +310,11 @@ class SrvFileDownload(metaclass=MetaService):
 
     @require_valid_token()
     def simple_download_file(self, output_path, item_res):
-        click.secho('preparing\r', fg='white', nl=False)
+        if self.progress is None:
+            click.secho('preparing\r', fg='white', nl=False)
         presigned_task, filename = self.handle_geid_downloading(item_res)
         if not filename:
-            return
+            return None
 
         # genereate download url for presigned or zip download
         pre_status, zip_file_path = self.pre_download()
@@ -276,8 +333,43 @@ class SrvFileDownload(metaclass=MetaService):
 
         if os.path.isfile(saved_filename):
             mhandler.SrvOutPutHandler.download_success(saved_filename)
+            return saved_filename
+        else:
+            SrvErrorHandler.customized_handle(ECustomizedError.DOWNLOAD_FAIL, self.interactive)
+            return None
+
+    async def simple_download_file_async(self, output_path, item_res):
+        """The coroutine of simple_download_file, the status is polled in transfer engine."""
+        presigned_task, filename = self.handle_geid_downloading(item_res)
+        if not filename:
+            return None
+
+        pre_status, zip_file_path = await self.prepare_download_async()
+        if pre_status == EFileStatus.WAITING and not presigned_task:
+            filename = zip_file_path.split('/')[-1]
+        if presigned_task:
+            download_url = zip_file_path
+        else:
+            status = await self.check_download_preparing_status_async()
+            mhandler.SrvOutPutHandler.download_status(status)
+            download_url = self.generate_download_url()
+
+        output_filename = output_path.rstrip('/') + '/' + filename
+        local_filename = self.avoid_duplicate_file_name(output_filename)
+        if presigned_task:
+            saved_filename = await self.download_file_async(download_url, local_filename)
+        else:
+            # the size of zip is unknown, it is downloaded by the sync path
+            saved_filename = await asyncio.get_running_loop().run_in_executor(
+                None, self.download_file, download_url, local_filename
+            )
+
+        if os.path.isfile(saved_filename):
+            mhandler.SrvOutPutHandler.download_success(saved_filename)
+            return saved_filename
         else:
             SrvErrorHandler.customized_handle(ECustomizedError.DOWNLOAD_FAIL, self.interactive)
+            return None
 
     @require_valid_token()
     def batch_download_file(self, output_path, item_res):
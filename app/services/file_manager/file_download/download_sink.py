@@ -0,0 +1,220 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any
+from typing import BinaryIO
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+
+from tqdm import tqdm
+
+from app.configs.app_config import AppConfig
+
+
+class ThrottledProgress:
+    """
+    Summary:
+        The progress bar wrapper which is updated at most once every
+        `download_progress_interval` seconds, the bytes in between are
+        accumulated. It is thread safe, so the segments can share it.
+    """
+
+    def __init__(self, bar: Any, interval: float = None):
+        self.bar = bar
+        self.interval = AppConfig.Env.download_progress_interval if interval is None else interval
+        self.pending = 0
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, size: int) -> None:
+        with self.lock:
+            self.pending += size
+            now = time.monotonic()
+            if now - self.last_update < self.interval:
+                return
+            self.bar.update(self.pending)
+            self.pending = 0
+            self.last_update = now
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.pending:
+                self.bar.update(self.pending)
+                self.pending = 0
+
+    def add_total(self, size: int) -> None:
+        """Extend the total of bar by the size of a download that joins it."""
+        with self.lock:
+            self.bar.total = (self.bar.total or 0) + size
+            self.bar.refresh()
+
+
+class BandwidthLimiter:
+    """
+    Summary:
+        The token bucket shared by the downloads of a command to cap the
+        total bandwidth. The bucket holds at most one second of bytes.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, size: int) -> float:
+        """Take the bytes from bucket, return the seconds to wait until they are refilled."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= size
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def consume(self, size: int) -> None:
+        """Take the bytes from bucket, wait until they are refilled if bucket is short."""
+        wait = self.reserve(size)
+        if wait:
+            time.sleep(wait)
+
+
+@contextmanager
+def progress_bar(desc: str, total: int, initial: int = 0, shared: ThrottledProgress = None) -> Iterator[Any]:
+    """
+    Summary:
+        The function is to create the progress of a download. If the shared
+        progress of batch is given, the download is added to it instead.
+    Parameter:
+        - desc(str): the description of bar.
+        - total(int): the size of download.
+        - initial(int): the bytes downloaded by previous run.
+        - shared(ThrottledProgress): optional, the progress of batch.
+    return:
+        - ThrottledProgress: the progress to update.
+    """
+    if shared is not None:
+        shared.add_total(total - initial)
+        yield shared
+        return
+
+    with tqdm(
+        desc=desc,
+        total=total,
+        initial=initial,
+        unit='iB',
+        unit_scale=True,
+        unit_divisor=1024,
+        bar_format='{desc} |{bar:30} {percentage:3.0f}% {remaining}',
+    ) as bar:
+        progress = ThrottledProgress(bar)
+        yield progress
+        progress.flush()
+
+
+class DownloadSink:
+    """
+    Summary:
+        The buffered writer of download. The data from network is copied
+        into a reusable buffer of `download_buffer_size`, and written once
+        the buffer is full. So there is one write and at most one progress
+        update per buffer instead of per network chunk.
+         - write: to consume the chunks from an iterator of response.
+         - readfrom: to read directly into the buffer from a raw stream
+           with `readinto`, without creating the chunk objects.
+        With the bandwidth limiter, the reading is paused after each
+        buffer until the limiter allows, which slows down the sender by
+        TCP flow control.
+        In the coroutines of transfer engine, write_async and flush_async
+        write the buffer in the default executor and wait the limiter by
+        asyncio.sleep, so the loop is never blocked.
+    """
+
+    def __init__(
+        self,
+        writer: Callable[[memoryview], Any],
+        on_progress: Callable[[int], None] = None,
+        buffer_size: int = None,
+        limiter: BandwidthLimiter = None,
+    ):
+        self.writer = writer
+        self.on_progress = on_progress
+        self.limiter = limiter
+        self.buffer = bytearray(buffer_size or AppConfig.Env.download_buffer_size)
+        self.view = memoryview(self.buffer)
+        self.filled = 0
+
+    @classmethod
+    def to_file(
+        cls,
+        file: BinaryIO,
+        on_progress: Callable[[int], None] = None,
+        buffer_size: int = None,
+        limiter: BandwidthLimiter = None,
+    ) -> 'DownloadSink':
+        return cls(file.write, on_progress, buffer_size, limiter)
+
+    def write(self, data: bytes) -> None:
+        data = memoryview(data)
+        while data:
+            size = min(len(data), len(self.buffer) - self.filled)
+            self.view[self.filled : self.filled + size] = data[:size]
+            self.filled += size
+            data = data[size:]
+            if self.filled == len(self.buffer):
+                self.flush()
+
+    def write_all(self, chunks: Iterable[bytes]) -> None:
+        for data in chunks:
+            self.write(data)
+        self.flush()
+
+    def readfrom(self, raw: BinaryIO) -> None:
+        """Read the raw stream into buffer until it is exhausted."""
+        while True:
+            size = raw.readinto(self.view[self.filled :])
+            if not size:
+                break
+            self.filled += size
+            if self.filled == len(self.buffer):
+                self.flush()
+        self.flush()
+
+    def flush(self) -> None:
+        size = self.write_buffer()
+        if self.limiter and size:
+            self.limiter.consume(size)
+
+    def write_buffer(self) -> int:
+        """Write the filled buffer and update the progress, return the size written."""
+        size = self.filled
+        data = self.view[:size]
+        while data:
+            written = self.writer(data)
+            data = data[written:] if written is not None else data[len(data) :]
+        if self.on_progress and size:
+            self.on_progress(size)
+        self.filled = 0
+        return size
+
+    async def write_async(self, data: bytes) -> None:
+        data = memoryview(data)
+        while data:
+            size = min(len(data), len(self.buffer) - self.filled)
+            self.view[self.filled : self.filled + size] = data[:size]
+            self.filled += size
+            data = data[size:]
+            if self.filled == len(self.buffer):
+                await self.flush_async()
+
+    async def flush_async(self) -> None:
+        size = await asyncio.get_running_loop().run_in_executor(None, self.write_buffer)
+        if self.limiter and size:
+            await asyncio.sleep(self.limiter.reserve(size))
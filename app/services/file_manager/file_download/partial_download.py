@@ -0,0 +1,137 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import json
+import os
+import threading
+
+import app.services.logger_services.log_functions as logger
+
+
+def merge_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """Merge the overlapping or adjacent byte ranges(inclusive), sorted by first byte."""
+    merged = []
+    for first_byte, last_byte in sorted(ranges):
+        if merged and first_byte <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last_byte))
+        else:
+            merged.append((first_byte, last_byte))
+    return merged
+
+
+class PartialDownload:
+    """
+    Summary:
+        The unfinished download saved as `<local_filename>.part`, with a
+        sidecar journal `<local_filename>.part.journal` of the completed
+        byte ranges. The first line of journal is the source of content
+        (the ETag or the hash code of download) and the total size, the
+        other lines are the completed ranges, each appended by a single
+        write. If the source is changed, the partial file is discarded.
+        The file is renamed to local filename once it is completed.
+    """
+
+    def __init__(self, local_filename: str):
+        self.local_filename = local_filename
+        self.part_path = f'{local_filename}.part'
+        self.journal_path = f'{self.part_path}.journal'
+        self.lock = threading.Lock()
+        self.journal_fd = None
+        self.completed = []
+
+    def load(self, source: str, total_size: int) -> list[tuple[int, int]]:
+        """
+        Summary:
+            The function is to read the completed ranges of previous run.
+            The journal is restarted if it is from other source.
+        Parameter:
+            - source(str): the ETag or hash code of content. None if
+                unknown, the download is not resumable.
+            - total_size(int): the size of content.
+        return:
+            - list of tuple: the completed byte ranges.
+        """
+        header = {'source': source, 'total_size': total_size}
+        completed = []
+        try:
+            with open(self.journal_path, 'rb') as f:
+                lines = f.read().splitlines()
+            if source and lines and json.loads(lines[0]) == header and os.path.isfile(self.part_path):
+                for line in lines[1:]:
+                    try:
+                        completed.append(tuple(json.loads(line)['range']))
+                    except (ValueError, KeyError, TypeError):
+                        # the last line may be partially written when killed
+                        continue
+        except (OSError, ValueError):
+            pass
+
+        self.completed = merge_ranges(completed)
+        if self.completed:
+            logger.info(f'Resume {self.part_path} from {self.completed_size} bytes')
+        else:
+            self.reset()
+            self.append(header)
+        return self.completed
+
+    @property
+    def completed_size(self) -> int:
+        return sum(last_byte - first_byte + 1 for first_byte, last_byte in self.completed)
+
+    def append(self, record: dict) -> None:
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        with self.lock:
+            if self.journal_fd is None:
+                self.journal_fd = os.open(self.journal_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            os.write(self.journal_fd, line)
+
+    def record(self, first_byte: int, last_byte: int) -> None:
+        """Record the byte range(inclusive) which has been written into part file."""
+        if last_byte >= first_byte:
+            self.append({'range': [first_byte, last_byte]})
+
+    def open(self, total_size: int) -> int:
+        """Open the part file for writing by offset, the content of previous run is kept."""
+        fd = os.open(self.part_path, os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        if os.fstat(fd).st_size != total_size:
+            if hasattr(os, 'posix_fallocate') and total_size:
+                try:
+                    os.posix_fallocate(fd, 0, total_size)
+                except OSError:
+                    # the file system may not support it, the size is still set below
+                    pass
+            os.ftruncate(fd, total_size)
+        return fd
+
+    def complete(self, final_filename: str = None) -> str:
+        """
+        Summary:
+            The function is to rename the part file and remove the journal.
+        Parameter:
+            - final_filename(str): optional, the name to save, default is
+                the local filename.
+        return:
+            - str: the saved filename.
+        """
+        final_filename = final_filename or self.local_filename
+        self.close()
+        os.replace(self.part_path, final_filename)
+        os.remove(self.journal_path)
+        return final_filename
+
+    def reset(self) -> None:
+        """Remove the part file and journal of previous run."""
+        self.close()
+        for path in [self.part_path, self.journal_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        self.completed = []
+
+    def close(self) -> None:
+        with self.lock:
+            if self.journal_fd is not None:
+                os.close(self.journal_fd)
+                self.journal_fd = None
@@ -0,0 +1,130 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import asyncio
+import contextlib
+import threading
+import time
+from enum import Enum
+from typing import Awaitable
+from typing import Callable
+
+import click
+
+import app.services.logger_services.log_functions as logger
+from app.configs.app_config import AppConfig
+
+PENDING_STATUSES = ['WAITING', 'RUNNING']
+
+
+class Spinner:
+    """
+    Summary:
+        The message animated by a daemon thread while waiting. The thread
+        waits on an event between the frames, so the spinner stops as soon
+        as the waiting is done instead of at the end of a frame. With the
+        timeout, the seconds waited are shown against it.
+    """
+
+    def __init__(self, message: str, interval: float = 0.2, timeout: float = None):
+        self.message = message
+        self.interval = interval
+        self.timeout = timeout
+        self.start = time.monotonic()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self) -> None:
+        frame = 0
+        while not self.stopped.wait(self.interval):
+            click.secho(f"{self.message}{'.' * frame:<5}{self.elapsed()}\r", fg='white', nl=False)
+            frame = (frame + 1) % 6
+
+    def elapsed(self) -> str:
+        if self.timeout is None:
+            return ''
+        return f' {int(time.monotonic() - self.start)}s (at most {int(self.timeout)}s)'
+
+    def __enter__(self) -> 'Spinner':
+        self.start = time.monotonic()
+        click.secho(f'{self.message}\r', fg='white', nl=False)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stopped.set()
+        self.thread.join()
+        finished_message = self.message.replace('ing', 'ed')
+        click.secho(f"{finished_message}{' ' * (len(self.message) + len(self.elapsed()))}\r", fg='white', nl=False)
+
+
+class PreparationWaiter:
+    """
+    Summary:
+        The policy to wait for the download preparation on server, shared
+        by file and dataset download. The status is checked at once, then
+        with exponential backoff from `download_prepare_initial_delay` to
+        `download_prepare_max_delay`, so the small files are ready in tens
+        of milliseconds while the large zips are not polled too often.
+        With `download_prepare_long_poll`, the status request asks server
+        to hold it until the status changes, and the time held counts
+        toward the delay. The waiting fails after the timeout, which is
+        `download_prepare_timeout` by default, and the spinner shows the
+        seconds waited against it.
+    """
+
+    def __init__(
+        self, timeout: float = None, initial_delay: float = None, max_delay: float = None, long_poll: float = None
+    ):
+        self.timeout = AppConfig.Env.download_prepare_timeout if timeout is None else timeout
+        self.initial_delay = AppConfig.Env.download_prepare_initial_delay if initial_delay is None else initial_delay
+        self.max_delay = AppConfig.Env.download_prepare_max_delay if max_delay is None else max_delay
+        self.long_poll = AppConfig.Env.download_prepare_long_poll if long_poll is None else long_poll
+
+    def wait(self, check_status: Callable[[float], Enum], message: str = None) -> Enum:
+        """
+        Summary:
+            The function is to check the status until it is not pending.
+        Parameter:
+            - check_status(function): the status request, which takes the
+                seconds that server can hold it, 0 means return at once. It
+                can return None if the status is unknown this time.
+            - message(str): optional, the spinner message while waiting.
+        return:
+            - Enum: the final status eg. SUCCEED or FAILED.
+        """
+        start = time.monotonic()
+        delay = self.initial_delay
+        with Spinner(message, timeout=self.timeout) if message else contextlib.nullcontext():
+            while True:
+                checked = time.monotonic()
+                status = check_status(self.long_poll)
+                if status is not None and status.name not in PENDING_STATUSES:
+                    return status
+
+                time.sleep(self.next_delay(start, checked, delay))
+                delay = min(delay * 2, self.max_delay)
+
+    async def wait_async(self, check_status: Callable[[float], Awaitable[Enum]]) -> Enum:
+        """The coroutine of wait, the status request is a coroutine as well."""
+        start = time.monotonic()
+        delay = self.initial_delay
+        while True:
+            checked = time.monotonic()
+            status = await check_status(self.long_poll)
+            if status is not None and status.name not in PENDING_STATUSES:
+                return status
+
+            await asyncio.sleep(self.next_delay(start, checked, delay))
+            delay = min(delay * 2, self.max_delay)
+
+    def next_delay(self, start: float, checked: float, delay: float) -> float:
+        """The seconds to sleep before next check, raise TimeoutError if the waiting is too long."""
+        now = time.monotonic()
+        if now - start >= self.timeout:
+            logger.error('Download preparation timed out.')
+            raise TimeoutError(f'Download preparation did not complete in {int(now - start)} seconds.')
+        return max(0, min(delay - (now - checked), start + self.timeout - now))
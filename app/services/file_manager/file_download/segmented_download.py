@@ -0,0 +1,259 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import concurrent.futures
+import math
+import os
+import re
+import threading
+from typing import Callable
+
+import httpx
+
+import app.services.logger_services.log_functions as logger
+from app.configs.app_config import AppConfig
+from app.services.file_manager.file_download.download_sink import BandwidthLimiter
+from app.services.file_manager.file_download.download_sink import DownloadSink
+from app.services.file_manager.file_download.download_sink import ThrottledProgress
+from app.services.file_manager.file_download.download_sink import progress_bar
+from app.services.file_manager.file_download.partial_download import PartialDownload
+from app.utils.aggregated import resilient_session
+
+CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)')
+
+
+class RangeNotSatisfied(Exception):
+    """The server answers the range request with full content or wrong range."""
+
+
+def segmented_download_available() -> bool:
+    """The segments are written by offset, which needs os.pwrite(not on windows)."""
+    return hasattr(os, 'pwrite')
+
+
+def probe_range_support(url: str) -> tuple[int, str]:
+    """
+    Summary:
+        The function is to check if the server supports range requests by
+        asking the first byte of object. The presigned url may only be
+        signed for GET, so HEAD is not used.
+    Parameter:
+        - url(str): the download url.
+    return:
+        - int: the total size of object. None if ranges are not supported.
+        - str: the ETag of object. None if server does not provide it.
+    """
+    with resilient_session(url).stream('GET', url, headers={'Range': 'bytes=0-0'}) as response:
+        matched = CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+        if response.status_code != 206 or not matched:
+            return None, None
+        return int(matched.group(3)), response.headers.get('ETag')
+
+
+def split_ranges(
+    total_size: int, num_of_segment: int, completed: list[tuple[int, int]] = None
+) -> list[tuple[int, int]]:
+    """
+    Summary:
+        The function is to split the missing bytes of object into ranges of
+        similar size. The segment is not smaller than `download_segment_min_size`.
+    Parameter:
+        - total_size(int): the size of object.
+        - num_of_segment(int): the number of segments expected.
+        - completed(list of tuple): optional, the sorted ranges already downloaded.
+    return:
+        - list of tuple: the first and last byte(inclusive) of each range.
+    """
+    missing = []
+    next_byte = 0
+    for first_byte, last_byte in (completed or []) + [(total_size, total_size)]:
+        if first_byte > next_byte:
+            missing.append((next_byte, first_byte - 1))
+        next_byte = max(next_byte, last_byte + 1)
+
+    missing_size = sum(last_byte - first_byte + 1 for first_byte, last_byte in missing)
+    segment_size = max(math.ceil(missing_size / max(num_of_segment, 1)), AppConfig.Env.download_segment_min_size)
+    return [
+        (start, min(start + segment_size - 1, last_byte))
+        for first_byte, last_byte in missing
+        for start in range(first_byte, last_byte + 1, segment_size)
+    ]
+
+
+def range_headers(first_byte: int, last_byte: int, etag: str = None) -> dict[str, str]:
+    """The headers to request the range, only from the object of etag if it is given."""
+    headers = {'Range': f'bytes={first_byte}-{last_byte}'}
+    if etag:
+        headers['If-Range'] = etag
+    return headers
+
+
+def check_range_response(response: httpx.Response, first_byte: int, last_byte: int) -> None:
+    """Raise RangeNotSatisfied if the server does not answer with the range, eg. the object is changed."""
+    matched = CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+    if response.status_code != 206 or not matched or int(matched.group(1)) != first_byte:
+        raise RangeNotSatisfied(f'bytes {first_byte}-{last_byte}: {response.status_code}')
+
+
+def download_range(
+    url: str,
+    fd: int,
+    first_byte: int,
+    last_byte: int,
+    etag: str,
+    partial: PartialDownload,
+    on_progress: Callable[[int], None],
+    stop: threading.Event,
+    limiter: BandwidthLimiter = None,
+) -> None:
+    """
+    Summary:
+        The function is to fetch one byte range and write it into the file
+        at its offset. The written bytes are recorded in the journal every
+        `download_journal_interval` bytes.
+    Parameter:
+        - url(str): the download url.
+        - fd(int): the file descriptor of preallocated file.
+        - first_byte(int): the first byte of range.
+        - last_byte(int): the last byte of range, inclusive.
+        - etag(str): the ETag of object, the range is only served from it.
+        - partial(PartialDownload): the partial download to record progress.
+        - on_progress(Callable): called with the number of bytes written.
+        - stop(threading.Event): set when other segment failed.
+        - limiter(BandwidthLimiter): optional, the cap of total bandwidth.
+    """
+    if stop.is_set():
+        return
+
+    headers = range_headers(first_byte, last_byte, etag)
+    offset = first_byte
+    recorded = first_byte
+
+    def write(data: memoryview) -> int:
+        nonlocal offset
+        written = os.pwrite(fd, data, offset)
+        offset += written
+        return written
+
+    buffer_size = min(AppConfig.Env.download_buffer_size, last_byte - first_byte + 1)
+    sink = DownloadSink(write, on_progress, buffer_size, limiter)
+    try:
+        with resilient_session(url).stream('GET', url, headers=headers) as response:
+            check_range_response(response, first_byte, last_byte)
+            for data in response.iter_bytes():
+                if stop.is_set():
+                    break
+                sink.write(data)
+                if offset - recorded >= AppConfig.Env.download_journal_interval:
+                    partial.record(recorded, offset - 1)
+                    recorded = offset
+    finally:
+        # the received data in buffer is written before recording the range
+        sink.flush()
+        partial.record(recorded, min(offset, last_byte + 1) - 1)
+
+    if stop.is_set():
+        return
+    if offset != last_byte + 1:
+        raise RangeNotSatisfied(f'bytes {first_byte}-{last_byte}: received {offset - first_byte} bytes')
+
+
+def download_segments(
+    url: str,
+    partial: PartialDownload,
+    total_size: int,
+    etag: str,
+    num_of_segment: int,
+    on_progress: Callable[[int], None],
+    limiter: BandwidthLimiter = None,
+) -> None:
+    """
+    Summary:
+        The function is to download the missing ranges of object with
+        parallel range requests into the part file. Each segment is on its
+        own connection, so the throughput is not limited by a single TCP
+        stream.
+    Parameter:
+        - url(str): the download url.
+        - partial(PartialDownload): the loaded partial download.
+        - total_size(int): the size of object from probe_range_support.
+        - etag(str): the ETag of object from probe_range_support.
+        - num_of_segment(int): the number of parallel segments.
+        - on_progress(Callable): called with the number of bytes written, from
+            the segment threads.
+        - limiter(BandwidthLimiter): optional, the cap of total bandwidth.
+    """
+    ranges = split_ranges(total_size, num_of_segment, partial.completed)
+    if not ranges:
+        return
+
+    stop = threading.Event()
+    fd = partial.open(total_size)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(ranges), num_of_segment)) as executor:
+            futures = [
+                executor.submit(
+                    download_range, url, fd, first_byte, last_byte, etag, partial, on_progress, stop, limiter
+                )
+                for first_byte, last_byte in ranges
+            ]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            finally:
+                stop.set()
+    finally:
+        os.close(fd)
+
+
+def download_in_ranges(
+    url: str,
+    local_filename: str,
+    final_filename: str = None,
+    progress: ThrottledProgress = None,
+    limiter: BandwidthLimiter = None,
+) -> str:
+    """
+    Summary:
+        The function is to download the object by range requests into
+        `<local_filename>.part`. The ranges downloaded by previous run of
+        same source(the ETag, or the url without query) are not downloaded
+        again. The part file is kept if the download is interrupted.
+    Parameter:
+        - url(str): the download url.
+        - local_filename(str): the path of file to save.
+        - final_filename(str): optional, the name to save the completed file,
+            default is the local filename.
+        - progress(ThrottledProgress): optional, the shared progress of batch.
+        - limiter(BandwidthLimiter): optional, the cap of total bandwidth.
+    return:
+        - str: the saved filename. None if the server does not support range
+            requests, then the file should be downloaded by single stream.
+    """
+    if not segmented_download_available():
+        return None
+
+    total_size, etag = probe_range_support(url)
+    if not total_size:
+        return None
+
+    partial = PartialDownload(local_filename)
+    partial.load(etag or url.split('?')[0], total_size)
+    desc = f'Downloading {os.path.basename(final_filename or local_filename)}'
+    try:
+        with progress_bar(desc, total_size, partial.completed_size, progress) as item_progress:
+            try:
+                download_segments(
+                    url, partial, total_size, etag, AppConfig.Env.download_segments, item_progress.update, limiter
+                )
+            except RangeNotSatisfied as e:
+                logger.warning(f'Range request is not satisfied, download in single stream: {e}')
+                partial.reset()
+                return None
+    finally:
+        partial.close()
+
+    return partial.complete(final_filename)
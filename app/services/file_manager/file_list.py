@@ -5,7 +5,6 @@
 # You may not use this file except in compliance with the License.
 
 import click
-import questionary
 import requests
 
 import app.services.logger_services.log_functions as logger
@@ -67,6 +66,8 @@ class SrvFileList(metaclass=MetaService):
         logger.info(query_result)
 
     def list_files_with_pagination(self, paths, zone, page, page_size):
+        import questionary
+
         while True:
             files = self.list_files(paths, zone, page, page_size)
             if len(files) < page_size and page == 0:
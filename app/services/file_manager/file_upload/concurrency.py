@@ -0,0 +1,125 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import threading
+import time
+
+from app.configs.app_config import AppConfig
+
+
+class ChunkConcurrency:
+    """
+    Summary:
+        The limit of in-flight chunks. Each in-flight chunk holds at most
+        one chunk in memory, so the limit also bounds the memory used by
+        upload. When minimum and maximum are different, the limit is
+        adjusted by AIMD(additive increase, multiplicative decrease) with
+        the result of each chunk PUT:
+         - every round, which is `limit` finished chunks, the throughput
+           of round is measured. if it does not drop compared with the
+           best throughput so far, the limit grows by one.
+         - if any chunk in round is failed or retried by server error, or
+           the throughput drops, the limit is multiplied by the decrease
+           factor.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.inflight = 0
+        self.condition = threading.Condition()
+
+        # the statistics of current round
+        self.round_start = time.monotonic()
+        self.round_chunks = 0
+        self.round_bytes = 0
+        self.round_congested = False
+        self.best_throughput = 0
+        # the limits used, to report the concurrency in summary
+        self.history = [self.limit]
+
+    @classmethod
+    def from_thread(cls, num_of_thread: int | str) -> 'ChunkConcurrency':
+        """
+        Summary:
+            The function is to create the limit from `--thread` option.
+            `auto` means the limit is adjusted during upload.
+        Parameter:
+            - num_of_thread(int|str): the number of thread or `auto`.
+        return:
+            - ChunkConcurrency: the limit of in-flight chunks.
+        """
+        if num_of_thread == 'auto':
+            return cls(
+                AppConfig.Env.upload_thread_auto_initial,
+                AppConfig.Env.upload_thread_auto_min,
+                AppConfig.Env.upload_thread_auto_max,
+            )
+        return cls(num_of_thread, num_of_thread, num_of_thread)
+
+    @property
+    def adaptive(self) -> bool:
+        return self.minimum != self.maximum
+
+    def acquire(self) -> None:
+        """Wait until the number of in-flight chunks is below the limit."""
+        with self.condition:
+            while self.inflight >= self.limit:
+                self.condition.wait()
+            self.inflight += 1
+
+    def release(self) -> None:
+        with self.condition:
+            self.inflight -= 1
+            self.condition.notify_all()
+
+    def record(self, size: int, congested: bool = False) -> None:
+        """
+        Summary:
+            The function is to record the result of a chunk PUT and adjust
+            the limit at the end of round.
+        Parameter:
+            - size(int): the bytes of chunk uploaded. 0 if it failed.
+            - congested(bool): if the chunk failed or was retried by server error.
+        """
+        if not self.adaptive:
+            return
+
+        with self.condition:
+            self.round_chunks += 1
+            self.round_bytes += size
+            self.round_congested = self.round_congested or congested
+            # react to the congestion right away instead of end of round
+            if not congested and self.round_chunks < self.limit:
+                return
+
+            now = time.monotonic()
+            throughput = self.round_bytes / max(now - self.round_start, 1e-6)
+            dropped = throughput < self.best_throughput * (1 - AppConfig.Env.upload_thread_auto_tolerance)
+            if self.round_congested or dropped:
+                limit = max(self.minimum, int(self.limit * AppConfig.Env.upload_thread_auto_decrease))
+                # the best throughput of larger limit is not comparable any more
+                self.best_throughput = throughput
+            else:
+                limit = min(self.maximum, self.limit + 1)
+                self.best_throughput = max(self.best_throughput, throughput)
+
+            if limit != self.limit:
+                self.limit = limit
+                self.history.append(limit)
+                self.condition.notify_all()
+
+            self.round_start = now
+            self.round_chunks = 0
+            self.round_bytes = 0
+            self.round_congested = False
+
+    def summary(self) -> str:
+        """The concurrency used by upload, eg. `4` or `auto, final 12 (range 2-16)`."""
+        if not self.adaptive:
+            return str(self.limit)
+        return f'auto, final {self.limit} (range {min(self.history)}-{max(self.history)})'
@@ -4,43 +4,55 @@
 # Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
 # You may not use this file except in compliance with the License.
 
-import math
+import concurrent.futures
 import os
 import time
-import zipfile
+from functools import partial
 from multiprocessing.pool import ThreadPool
 from typing import Any
+from typing import Iterator
 
 import click
 
 import app.services.logger_services.log_functions as logger
 import app.services.output_manager.message_handler as mhandler
 from app.configs.app_config import AppConfig
+from app.services.file_manager.file_upload.folder_zip import archive_name
+from app.services.file_manager.file_upload.folder_zip import folder_size
+from app.services.file_manager.file_upload.folder_zip import stream_folder_archive
+from app.services.file_manager.file_upload.folder_zip import write_folder_archive
+from app.services.file_manager.file_upload.manifest_journal import ManifestJournal
+from app.services.file_manager.file_upload.manifest_journal import file_mtime_ns
 from app.services.file_manager.file_upload.models import FileObject
 from app.services.file_manager.file_upload.models import ItemStatus
+from app.services.file_manager.file_upload.models import StreamFileObject
 from app.services.file_manager.file_upload.models import UploadType
 from app.services.file_manager.file_upload.upload_client import UploadClient
+from app.services.file_manager.path_resolver import PathResolver
 from app.services.output_manager.error_handler import ECustomizedError
 from app.services.output_manager.error_handler import SrvErrorHandler
 from app.services.output_manager.error_handler import customized_error_msg
 from app.utils.aggregated import get_file_in_folder
 from app.utils.aggregated import get_file_info_by_geid
-from app.utils.aggregated import search_item
 
 
-def compress_folder_to_zip(path):
-    path = path.rstrip('/').lstrip()
-    zipfile_path = path + '.zip'
+def compress_folder_to_zip(path: str, archive_format: str = 'zip', level: int = None) -> str:
+    """Compress the folder into the archive next to it, return the path of archive."""
+    zipfile_path = archive_name(path, archive_format)
     mhandler.SrvOutPutHandler.start_zipping_file()
-    zipf = zipfile.ZipFile(zipfile_path, 'w', zipfile.ZIP_DEFLATED)
-    for root, _, files in os.walk(path):
-        for file in files:
-            zipf.write(os.path.join(root, file))
-    zipf.close()
+    with open(zipfile_path, 'wb') as file:
+        write_folder_archive(file, path, archive_format, level)
+    return zipfile_path
 
 
 def assemble_path(
-    f: str, target_folder: str, project_code: str, zone: str, zipping: bool = False
+    f: str,
+    target_folder: str,
+    project_code: str,
+    zone: str,
+    zipping: bool = False,
+    resolver: PathResolver = None,
+    archive_format: str = 'zip',
 ) -> tuple[str, dict, bool, str]:
     """
     Summary:
@@ -59,6 +71,9 @@ def assemble_path(
          - project_code(str): the unique identifier of project
          - zone(str): the zone label eg.greenroom/core
          - zipping(bool): default False. The flag to indicate if upload as a zip
+         - resolver(PathResolver): optional, the resolver shared by the files of
+            command, so the parent folders are searched only once.
+         - archive_format(str): default zip. The format of archive if zipping.
     Return:
          - current_file_path: the format file path on platform
          - parent_folder: the item information of longest parent folder
@@ -70,27 +85,30 @@ def assemble_path(
     current_file_path = target_folder + '/' + f.rstrip('/').split('/')[-1]
     result_file = current_file_path
     if zipping:
-        result_file = result_file + '.zip'
+        result_file = archive_name(result_file, archive_format)
 
+    # the name folder and all parent folders are searched together
     name_folder = target_folder.split('/')[0]
-    parent_folder = search_item(project_code, zone, name_folder, 'name_folder')
-    parent_folder = parent_folder.get('result')
+    folder_paths = []
+    if len(current_file_path.split('/')) > 2:
+        sub_path = target_folder.split('/')
+        folder_paths = ['/'.join(sub_path[0 : 2 + index]) for index in range(len(sub_path) - 1)]
+    resolver = resolver or PathResolver(zone)
+    name_folder_res, *folder_res = resolver.resolve_many(
+        [(project_code, name_folder, 'name_folder')] + [(project_code, path, 'folder') for path in folder_paths]
+    )
+    parent_folder = name_folder_res.get('result')
 
     current_folder_node = target_folder if os.path.isfile(f) else current_file_path
     create_folder_flag = False
-    if len(current_file_path.split('/')) > 2:
-        sub_path = target_folder.split('/')
-        for index in range(len(sub_path) - 1):
-            folder_path = '/'.join(sub_path[0 : 2 + index])
-            res = search_item(project_code, zone, folder_path, 'folder')
-
-            if not res.get('result'):
-                current_folder_node = folder_path
-                click.confirm(customized_error_msg(ECustomizedError.CREATE_FOLDER_IF_NOT_EXIST), abort=True)
-                create_folder_flag = True
-                break
-            else:
-                parent_folder = res.get('result')
+    for folder_path, res in zip(folder_paths, folder_res):
+        if not res.get('result'):
+            current_folder_node = folder_path
+            click.confirm(customized_error_msg(ECustomizedError.CREATE_FOLDER_IF_NOT_EXIST), abort=True)
+            create_folder_flag = True
+            break
+        else:
+            parent_folder = res.get('result')
 
     if not parent_folder:
         SrvErrorHandler.customized_handle(ECustomizedError.PERMISSION_DENIED, True)
@@ -98,9 +116,40 @@ def assemble_path(
     return current_folder_node, parent_folder, create_folder_flag, result_file
 
 
+def pre_upload_in_batches(
+    upload_client: UploadClient, file_objects: list[FileObject], output_path: str
+) -> Iterator[list[FileObject]]:
+    """
+    Summary:
+        Pre-upload the files in batches of `upload_batch_size`. The batches
+        are sent with `upload_pre_upload_workers` requests in parallel and
+        each batch is yielded as soon as it is pre-uploaded, so the caller
+        can stream its files while the rest are still in progress.
+    Parameters:
+        - upload_client: the upload client
+        - file_objects: the files to be pre-uploaded
+        - output_path: the output path of manifest
+    Return:
+        - the pre-uploaded files of each batch, in completion order
+    """
+    batch_size = AppConfig.Env.upload_batch_size
+    with concurrent.futures.ThreadPoolExecutor(max_workers=AppConfig.Env.upload_pre_upload_workers) as executor:
+        futures = [
+            executor.submit(upload_client.pre_upload, file_objects[start : start + batch_size], output_path)
+            for start in range(0, len(file_objects), batch_size)
+        ]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result() or []
+        finally:
+            # stop the pending batches if one of them failed
+            for future in futures:
+                future.cancel()
+
+
 def simple_upload(  # noqa: C901
     upload_event,
-    num_of_thread: int = 1,
+    num_of_thread: int | str = 1,
     output_path: str = None,
 ) -> list[str]:
     upload_start_time = time.time()
@@ -113,16 +162,24 @@ def simple_upload(  # noqa: C901
     parent_folder_id = upload_event.get('parent_folder_id', '')
     create_folder_flag = upload_event.get('create_folder_flag', False)
     compress_zip = upload_event.get('compress_zip', False)
+    compress_format = upload_event.get('compress_format', 'zip')
+    compress_level = upload_event.get('compress_level')
     regular_file = upload_event.get('regular_file', True)
     source_file = upload_event.get('valid_source')
     attribute = upload_event.get('attribute')
 
     mhandler.SrvOutPutHandler.start_uploading(input_path)
+    # the zip of folder is compressed while it is uploaded, the temporary
+    # zip next to folder is only created if streaming is disabled
+    zip_folder = None
     if os.path.isdir(input_path):
         job_type = UploadType.AS_FILE if compress_zip else UploadType.AS_FOLDER
         if job_type == UploadType.AS_FILE:
-            upload_file_path = [input_path.rstrip('/').lstrip() + '.zip']
-            compress_folder_to_zip(input_path)
+            upload_file_path = [archive_name(input_path, compress_format)]
+            if AppConfig.Env.upload_zip_stream:
+                zip_folder = input_path
+            else:
+                compress_folder_to_zip(input_path, compress_format, compress_level)
         elif tags or attribute:
             SrvErrorHandler.customized_handle(ECustomizedError.UNSUPPORT_TAG_MANIFEST, True)
         else:
@@ -136,6 +193,10 @@ def simple_upload(  # noqa: C901
         else:
             job_type = UploadType.AS_FILE
 
+    # the progress is appended to the journal next to manifest, and
+    # compacted into manifest when all the files are uploaded
+    journal = ManifestJournal(output_path)
+    journal.reset()
     upload_client = UploadClient(
         input_path=input_path,
         project_code=project_code,
@@ -146,6 +207,8 @@ def simple_upload(  # noqa: C901
         regular_file=regular_file,
         tags=tags,
         upload_message=upload_message,
+        num_of_thread=num_of_thread,
+        journal=journal,
     )
 
     file_objects = []
@@ -154,33 +217,34 @@ def simple_upload(  # noqa: C901
     for file in upload_file_path:
         file_path_sub = file.replace(input_path + '/', '') if input_path else file
         object_path = os.path.join(target_folder, file_path_sub)
-        file_objects.append(FileObject(object_path, file))
-
-    num_of_batchs = math.ceil(len(file_objects) / AppConfig.Env.upload_batch_size)
-    pre_upload_infos = []
-    for batch in range(0, num_of_batchs):
-        start_index = batch * AppConfig.Env.upload_batch_size
-        end_index = (batch + 1) * AppConfig.Env.upload_batch_size
-        file_batchs = file_objects[start_index:end_index]
+        if zip_folder:
+            # the stream is recorded in manifest to compress the folder again on resume
+            level = AppConfig.Env.upload_zip_level if compress_level is None else compress_level
+            stream = {'folder': zip_folder, 'archive_format': compress_format, 'level': level}
+            file_objects.append(StreamFileObject(object_path, file, folder_size(zip_folder), stream=stream))
+        else:
+            file_objects.append(FileObject(object_path, file))
 
-        pre_upload_infos.extend(upload_client.pre_upload(file_batchs, output_path))
+    # the token is refreshed by a thread of its own, the files are finalized
+    # by the finalizer of upload client so the workers only upload chunks
+    pool = ThreadPool(upload_client.concurrency.maximum)
+    upload_client.upload_token_refresh()
 
-    pool = ThreadPool(num_of_thread + 1)
-    pool.apply_async(upload_client.upload_token_refresh)
+    # the files start streaming as soon as their batch is pre-uploaded,
+    # while the next batches are still being pre-uploaded
+    pre_upload_infos = []
     on_success_res = []
-    for file_object in pre_upload_infos:
-        chunk_res = upload_client.stream_upload(file_object, pool)
-        res = pool.apply_async(
-            upload_client.on_succeed,
-            args=(file_object, tags, chunk_res),
-        )
-        on_success_res.append(res)
+    for file_batch in pre_upload_in_batches(upload_client, file_objects, output_path):
+        pre_upload_infos.extend(file_batch)
+        for file_object in file_batch:
+            on_success_res.append(upload_file_or_stream(upload_client, file_object, pool, tags))
 
-    [res.wait() for res in on_success_res]
+    concurrent.futures.wait(on_success_res)
     upload_client.set_finish_upload()
 
     pool.close()
     pool.join()
+    journal.compact()
 
     if source_file or attribute:
         continue_loop = True
@@ -190,27 +254,121 @@ def simple_upload(  # noqa: C901
             time.sleep(0.5)
         if source_file:
             upload_client.create_file_lineage(source_file)
-            os.remove(file_batchs[0]) if os.path.isdir(input_path) and job_type == UploadType.AS_FILE else None
+            if os.path.isdir(input_path) and job_type == UploadType.AS_FILE and not zip_folder:
+                os.remove(upload_file_path[0])
 
     num_of_file = len(upload_file_path)
-    logger.info(f'Upload Time: {time.time() - upload_start_time:.2f}s for {num_of_file:d} files')
+    logger.info(
+        f'Upload Time: {time.time() - upload_start_time:.2f}s for {num_of_file:d} files '
+        f'with concurrency {upload_client.concurrency.summary()}'
+    )
 
     return [file_object.item_id for file_object in pre_upload_infos]
 
 
+def upload_file_or_stream(
+    upload_client: UploadClient, file_object: FileObject, pool: ThreadPool, tags: list[str]
+) -> concurrent.futures.Future:
+    """
+    Summary:
+        Upload the local file, or the archive of folder while it is
+        compressed by its recorded stream.
+    Parameters:
+        - upload_client: the upload client
+        - file_object: the file object, StreamFileObject for the archive
+        - pool: the pool to run chunk uploads
+        - tags: the tags attached with uploaded object
+    Return:
+        - the future of finalized file
+    """
+    if not isinstance(file_object, StreamFileObject):
+        return upload_client.upload_file(file_object, pool, tags)
+
+    mhandler.SrvOutPutHandler.start_zipping_file()
+    stream = file_object.stream
+    write_stream = partial(
+        stream_folder_archive, stream['folder'], archive_format=stream['archive_format'], level=stream['level']
+    )
+    return upload_client.upload_stream(file_object, write_stream, pool, tags)
+
+
+def manifest_file_object(file_info: dict[str, Any]) -> FileObject:
+    """The file object of manifest, the archive streamed from folder is compressed again from the folder."""
+    object_path, local_path = file_info.get('object_path'), file_info.get('local_path')
+    ids = (file_info.get('resumable_id'), file_info.get('job_id'), file_info.get('item_id'))
+    stream = file_info.get('stream')
+    if stream:
+        return StreamFileObject(object_path, local_path, folder_size(stream['folder']), *ids, stream=stream)
+    return FileObject(object_path, local_path, *ids)
+
+
+def apply_manifest_journal(manifest_json: dict[str, Any]) -> tuple[list[FileObject], list[FileObject]]:
+    """
+    Summary:
+        Build the file objects of the registered files in manifest which
+        are not finalized yet. The chunks recorded in manifest are set as
+        uploaded, and as trusted if the local file is not changed since.
+    Parameters:
+        - manifest_json: the manifest json with the journal applied
+    Return:
+        - the files to query their uploaded chunks from server, and the
+            files with the uploaded chunks from journal
+    """
+    all_files = manifest_json.get('file_objects')
+    item_ids = [item_id for item_id, file_info in all_files.items() if not file_info.get('finalized')]
+    items = get_file_info_by_geid(item_ids) if item_ids else []
+
+    unfinished_items = []
+    journaled_items = []
+    for x in items:
+        if x.get('result').get('status') != ItemStatus.REGISTERED:
+            continue
+        file_info = all_files.get(x.get('result').get('id'))
+        file_object = manifest_file_object(file_info)
+
+        if not file_info.get('uploaded_chunks'):
+            unfinished_items.append(file_object)
+            continue
+
+        file_object.uploaded_chunks = file_info.get('uploaded_chunks')
+        if (
+            file_info.get('mtime_ns') is not None
+            and file_info.get('mtime_ns') == file_mtime_ns(file_object.local_path)
+            and file_info.get('total_size') == file_object.total_size
+        ):
+            file_object.trusted_chunks = file_object.uploaded_chunks
+        journaled_items.append(file_object)
+
+    return unfinished_items, journaled_items
+
+
 def resume_upload(
     manifest_json: dict[str, Any],
-    num_of_thread: int = 1,
+    num_of_thread: int | str = 1,
+    trust_hash_cache: bool = False,
+    manifest_path: str = None,
 ):
     """
     Summary:
-        Resume upload from the manifest file
+        Resume upload from the manifest file. With the manifest journal,
+        the finalized files are skipped, and the chunks recorded in the
+        journal are not queried from server. They are not read again
+        either if the local file is not changed since they were uploaded.
     Parameters:
         - manifest_json: the manifest json which store the upload information
-        - num_of_thread: the number of thread to upload the file
+        - num_of_thread: the number of thread to upload the file, or
+            `auto` to adjust it by the upload throughput
+        - trust_hash_cache: trust the local hash cache of uploaded chunks
+            instead of reading and hashing them again
+        - manifest_path: optional, the path of manifest to find its journal
     """
     upload_start_time = time.time()
 
+    journal = None
+    if manifest_path:
+        journal = ManifestJournal(manifest_path)
+        manifest_json = journal.load(manifest_json)
+
     upload_client = UploadClient(
         input_path=manifest_json.get('file'),
         project_code=manifest_json.get('project_code'),
@@ -219,46 +377,36 @@ def resume_upload(
         current_folder_node=manifest_json.get('current_folder_node', ''),
         parent_folder_id=manifest_json.get('parent_folder_id', ''),
         tags=manifest_json.get('tags'),
+        num_of_thread=num_of_thread,
+        trust_hash_cache=trust_hash_cache,
+        journal=journal,
     )
 
-    item_ids = []
-    all_files = manifest_json.get('file_objects')
-    for item_id in all_files:
-        item_ids.append(item_id)
-    items = get_file_info_by_geid(item_ids)
+    unfinished_items, journaled_items = apply_manifest_journal(manifest_json)
 
-    unfinished_items = []
-    for x in items:
-        if x.get('result').get('status') == ItemStatus.REGISTERED:
-            file_info = all_files.get(x.get('result').get('id'))
-            unfinished_items.append(
-                FileObject(
-                    file_info.get('object_path'),
-                    file_info.get('local_path'),
-                    file_info.get('resumable_id'),
-                    file_info.get('job_id'),
-                    file_info.get('item_id'),
-                )
-            )
-
-    unfinished_items = upload_client.resume_upload(unfinished_items)
-
-    pool = ThreadPool(num_of_thread + 1)
-    pool.apply_async(upload_client.upload_token_refresh)
+    if unfinished_items:
+        unfinished_items = upload_client.resume_upload(unfinished_items)
+    unfinished_items.extend(journaled_items)
+
+    # the token is refreshed by a thread of its own, the files are finalized
+    # by the finalizer of upload client so the workers only upload chunks
+    pool = ThreadPool(upload_client.concurrency.maximum)
+    upload_client.upload_token_refresh()
     on_success_res = []
     for file_object in unfinished_items:
-        chunk_res = upload_client.stream_upload(file_object, pool)
-        res = pool.apply_async(
-            upload_client.on_succeed,
-            args=(file_object, manifest_json.get('tags'), chunk_res),
-        )
+        res = upload_file_or_stream(upload_client, file_object, pool, manifest_json.get('tags'))
         on_success_res.append(res)
 
-    [res.wait() for res in on_success_res]
+    concurrent.futures.wait(on_success_res)
     upload_client.set_finish_upload()
 
     pool.close()
     pool.join()
+    if journal is not None:
+        journal.compact()
 
     num_of_file = len(unfinished_items)
-    logger.info(f'Upload Time: {time.time() - upload_start_time:.2f}s for {num_of_file:d} files')
+    logger.info(
+        f'Upload Time: {time.time() - upload_start_time:.2f}s for {num_of_file:d} files '
+        f'with concurrency {upload_client.concurrency.summary()}'
+    )
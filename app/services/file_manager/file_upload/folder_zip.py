@@ -0,0 +1,368 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import importlib.util
+import multiprocessing
+import os
+import struct
+import tarfile
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import BinaryIO
+from typing import Callable
+from typing import Iterator
+
+from app.configs.app_config import AppConfig
+
+ARCHIVE_FORMATS = ['zip', 'tar.zst']
+# the records of zip, see APPNOTE.TXT of PKWARE
+LOCAL_HEADER_SIGNATURE = 0x04034B50
+DATA_DESCRIPTOR_SIGNATURE = 0x08074B50
+CENTRAL_DIRECTORY_SIGNATURE = 0x02014B50
+ZIP64_END_SIGNATURE = 0x06064B50
+ZIP64_LOCATOR_SIGNATURE = 0x07064B50
+END_SIGNATURE = 0x06054B50
+ZIP64_EXTRA_ID = 0x0001
+DEFAULT_VERSION = 20
+ZIP64_VERSION = 45
+# the sizes, offsets and number of members beyond the limits need zip64 records
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+# the window of deflate, the next segment is primed with the tail of previous one
+DEFLATE_WINDOW = 32 * 1024
+
+
+class ZipPartWriter:
+    """
+    Summary:
+        The unseekable output of archive, which cuts the archive into the
+        parts of `chunk_size` and gives each part to the callback once it
+        is full, the last part is given on close. So the archive is never
+        on disk, and the memory is one part plus the parts being uploaded.
+        The zip writer adds a data descriptor after each member, since the
+        output can not be seeked back to patch the local headers.
+    """
+
+    def __init__(self, on_part: Callable[[bytes], None], part_size: int = None):
+        self.on_part = on_part
+        self.part_size = part_size or AppConfig.Env.chunk_size
+        self.buffer = bytearray()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= self.part_size:
+            self.on_part(bytes(self.buffer[: self.part_size]))
+            del self.buffer[: self.part_size]
+        return len(data)
+
+    def flush(self) -> None:
+        # only the last part can be smaller than part size
+        pass
+
+    def close(self) -> None:
+        if self.buffer or not self.size:
+            self.on_part(bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+def encode_filename(zinfo: zipfile.ZipInfo) -> tuple[bytes, int]:
+    """The filename in ascii, or in utf-8 with the flag of language encoding."""
+    try:
+        return zinfo.filename.encode('ascii'), zinfo.flag_bits
+    except UnicodeEncodeError:
+        return zinfo.filename.encode('utf-8'), zinfo.flag_bits | 0x800
+
+
+def dos_date_time(zinfo: zipfile.ZipInfo) -> tuple[int, int]:
+    """The modification time and date of member in ms-dos format."""
+    year, month, day, hour, minute, second = zinfo.date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def zstd_available() -> bool:
+    """The tar.zst archive is only available if the `zstandard` package is installed."""
+    return importlib.util.find_spec('zstandard') is not None
+
+
+def archive_name(path: str, archive_format: str = 'zip') -> str:
+    return path.rstrip('/').lstrip() + '.' + archive_format
+
+
+def walk_files(path: str) -> Iterator[str]:
+    """The files of folder in sorted order, so the archive of unchanged folder is the same on resume."""
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            yield os.path.join(root, file)
+
+
+def folder_size(path: str) -> int:
+    """The total size of files in folder, the estimated size of its archive."""
+    return sum(os.path.getsize(file) for file in walk_files(path))
+
+
+def is_incompressible(path: str) -> bool:
+    """The file is already compressed eg. .nii.gz or .jpg, deflating it again only costs cpu."""
+    return path.lower().endswith(tuple(AppConfig.Env.upload_zip_stored_extensions))
+
+
+def deflate_segment(data: bytes, level: int, last: bool, previous: bytes) -> bytes:
+    """
+    Summary:
+        The function is to deflate one segment of a member in worker
+        process. The segments are deflated independently and joined in
+        order: the segment ends with a sync flush so the next one starts
+        at byte boundary, and only the last one ends the stream. With the
+        tail of previous segment as dictionary, the ratio is about the
+        same as deflating the member at once.
+    """
+    options = {'zdict': previous} if previous else {}
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, **options)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelZipWriter:
+    """
+    Summary:
+        The zip writer deflating the members in a process pool. Each member
+        is cut into segments of `upload_zip_segment_size`, the segments of
+        current and following members are deflated by the workers, and
+        written in order, so both a large file and many small files use
+        all the cores. The CRC is computed while reading, which is much
+        faster than deflating. The incompressible files are stored.
+        The output can be unseekable, so the headers, data descriptors and
+        central directory are written by the writer itself as specified
+        in APPNOTE.TXT, the local header of member is followed by its
+        data and a data descriptor with the CRC and sizes. The member
+        larger than `ZIP64_LIMIT` and the large archive use zip64 records.
+    """
+
+    def __init__(self, fileobj: BinaryIO, level: int = None, workers: int = None):
+        self.fileobj = fileobj
+        self.level = AppConfig.Env.upload_zip_level if level is None else level
+        workers = workers or AppConfig.Env.upload_zip_workers or os.cpu_count()
+        # the workers are spawned, the forked ones could inherit the locks held by upload threads
+        self.executor = (
+            ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) if workers > 1 else None
+        )
+        self.window = workers * 2
+        self.pending = deque()
+        self.members = []
+        self.offset = 0
+        self.compress_size = 0
+
+    def write(self, data: bytes) -> None:
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def add(self, path: str) -> None:
+        """Add the file into zip, with the same arcname as ZipFile.write."""
+        zinfo = zipfile.ZipInfo.from_file(path)
+        stored = self.level == 0 or not zinfo.file_size or is_incompressible(path)
+        zinfo.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+        zinfo.flag_bits |= 0x08
+        # the deflated data can be a bit larger than the file, as zipfile estimates
+        zip64 = zinfo.file_size * 1.05 > ZIP64_LIMIT
+        self.pending.append(partial(self.start_member, zinfo, zip64))
+
+        crc, size, previous = 0, 0, b''
+        segment_size = AppConfig.Env.upload_zip_segment_size
+        with open(path, 'rb') as file:
+            data = file.read(segment_size)
+            while data:
+                following = file.read(segment_size)
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                self.pending.append(self.compress(data, stored, not following, previous))
+                previous = data[-DEFLATE_WINDOW:]
+                data = following
+                self.drain(self.window)
+
+        zinfo.CRC, zinfo.file_size = crc, size
+        self.pending.append(partial(self.end_member, zinfo, zip64))
+        self.drain(self.window)
+
+    def compress(self, data: bytes, stored: bool, last: bool, previous: bytes) -> Future:
+        """The future of the segment to write, deflated by the workers if there are more than one."""
+        if not stored and self.executor is not None:
+            return self.executor.submit(deflate_segment, data, self.level, last, previous)
+        future = Future()
+        future.set_result(data if stored else deflate_segment(data, self.level, last, previous))
+        return future
+
+    def start_member(self, zinfo: zipfile.ZipInfo, zip64: bool) -> None:
+        zinfo.header_offset = self.offset
+        extra = b''
+        if zip64:
+            # the sizes are in data descriptor, the zip64 extra marks the 8 bytes sizes
+            extra = struct.pack('<HHQQ', ZIP64_EXTRA_ID, 16, 0, 0)
+        filename, flag_bits = encode_filename(zinfo)
+        header = struct.pack(
+            '<LHHHHHLLLHH',
+            LOCAL_HEADER_SIGNATURE,
+            ZIP64_VERSION if zip64 else DEFAULT_VERSION,
+            flag_bits,
+            zinfo.compress_type,
+            *dos_date_time(zinfo),
+            0,
+            0xFFFFFFFF if zip64 else 0,
+            0xFFFFFFFF if zip64 else 0,
+            len(filename),
+            len(extra),
+        )
+        self.write(header + filename + extra)
+        self.compress_size = 0
+
+    def end_member(self, zinfo: zipfile.ZipInfo, zip64: bool) -> None:
+        zinfo.compress_size = self.compress_size
+        if not zip64 and max(zinfo.file_size, zinfo.compress_size) > ZIP64_LIMIT:
+            raise RuntimeError(f'The size of {zinfo.filename} is changed while compressing it.')
+        fmt = '<LLQQ' if zip64 else '<LLLL'
+        self.write(struct.pack(fmt, DATA_DESCRIPTOR_SIGNATURE, zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+        self.members.append(zinfo)
+
+    def drain(self, limit: int) -> None:
+        """Write the pending members and segments in order until at most `limit` are pending."""
+        while len(self.pending) > limit:
+            item = self.pending.popleft()
+            if isinstance(item, Future):
+                data = item.result()
+                self.write(data)
+                self.compress_size += len(data)
+            else:
+                item()
+
+    def write_central_directory(self) -> None:
+        """Write the central directory and the end records, zip64 ones if any limit is exceeded."""
+        start_dir = self.offset
+        for zinfo in self.members:
+            extra = []
+            file_size, compress_size, header_offset = zinfo.file_size, zinfo.compress_size, zinfo.header_offset
+            # the values exceeding the limit are moved into zip64 extra, in this order
+            if file_size > ZIP64_LIMIT:
+                extra.append(file_size)
+                file_size = 0xFFFFFFFF
+            if compress_size > ZIP64_LIMIT:
+                extra.append(compress_size)
+                compress_size = 0xFFFFFFFF
+            if header_offset > ZIP64_LIMIT:
+                extra.append(header_offset)
+                header_offset = 0xFFFFFFFF
+            extra_data = struct.pack(f'<HH{len(extra)}Q', ZIP64_EXTRA_ID, 8 * len(extra), *extra) if extra else b''
+            version = ZIP64_VERSION if extra else DEFAULT_VERSION
+            filename, flag_bits = encode_filename(zinfo)
+            header = struct.pack(
+                '<LBBHHHHHLLLHHHHHLL',
+                CENTRAL_DIRECTORY_SIGNATURE,
+                version,
+                zinfo.create_system,
+                version,
+                flag_bits,
+                zinfo.compress_type,
+                *dos_date_time(zinfo),
+                zinfo.CRC,
+                compress_size,
+                file_size,
+                len(filename),
+                len(extra_data),
+                0,
+                0,
+                0,
+                zinfo.external_attr,
+                header_offset,
+            )
+            self.write(header + filename + extra_data)
+
+        count, size_dir = len(self.members), self.offset - start_dir
+        if count > ZIP_FILECOUNT_LIMIT or size_dir > ZIP64_LIMIT or start_dir > ZIP64_LIMIT:
+            zip64_end = self.offset
+            self.write(
+                struct.pack(
+                    '<LQHHLLQQQQ',
+                    ZIP64_END_SIGNATURE,
+                    44,
+                    ZIP64_VERSION,
+                    ZIP64_VERSION,
+                    0,
+                    0,
+                    count,
+                    count,
+                    size_dir,
+                    start_dir,
+                )
+            )
+            self.write(struct.pack('<LLQL', ZIP64_LOCATOR_SIGNATURE, 0, zip64_end, 1))
+            # the readers only look for zip64 end record if the values are saturated
+            count, size_dir, start_dir = 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF
+        self.write(struct.pack('<LHHHHLLH', END_SIGNATURE, 0, 0, count, count, size_dir, start_dir, 0))
+
+    def close(self) -> None:
+        try:
+            self.drain(0)
+            self.write_central_directory()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(cancel_futures=True)
+
+
+def write_folder_archive(fileobj: BinaryIO, path: str, archive_format: str = 'zip', level: int = None) -> None:
+    """
+    Summary:
+        The function is to write the archive of folder into the file object.
+    Parameter:
+        - fileobj(BinaryIO): the output, it can be unseekable.
+        - path(str): the local folder.
+        - archive_format(str): zip, or tar.zst which is compressed by the
+            threads of zstandard.
+        - level(int): the compression level, default is `upload_zip_level`.
+            0 means stored for zip and the default level for tar.zst.
+    """
+    path = path.rstrip('/').lstrip()
+    level = AppConfig.Env.upload_zip_level if level is None else level
+    if archive_format == 'tar.zst':
+        import zstandard
+
+        compressor = zstandard.ZstdCompressor(level=level or 3, threads=-1)
+        with compressor.stream_writer(fileobj, closefd=False) as writer:
+            with tarfile.open(fileobj=writer, mode='w|') as tar:
+                for file in walk_files(path):
+                    tar.add(file, recursive=False)
+        return
+
+    writer = ParallelZipWriter(fileobj, level)
+    try:
+        for file in walk_files(path):
+            writer.add(file)
+    finally:
+        writer.close()
+
+
+def stream_folder_archive(
+    path: str, on_part: Callable[[bytes], None], archive_format: str = 'zip', level: int = None
+) -> int:
+    """
+    Summary:
+        The function is to compress the folder as a stream of parts, the
+        members are the same as the archive of compress_folder_to_zip.
+    Parameter:
+        - path(str): the local folder.
+        - on_part(Callable): called with each part of archive in order, it
+            can block to slow down the compression.
+        - archive_format(str): zip or tar.zst.
+        - level(int): optional, the compression level.
+    return:
+        - int: the size of archive.
+    """
+    writer = ZipPartWriter(on_part)
+    write_folder_archive(writer, path, archive_format, level)
+    writer.close()
+    return writer.size
@@ -0,0 +1,109 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import os
+import sqlite3
+import threading
+
+from app.configs.app_config import AppConfig
+from app.services.file_manager.file_upload.models import FileObject
+
+
+class ChunkHashCache:
+    """
+    Summary:
+        The local cache of chunk md5 hashes, persisted in a sqlite file
+        under the cli config folder. The hashes are keyed by the local
+        file(path, size, mtime) and the chunk size, so any change of the
+        file makes its hashes unusable. The hashes are recorded when a
+        chunk is uploaded(the ETag from object storage) or verified, and
+        the resume can trust them instead of reading the chunks again.
+        The hashes of a file are deleted once it is finalized, so the cache
+        only keeps the files which are not done yet.
+        The cache is best effort, any error of it is ignored.
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or AppConfig.Env.upload_hash_cache_path
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS chunk_hash ('
+                'path TEXT, size INTEGER, mtime_ns INTEGER, chunk_size INTEGER, chunk_number INTEGER, md5 TEXT, '
+                'PRIMARY KEY (path, size, mtime_ns, chunk_size, chunk_number))'
+            )
+        return self.connection
+
+    def file_key(self, file_object: FileObject) -> tuple[str, int, int, int]:
+        stat = os.stat(file_object.local_path)
+        return os.path.abspath(file_object.local_path), stat.st_size, stat.st_mtime_ns, AppConfig.Env.chunk_size
+
+    def get(self, file_object: FileObject) -> dict[int, str]:
+        """
+        Summary:
+            The function is to get the cached hashes of the current file
+            content. The hashes of previous content are removed.
+        Parameter:
+            - file_object(FileObject): the file object.
+        return:
+            - dict: the mapping of chunk number and md5.
+        """
+        try:
+            key = self.file_key(file_object)
+            with self.lock:
+                connection = self.connect()
+                connection.execute(
+                    'DELETE FROM chunk_hash WHERE path = ? AND (size, mtime_ns, chunk_size) != (?, ?, ?)', key
+                )
+                rows = connection.execute(
+                    'SELECT chunk_number, md5 FROM chunk_hash WHERE path = ? AND size = ? AND mtime_ns = ? '
+                    'AND chunk_size = ?',
+                    key,
+                )
+                return dict(rows.fetchall())
+        except (OSError, sqlite3.Error):
+            return {}
+
+    def set(self, file_object: FileObject, chunk_number: int, md5: str) -> None:
+        """
+        Summary:
+            The function is to record the md5 of a chunk.
+        Parameter:
+            - file_object(FileObject): the file object.
+            - chunk_number(int): the chunk number.
+            - md5(str): the md5 hex digest of chunk.
+        """
+        try:
+            key = self.file_key(file_object)
+            with self.lock:
+                self.connect().execute(
+                    'INSERT OR REPLACE INTO chunk_hash VALUES (?, ?, ?, ?, ?, ?)', (*key, chunk_number, md5)
+                )
+        except (OSError, sqlite3.Error):
+            pass
+
+    def delete(self, file_object: FileObject) -> None:
+        """Delete the hashes of a file, the finalized file is never resumed."""
+        try:
+            with self.lock:
+                self.connect().execute(
+                    'DELETE FROM chunk_hash WHERE path = ?', (os.path.abspath(file_object.local_path),)
+                )
+        except (OSError, sqlite3.Error):
+            pass
+
+    def close(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
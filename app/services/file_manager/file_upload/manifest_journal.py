@@ -0,0 +1,146 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import json
+import os
+import threading
+from typing import Any
+
+from app.services.file_manager.file_upload.models import FileObject
+
+
+def file_mtime_ns(local_path: str) -> int:
+    try:
+        return os.stat(local_path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ManifestJournal:
+    """
+    Summary:
+        The append-only journal next to the resumable manifest(eg.
+        manifest.json.journal). Each line is one json record:
+         - {"op": "file", "file": {...}}: the file is pre-uploaded.
+         - {"op": "chunk", "item_id": ..., "chunk": 1, "etag": ..., "mtime_ns": ...}:
+           the chunk is uploaded from the local file with the mtime.
+         - {"op": "done", "item_id": ...}: the file is finalized.
+        Each record is written by a single append, so the journal stays
+        valid if the process is killed. A partial last line is ignored by
+        load. When the upload completes, the journal is compacted into the
+        manifest and removed.
+    """
+
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self.journal_path = f'{manifest_path}.journal'
+        self.lock = threading.Lock()
+        self.fd = None
+
+    def append(self, record: dict[str, Any]) -> None:
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode()
+        with self.lock:
+            if self.fd is None:
+                self.fd = os.open(self.journal_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            os.write(self.fd, line)
+
+    def reset(self) -> None:
+        """Remove the journal of previous upload with the same manifest path."""
+        self.close()
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def record_files(self, file_objects: list[FileObject]) -> None:
+        for file_object in file_objects:
+            self.append({'op': 'file', 'file': file_object.to_dict()})
+
+    def record_chunk(self, file_object: FileObject, chunk_number: int, etag: str) -> None:
+        self.append(
+            {
+                'op': 'chunk',
+                'item_id': file_object.item_id,
+                'chunk': chunk_number,
+                'etag': etag,
+                'mtime_ns': file_mtime_ns(file_object.local_path),
+            }
+        )
+
+    def record_done(self, file_object: FileObject) -> None:
+        self.append({'op': 'done', 'item_id': file_object.item_id})
+
+    def load(self, manifest_json: dict[str, Any]) -> dict[str, Any]:
+        """
+        Summary:
+            The function is to apply the journal to the manifest.
+        Parameter:
+            - manifest_json(dict): the manifest loaded from manifest path.
+        return:
+            - dict: the manifest with all the files, the uploaded chunks,
+                and `finalized` of each file.
+        """
+        file_objects = {
+            item_id: dict(file_info, uploaded_chunks=dict(file_info.get('uploaded_chunks') or {}))
+            for item_id, file_info in (manifest_json.get('file_objects') or {}).items()
+        }
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line may be partially written when killed
+                        continue
+
+                    if record.get('op') == 'file':
+                        file_info = record['file']
+                        file_objects.setdefault(file_info['item_id'], dict(file_info, uploaded_chunks={}))
+                        continue
+
+                    file_info = file_objects.get(record.get('item_id'))
+                    if file_info is None:
+                        continue
+                    if record.get('op') == 'chunk':
+                        file_info['uploaded_chunks'][str(record['chunk'])] = record['etag']
+                        # the chunks uploaded from different content of file are not trusted
+                        mtime_ns = record.get('mtime_ns')
+                        if file_info.setdefault('mtime_ns', mtime_ns) != mtime_ns:
+                            file_info['mtime_ns'] = None
+                    elif record.get('op') == 'done':
+                        file_info['finalized'] = True
+
+        return dict(manifest_json, file_objects=file_objects)
+
+    def compact(self) -> dict[str, Any]:
+        """
+        Summary:
+            The function is to write the journal into manifest and remove
+            the journal. The manifest is replaced atomically.
+        return:
+            - dict: the compacted manifest.
+        """
+        self.close()
+        if not os.path.exists(self.manifest_path):
+            self.reset()
+            return {}
+
+        with open(self.manifest_path) as f:
+            manifest_json = self.load(json.load(f))
+
+        temp_path = f'{self.manifest_path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(manifest_json, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.manifest_path)
+        self.reset()
+        return manifest_json
+
+    def close(self) -> None:
+        with self.lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
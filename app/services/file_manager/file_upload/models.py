@@ -5,6 +5,7 @@
 # You may not use this file except in compliance with the License.
 
 import math
+import os
 from enum import Enum
 from os.path import basename
 from os.path import dirname
@@ -79,6 +80,9 @@ class FileObject:
         self.total_size, self.total_chunks = self.generate_meta(local_path)
 
         self.uploaded_chunks = {}
+        # the uploaded chunks recorded in manifest journal from the same
+        # file content, they are skipped without reading the chunk
+        self.trusted_chunks = {}
 
     def generate_meta(self, local_path: str) -> tuple[int, int]:
         """
@@ -95,6 +99,28 @@ class FileObject:
         total_chunks = math.ceil(total_size / AppConfig.Env.chunk_size)
         return total_size, total_chunks
 
+    def read_chunk(self, chunk_number: int) -> bytes:
+        """
+        Summary:
+            The function is to read one chunk of the local file by its
+            offset. Each call opens its own descriptor so chunks can be
+            read concurrently from different threads.
+        Parameter:
+            - chunk_number(int): the number of chunk, starting from 1.
+        return:
+            - bytes: the chunk data.
+        """
+        offset = (chunk_number - 1) * AppConfig.Env.chunk_size
+        fd = os.open(self.local_path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            if hasattr(os, 'pread'):
+                return os.pread(fd, AppConfig.Env.chunk_size, offset)
+
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, AppConfig.Env.chunk_size)
+        finally:
+            os.close(fd)
+
     def to_dict(self):
         """
         Summary:
@@ -140,3 +166,43 @@ class FileObject:
             self.progress_bar.clear()
             self.progress_bar.close()
             self.progress_bar = None
+
+
+class StreamFileObject(FileObject):
+    """
+    Summary:
+        The file generated while it is uploaded eg. the zip stream of a
+        folder, it is not on local disk. The size and chunks are estimated
+        from `estimated_size` for progress and presigned url prefetching,
+        and set by `complete` once the stream ends. The `stream` is how
+        the file is generated(eg. the folder, archive format and level),
+        it is recorded in manifest to generate the same file on resume.
+    """
+
+    def __init__(
+        self,
+        object_path: str,
+        local_path: str,
+        estimated_size: int,
+        resumable_id: str = None,
+        job_id: str = None,
+        item_id: str = None,
+        stream: dict = None,
+    ) -> None:
+        self.estimated_size = estimated_size
+        self.stream = stream or {}
+        super().__init__(object_path, local_path, resumable_id, job_id, item_id)
+
+    def generate_meta(self, local_path: str) -> tuple[int, int]:
+        return self.estimated_size, max(1, math.ceil(self.estimated_size / AppConfig.Env.chunk_size))
+
+    def read_chunk(self, chunk_number: int) -> bytes:
+        raise OSError(f'The chunk {chunk_number} of stream {self.file_name} can not be read again.')
+
+    def to_dict(self):
+        return dict(super().to_dict(), stream=self.stream)
+
+    def complete(self, total_size: int, total_chunks: int) -> None:
+        """Set the actual size and chunks once the stream ends."""
+        self.total_size = total_size
+        self.total_chunks = total_chunks
@@ -0,0 +1,269 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from datetime import timezone
+from typing import Any
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import httpx
+
+from app.configs.app_config import AppConfig
+from app.configs.user_config import UserConfig
+from app.services.file_manager.file_upload.models import FileObject
+from app.services.user_authentication.token_provider import TokenProvider
+from app.utils.aggregated import resilient_session
+from app.utils.transfer_engine import TransferEngine
+
+
+def presigned_url_expiry(presigned_url: str) -> float:
+    """
+    Summary:
+        The function is to find when the presigned url expires. The
+        S3 signature v4 query(X-Amz-Date + X-Amz-Expires) is used and
+        the `presigned_url_ttl` config is the fallback.
+    Parameter:
+        - presigned_url(str): the presigned url.
+    return:
+        - float: the expiry as unix timestamp.
+    """
+    query = parse_qs(urlparse(presigned_url).query)
+    try:
+        signed_at = datetime.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ')
+        signed_at = signed_at.replace(tzinfo=timezone.utc).timestamp()
+        return signed_at + int(query['X-Amz-Expires'][0])
+    except (KeyError, ValueError):
+        return time.time() + AppConfig.Env.presigned_url_ttl
+
+
+class PresignedUrlCache:
+    """
+    Summary:
+        The cache of chunk presigned urls for one upload client. When a
+        chunk url is requested, the urls of the next chunks in the window
+        are requested ahead of the PUT workers:
+         - with the batch endpoint, one request for the whole window.
+         - without it, one request per chunk run by prefetch workers.
+        The urls are kept with their expiry and only the expired ones are
+        requested again.
+    """
+
+    def __init__(self, base_url: str, bucket: str):
+        self.base_url = base_url
+        self.bucket = bucket
+        self.user = UserConfig()
+        self.window = AppConfig.Env.presigned_url_window
+        # None means not probed yet, it will be set once server replies
+        self.batch_supported = None if AppConfig.Env.presigned_url_batch else False
+        self.urls = {}
+        self.consumed = set()
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get_headers(self) -> dict:
+        return {'Authorization': TokenProvider().bearer(), 'Session-ID': self.user.session_id}
+
+    def get(self, file_object: FileObject, chunk_number: int) -> str:
+        """
+        Summary:
+            The function is to get the presigned url of a chunk and
+            schedule the urls of the following chunks.
+        Parameter:
+            - file_object(FileObject): the file object of the chunk.
+            - chunk_number(int): the number of chunk.
+        return:
+            - str: the presigned url.
+        """
+        key = (file_object.resumable_id, chunk_number)
+        with self.lock:
+            future = self.urls.get(key)
+            # the key of a url already handed out or expired is dropped, so
+            # prefetch below requests a new one for it
+            if key in self.consumed or (future and future.done() and not self.is_valid(future)):
+                self.consumed.discard(key)
+                self.urls.pop(key, None)
+            self.prefetch(file_object, chunk_number)
+            future = self.urls.pop(key)
+            self.consumed.add(key)
+
+        presigned_url, _ = future.result()
+        return presigned_url
+
+    def forget(self, file_object: FileObject) -> None:
+        """Drop the urls and consumed keys of a file once its chunks are done."""
+        with self.lock:
+            self.urls = {key: future for key, future in self.urls.items() if key[0] != file_object.resumable_id}
+            self.consumed = {key for key in self.consumed if key[0] != file_object.resumable_id}
+
+    def is_valid(self, future: Future) -> bool:
+        if future.exception():
+            return False
+        _, expire_at = future.result()
+        return expire_at - AppConfig.Env.presigned_url_expiry_margin > time.time()
+
+    def prefetch(self, file_object: FileObject, chunk_number: int) -> None:
+        """
+        Summary:
+            The function is to schedule the requests for the chunks in window
+            which are not uploaded or cached yet. To keep the batches large,
+            the window is only refilled when half of it is missing. The caller
+            holds the lock.
+        Parameter:
+            - file_object(FileObject): the file object of the chunk.
+            - chunk_number(int): the first chunk number of window.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=AppConfig.Env.presigned_url_prefetch_workers)
+
+        last_chunk = max(chunk_number, min(chunk_number + self.window - 1, file_object.total_chunks))
+        missing = []
+        for number in range(chunk_number, last_chunk + 1):
+            key = (file_object.resumable_id, number)
+            if key in self.urls or key in self.consumed:
+                continue
+            if number != chunk_number and str(number) in file_object.uploaded_chunks:
+                continue
+            missing.append(number)
+
+        current_cached = (file_object.resumable_id, chunk_number) in self.urls
+        if not missing or (current_cached and len(missing) < self.window // 2):
+            return
+
+        futures = {}
+        for number in missing:
+            futures[number] = Future()
+            self.urls[(file_object.resumable_id, number)] = futures[number]
+
+        if self.batch_supported is False:
+            for number, future in futures.items():
+                self.executor.submit(self.fill, future, self.request_url, file_object, number)
+        else:
+            self.executor.submit(self.fill_batch, file_object, futures)
+
+    def fill(self, future: Future, func, *args) -> None:
+        # the url is not requested if the cache is closed before
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+    def fill_batch(self, file_object: FileObject, futures: dict[int, Future]) -> None:
+        """
+        Summary:
+            The function is to request the urls of window in one call. If
+            server does not support it or the call fails, the batch endpoint
+            is not used again and the urls will be requested one by one.
+        Parameter:
+            - file_object(FileObject): the file object of the chunks.
+            - futures(dict): the mapping of chunk number and its future.
+        """
+        try:
+            presigned_urls = self.request_batch_urls(file_object, list(futures))
+        except Exception:
+            self.batch_supported = False
+            presigned_urls = None
+
+        for number, future in futures.items():
+            presigned_url = (presigned_urls or {}).get(str(number))
+            if future.cancelled():
+                continue
+            if presigned_url:
+                future.set_result((presigned_url, presigned_url_expiry(presigned_url)))
+            else:
+                self.executor.submit(self.fill, future, self.request_url, file_object, number)
+
+    def close(self) -> None:
+        """Cancel the urls not requested yet and stop the prefetch workers once the upload finishes."""
+        with self.lock:
+            for future in self.urls.values():
+                future.cancel()
+            self.urls = {}
+            self.consumed = set()
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+    def request_batch_urls(self, file_object: FileObject, chunk_numbers: list[int]) -> dict[str, str]:
+        """
+        Summary:
+            The function is to request presigned urls for multiple chunks.
+        Parameter:
+            - file_object(FileObject): the file object of the chunks.
+            - chunk_numbers(list of int): the chunk numbers.
+        return:
+            - dict: the mapping of chunk number and presigned url. None if
+                the call fails, then the endpoint is not used again.
+        """
+        url = self.base_url + AppConfig.Env.presigned_url_batch_path
+        payload = {
+            'bucket': self.bucket,
+            'key': file_object.object_path,
+            'upload_id': file_object.resumable_id,
+            'chunk_numbers': chunk_numbers,
+        }
+        response = resilient_session(url).post(
+            url,
+            json=payload,
+            headers=self.get_headers(),
+            timeout=None,
+            extensions={'idempotent': True, 'retry_class': 'presign'},
+        )
+        # the transport already retried the transient errors, any other
+        # status means the endpoint can not be used by this client
+        if response.status_code != 200:
+            self.batch_supported = False
+            return None
+
+        self.batch_supported = True
+        return response.json().get('result')
+
+    def url_request(self, file_object: FileObject, chunk_number: int) -> dict[str, Any]:
+        """The url, params and headers to request the presigned url of one chunk."""
+        return {
+            'url': self.base_url + '/v1/files/chunks/presigned',
+            'params': {
+                'bucket': self.bucket,
+                'key': file_object.object_path,
+                'upload_id': file_object.resumable_id,
+                'chunk_number': chunk_number,
+            },
+            'headers': self.get_headers(),
+        }
+
+    def read_url(self, response: httpx.Response) -> tuple[str, float]:
+        if response.status_code != 200:
+            raise Exception(response.content)
+
+        presigned_url = response.json().get('result')
+        return presigned_url, presigned_url_expiry(presigned_url)
+
+    def request_url(self, file_object: FileObject, chunk_number: int) -> tuple[str, float]:
+        """
+        Summary:
+            The function is to request presigned url for one chunk.
+        Parameter:
+            - file_object(FileObject): the file object of the chunk.
+            - chunk_number(int): the chunk number.
+        return:
+            - str: the presigned url.
+            - float: the expiry of url.
+        """
+        request = self.url_request(file_object, chunk_number)
+        response = resilient_session(request['url']).get(**request, timeout=None, extensions={'retry_class': 'presign'})
+        return self.read_url(response)
+
+    async def request_url_async(self, file_object: FileObject, chunk_number: int) -> tuple[str, float]:
+        """The coroutine of request_url in transfer engine."""
+        request = self.url_request(file_object, chunk_number)
+        response = await TransferEngine().request('GET', request_class='presign', **request)
+        return self.read_url(response)
@@ -4,14 +4,19 @@
 # Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
 # You may not use this file except in compliance with the License.
 
+import asyncio
 import hashlib
 import json
 import math
 import os
+import threading
 import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing.pool import ApplyResult
 from multiprocessing.pool import ThreadPool
 from typing import Any
+from typing import Callable
 
 import httpx
 
@@ -19,20 +24,37 @@ import app.models.upload_form as uf
 import app.services.output_manager.message_handler as mhandler
 from app.configs.app_config import AppConfig
 from app.configs.user_config import UserConfig
+from app.services.file_manager.file_upload.concurrency import ChunkConcurrency
+from app.services.file_manager.file_upload.hash_cache import ChunkHashCache
+from app.services.file_manager.file_upload.manifest_journal import ManifestJournal
 from app.services.file_manager.file_upload.models import FileObject
+from app.services.file_manager.file_upload.models import StreamFileObject
 from app.services.file_manager.file_upload.models import UploadType
+from app.services.file_manager.file_upload.presigned_cache import PresignedUrlCache
 from app.services.output_manager.error_handler import ECustomizedError
 from app.services.output_manager.error_handler import SrvErrorHandler
 from app.services.user_authentication.decorator import require_valid_token
-from app.services.user_authentication.token_manager import SrvTokenManager
+from app.services.user_authentication.token_provider import TokenProvider
 from app.utils.aggregated import get_file_info_by_geid
 from app.utils.aggregated import resilient_session
 from app.utils.aggregated import search_item
+from app.utils.http_retry import backoff_delay
+from app.utils.http_retry import get_retry_budget
+from app.utils.metadata_cache import MetadataCache
+from app.utils.transfer_engine import TransferEngine
 
 from .exception import INVALID_CHUNK_ETAG
 from ..file_lineage import create_lineage
 
 
+def chain_future(source: Future, target: Future) -> None:
+    """Copy the result or exception of finished future to another one."""
+    if source.exception():
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
 class UploadClient:
     """
     Summary:
@@ -44,6 +66,13 @@ class UploadClient:
          - upload_message:
          - job_type: based on the input. can be AS_FILE or AS_FOLDER.
          - current_folder_node: the target folder in object storage.
+         - num_of_thread: the number of chunks that can be in flight
+            at the same time. it bounds the memory used by upload. `auto`
+            means the number is adjusted by the chunk throughput.
+         - trust_hash_cache: when resuming, trust the local hash cache of
+            chunks instead of reading the uploaded chunks again.
+         - journal: optional, the manifest journal to record the pre-uploaded
+            files, the uploaded chunks and the finalized files.
     """
 
     def __init__(
@@ -58,8 +87,12 @@ class UploadClient:
         current_folder_node: str = '',
         regular_file: str = True,
         tags: list = None,
+        num_of_thread: int | str = 1,
+        trust_hash_cache: bool = False,
+        journal: ManifestJournal = None,
     ):
         self.user = UserConfig()
+        self.tokens = TokenProvider()
         self.operator = self.user.username
         self.input_path = input_path
         self.upload_message = upload_message
@@ -84,6 +117,24 @@ class UploadClient:
         self.regular_file = regular_file
         self.tags = tags
 
+        # the limit is released by the pool callback once the chunk is done
+        self.concurrency = ChunkConcurrency.from_thread(num_of_thread)
+        # the slots of single chunk files uploaded in transfer engine
+        self.small_file_slots = None
+        self.presigned_urls = PresignedUrlCache(self.base_url, self.bucket)
+        # the files are finalized here instead of the chunk pool
+        self.finalizer = ThreadPoolExecutor(max_workers=AppConfig.Env.upload_finalize_workers)
+        # the batches are pre-uploaded in parallel, one manifest write at a time
+        self.manifest_lock = threading.Lock()
+        # the uploaded chunks are verified in hash pool when resuming
+        self.hash_pool = None
+        self.hash_pool_lock = threading.Lock()
+        self.hash_cache = ChunkHashCache()
+        self.trust_hash_cache = trust_hash_cache
+        # the manifest is written once, the other batches are appended to journal
+        self.journal = journal
+        self.manifest_written = False
+
         self.finish_upload = False
 
     def generate_meta(self, local_path: str) -> tuple[int, int]:
@@ -117,7 +168,7 @@ class UploadClient:
         """
         mhandler.SrvOutPutHandler.resume_warning(len(unfinished_file_objects))
 
-        headers = {'Authorization': 'Bearer ' + self.user.access_token, 'Session-ID': self.user.session_id}
+        headers = {'Authorization': self.tokens.bearer(), 'Session-ID': self.user.session_id}
         url = AppConfig.Connections.url_bff + f'/v1/project/{self.project_code}/files/resumable'
         rid_file_object_map = {x.resumable_id: x for x in unfinished_file_objects}
         payload = {
@@ -133,7 +184,7 @@ class UploadClient:
             ],
         }
 
-        response = resilient_session().post(url, json=payload, headers=headers, timeout=None)
+        response = resilient_session(url).post(url, json=payload, headers=headers, timeout=None)
         if response.status_code == 404:
             SrvErrorHandler.customized_handle(ECustomizedError.UPLOAD_ID_NOT_EXIST, True)
 
@@ -161,7 +212,7 @@ class UploadClient:
                 - chunk_info(dict): the mapping for chunks that already been uploaded.
         """
 
-        headers = {'Authorization': 'Bearer ' + self.user.access_token, 'Session-ID': self.user.session_id}
+        headers = {'Authorization': self.tokens.bearer(), 'Session-ID': self.user.session_id}
         url = AppConfig.Connections.url_bff + f'/v1/project/{self.project_code}/files'
         payload = {
             'project_code': self.project_code,
@@ -176,7 +227,7 @@ class UploadClient:
             ],
         }
 
-        response = resilient_session().post(url, json=payload, headers=headers, timeout=None)
+        response = resilient_session(url).post(url, json=payload, headers=headers, timeout=None)
 
         if response.status_code == 200:
             result = response.json().get('result')
@@ -191,9 +242,7 @@ class UploadClient:
                 file_object.job_id = job.get('job_id')
                 file_objets.append(file_object)
 
-            # then output manifest file to the output path
-            self.output_manifest(file_objets, output_path)
-
+            self.record_pre_upload(file_objets, output_path)
             mhandler.SrvOutPutHandler.preupload_success()
             return file_objets
         elif response.status_code == 403:
@@ -210,6 +259,21 @@ class UploadClient:
         else:
             SrvErrorHandler.default_handle(str(response.status_code) + ': ' + str(response.content), self.regular_file)
 
+    def record_pre_upload(self, file_objects: list[FileObject], output_path: str) -> None:
+        """Output the pre-uploaded files into manifest or its journal, and invalidate the cached folders."""
+        with self.manifest_lock:
+            if self.journal is None:
+                self.output_manifest(file_objects, output_path)
+            else:
+                if not self.manifest_written:
+                    self.output_manifest([], output_path)
+                    self.manifest_written = True
+                self.journal.record_files(file_objects)
+
+        # the folders of job are created by pre-upload
+        if self.job_type == UploadType.AS_FOLDER:
+            MetadataCache().invalidate(self.project_code, self.zone, self.current_folder_node)
+
     def output_manifest(self, file_objects: list[FileObject], output_path: str) -> dict[str, Any]:
         """
         Summary:
@@ -237,114 +301,326 @@ class UploadClient:
 
         return manifest_json
 
-    def stream_upload(self, file_object: FileObject, pool: ThreadPool) -> list[ApplyResult]:
+    def stream_upload(
+        self, file_object: FileObject, pool: ThreadPool, on_complete: Callable[[list[ApplyResult]], None] = None
+    ) -> list[ApplyResult]:
         """
         Summary:
             The function is a wrap to display the uploading process.
             It will submit the async function job to ThreadPool. Each
             of chunk upload process will be queued in pool and scheduled.
+            The chunk data is not read here, each worker reads its own
+            chunk by offset. The number of queued chunks is bounded by
+            the in-flight limit so the memory usage stays around
+            `num_of_thread * chunk_size` regardless of the file size.
         Parameter:
             - file_object(FileObject): the file object that contains correct
                 information for chunk uploading.
+            - pool(ThreadPool): the pool to run chunk uploads.
+            - on_complete(Callable): optional, called with the chunk results
+                once all the chunks are done. it runs in the result thread
+                of pool, so it should not block.
         return:
             - List[ApplyResult]: the result of each chunk upload. and will be
                 used in on_success function to make sure all the chunks have
                 been uploaded.
         """
-        count = 0
 
-        # process on the file content
-        f = open(file_object.local_path, 'rb')
+        # the pending count starts with one for the loop below, so the file
+        # is not completed before all of its chunks are queued
+        pending_chunks = [1]
+        pending_lock = threading.Lock()
+
+        def complete_chunk():
+            with pending_lock:
+                pending_chunks[0] -= 1
+                completed = pending_chunks[0] == 0
+            if completed and on_complete:
+                on_complete(chunk_result)
+
+        def release_chunk(_):
+            self.concurrency.release()
+            complete_chunk()
+
+        def complete_verify(_):
+            complete_chunk()
+
+        # the hashes cached locally for current file content, they are
+        # trusted to skip reading the uploaded chunks again
+        cached_hashes = (
+            self.hash_cache.get(file_object) if self.trust_hash_cache and file_object.uploaded_chunks else {}
+        )
+
         # this will be used to check if the chunk has been uploaded
         # in the on_success function. to make sure on_success is called
         # after all the chunks have been uploaded.
         chunk_result = []
-        while True:
-            chunk = f.read(self.chunk_size)
-            chunk_etag = file_object.uploaded_chunks.get(str(count + 1))
-            if not chunk:
-                break
+        for chunk_number in range(1, file_object.total_chunks + 1):
+            chunk_etag = file_object.uploaded_chunks.get(str(chunk_number))
             # if current chunk has been uploaded to object storage
-            # only check the md5 if the file is same. If ture,
-            # skip current chunk, if not, raise the error.
-            elif chunk_etag:
-                local_chunk_etag = hashlib.md5(chunk).hexdigest()
-                if chunk_etag != local_chunk_etag:
-                    SrvErrorHandler.customized_handle(ECustomizedError.INVALID_CHUNK_UPLOAD, value=count + 1)
-                    raise INVALID_CHUNK_ETAG(count + 1)
+            # only check the md5 if the file is same. the check runs in
+            # hash pool alongside the upload of missing chunks, and the
+            # file will not be finalized if any of chunks is different.
+            if chunk_etag and (
+                file_object.trusted_chunks.get(str(chunk_number)) == chunk_etag
+                or cached_hashes.get(chunk_number) == chunk_etag
+            ):
                 file_object.update_progress(self.chunk_size)
+            elif chunk_etag:
+                with pending_lock:
+                    pending_chunks[0] += 1
+                res = self.get_hash_pool().apply_async(
+                    self.verify_chunk,
+                    args=(file_object, chunk_number, chunk_etag),
+                    callback=complete_verify,
+                    error_callback=complete_verify,
+                )
+                chunk_result.append(res)
             else:
+                self.concurrency.acquire()
+                with pending_lock:
+                    pending_chunks[0] += 1
                 res = pool.apply_async(
                     self.upload_chunk,
-                    args=(file_object, count + 1, chunk),
+                    args=(file_object, chunk_number),
+                    callback=release_chunk,
+                    error_callback=release_chunk,
                 )
                 chunk_result.append(res)
 
-            count += 1  # uploaded successfully
-
-        f.close()
-
+        complete_chunk()
         return chunk_result
 
-    def upload_chunk(self, file_object: FileObject, chunk_number: int, chunk: str) -> None:
+    def upload_file(self, file_object: FileObject, pool: ThreadPool, tags: list[str]) -> Future:
         """
         Summary:
-            The function is to upload a chunk directly into minio storage.
+            The function is to upload the chunks of file in pool and then
+            finalize it in finalizer executor once the last chunk is done.
+            The pool workers never wait for other chunks, so they always
+            move data no matter how many files are in progress.
         Parameter:
             - file_object(FileObject): the file object that contains correct
                 information for chunk uploading.
-            - chunk_number(int): the number of current chunk.
-            - chunk(str): the chunk data.
+            - pool(ThreadPool): the pool to run chunk uploads.
+            - tags(list of str): the tag attached with uploaded object.
+        return:
+            - Future: the result of on_succeed.
+        """
+        # the single chunk files are coroutines instead of pool jobs
+        if AppConfig.Env.upload_async_small_files and file_object.total_chunks == 1 and not file_object.uploaded_chunks:
+            return TransferEngine().submit(self.upload_small_file(file_object, tags))
+
+        finalized = Future()
+
+        def finalize(chunk_result: list[ApplyResult]) -> None:
+            future = self.finalizer.submit(self.on_succeed, file_object, tags, chunk_result)
+            future.add_done_callback(lambda f: chain_future(f, finalized))
+
+        self.stream_upload(file_object, pool, on_complete=finalize)
+        return finalized
+
+    def upload_stream(
+        self,
+        file_object: StreamFileObject,
+        write_stream: Callable[[Callable[[bytes], None]], int],
+        pool: ThreadPool,
+        tags: list[str],
+    ) -> Future:
+        """
+        Summary:
+            The function is to upload a file while it is generated eg. the
+            zip of folder. Each part given by the stream is uploaded as a
+            chunk in pool, the stream is blocked when the in-flight limit
+            is reached, so the generation and the upload overlap and the
+            memory stays around `num_of_thread * chunk_size`. The file is
+            finalized in finalizer executor once the stream ends. On resume,
+            the stream is generated again, and the part of chunk uploaded
+            before is checked against its etag in hash pool instead.
+        Parameter:
+            - file_object(StreamFileObject): the file object of stream.
+            - write_stream(Callable): the function to generate the file, it
+                is called with the callback of parts and returns the size.
+            - pool(ThreadPool): the pool to run chunk uploads.
+            - tags(list of str): the tag attached with uploaded object.
+        return:
+            - Future: the result of on_succeed.
+        """
+        chunk_result = []
+        failed = threading.Event()
+
+        def release_chunk(_):
+            self.concurrency.release()
+
+        def fail_chunk(_):
+            failed.set()
+            self.concurrency.release()
+
+        def on_part(chunk: bytes) -> None:
+            # stop generating the rest of file if a chunk is failed
+            if failed.is_set():
+                for res in chunk_result:
+                    if res.ready() and not res.successful():
+                        res.get()
+            self.concurrency.acquire()
+            chunk_number = len(chunk_result) + 1
+            chunk_etag = file_object.uploaded_chunks.get(str(chunk_number))
+            if chunk_etag:
+                res = self.get_hash_pool().apply_async(
+                    self.verify_chunk,
+                    args=(file_object, chunk_number, chunk_etag, chunk),
+                    callback=release_chunk,
+                    error_callback=fail_chunk,
+                )
+            else:
+                res = pool.apply_async(
+                    self.upload_chunk,
+                    args=(file_object, chunk_number, chunk),
+                    callback=release_chunk,
+                    error_callback=fail_chunk,
+                )
+            chunk_result.append(res)
+
+        total_size = write_stream(on_part)
+        file_object.complete(total_size, len(chunk_result))
+        return self.finalizer.submit(self.on_succeed, file_object, tags, chunk_result)
+
+    def get_hash_pool(self) -> ThreadPool:
+        """The pool to verify uploaded chunks, hashlib releases GIL so threads run in parallel."""
+        with self.hash_pool_lock:
+            if self.hash_pool is None:
+                self.hash_pool = ThreadPool(AppConfig.Env.upload_hash_workers or os.cpu_count())
+            return self.hash_pool
+
+    def verify_chunk(self, file_object: FileObject, chunk_number: int, chunk_etag: str, chunk: bytes = None) -> None:
+        """
+        Summary:
+            The function is to check if the uploaded chunk is the same as
+            the local one by md5.
+        Parameter:
+            - file_object(FileObject): the file object of chunk.
+            - chunk_number(int): the number of chunk.
+            - chunk_etag(str): the etag of uploaded chunk.
+            - chunk(bytes): the chunk data. default None, the chunk will be
+                read from local file by chunk number.
         return:
             - None
         """
+        if chunk is None:
+            chunk = file_object.read_chunk(chunk_number)
 
-        # retry three times
-        for i in range(AppConfig.Env.resilient_retry):
-            if i > 0:
-                SrvErrorHandler.default_handle(f'retry number {i}')
+        local_chunk_etag = hashlib.md5(chunk).hexdigest()
+        if chunk_etag != local_chunk_etag:
+            SrvErrorHandler.customized_handle(ECustomizedError.INVALID_CHUNK_UPLOAD, value=chunk_number)
+            raise INVALID_CHUNK_ETAG(chunk_number)
 
-            file_object.update_progress(0)
+        self.hash_cache.set(file_object, chunk_number, local_chunk_etag)
+        file_object.update_progress(self.chunk_size)
 
-            # request upload service to generate presigned url for the chunk
-            params = {
-                'bucket': self.bucket,
-                'key': file_object.object_path,
-                'upload_id': file_object.resumable_id,
-                'chunk_number': chunk_number,
-            }
-            headers = {'Authorization': 'Bearer ' + self.user.access_token, 'Session-ID': self.user.session_id}
-            response = httpx.get(
-                self.base_url + '/v1/files/chunks/presigned',
-                params=params,
-                headers=headers,
-                timeout=None,
-            )
+    def upload_chunk(self, file_object: FileObject, chunk_number: int, chunk: bytes = None) -> None:
+        """
+        Summary:
+            The function is to upload a chunk directly into minio storage.
+        Parameter:
+            - file_object(FileObject): the file object that contains correct
+                information for chunk uploading.
+            - chunk_number(int): the number of current chunk.
+            - chunk(bytes): the chunk data. default None, the chunk will be
+                read from local file by chunk number.
+        return:
+            - None
+        """
 
-            # then use the presigned url directly uplad to minio
-            if response.status_code == 200:
-                presigned_chunk_url = response.json().get('result')
-                res = httpx.put(presigned_chunk_url, data=chunk, timeout=None)
+        if chunk is None:
+            chunk = file_object.read_chunk(chunk_number)
 
-                if res.status_code != 200:
-                    error_msg = f'Fail to upload the chunck {chunk_number}: {str(res.text)}'
-                    raise Exception(error_msg)
+        res = self.put_chunk(file_object, chunk_number, chunk)
+        if res.status_code != 200:
+            self.concurrency.record(0, congested=True)
+        else:
+            self.concurrency.record(len(chunk), congested=res.extensions.get('retries', 0) > 0)
+        self.complete_chunk(file_object, chunk_number, len(chunk), res)
 
-                # update the progress bar
-                file_object.update_progress(len(chunk))
-                if chunk_number == file_object.total_chunks:
-                    file_object.close_progress()
+        # the response and its stream refer to each other, which keeps
+        # the chunk alive until garbage collection. break the cycle and
+        # only return status and headers, since the result is kept by
+        # ApplyResult until the file is finalized
+        res.stream = httpx.ByteStream(b'')
+        return httpx.Response(res.status_code, headers=res.headers)
 
-                return res
+    def put_chunk(self, file_object: FileObject, chunk_number: int, chunk: bytes) -> httpx.Response:
+        """
+        Summary:
+            The function is to PUT the chunk into minio storage. The presigned
+            url is for single use, so each attempt gets a new one from cache
+            (the urls of next chunks are requested ahead, so most of time it
+            is already cached). The failed attempt is retried with backoff
+            `resilient_retry` times in total, within the `chunk` retry budget.
+        Parameter:
+            - file_object(FileObject): the file object of chunk.
+            - chunk_number(int): the number of chunk.
+            - chunk(bytes): the chunk data.
+        return:
+            - httpx.Response: the response of last attempt, the number of
+                retries is in its `retries` extension.
+        """
+        budget = get_retry_budget('chunk')
+        for attempt in range(AppConfig.Env.resilient_retry):
+            if attempt > 0:
+                SrvErrorHandler.default_handle(f'Chunk Error: retry number {attempt} of chunk {chunk_number}')
+            file_object.update_progress(0)
+            try:
+                presigned_chunk_url = self.presigned_urls.get(file_object, chunk_number)
+            except Exception as e:
+                SrvErrorHandler.default_handle(f'Chunk Error: fail to get presigned url of chunk {chunk_number}')
+                SrvErrorHandler.default_handle(str(e))
+                raise
+
+            can_retry = attempt + 1 < AppConfig.Env.resilient_retry
+            try:
+                res = resilient_session(presigned_chunk_url).put(
+                    presigned_chunk_url,
+                    content=chunk,
+                    timeout=None,
+                    extensions={'retry_class': 'chunk', 'max_retries': 0},
+                )
+            except httpx.TransportError:
+                self.concurrency.record(0, congested=True)
+                if not (can_retry and budget.withdraw()):
+                    raise
             else:
-                SrvErrorHandler.default_handle(f'Chunk Error: retry number {i}')
-                if i == 2:
-                    SrvErrorHandler.default_handle('retry over 3 times')
-                    SrvErrorHandler.default_handle(response.content)
+                res.extensions['retries'] = attempt
+                if res.status_code not in AppConfig.Env.chunk_retry_code or not (can_retry and budget.withdraw()):
+                    return res
+                self.concurrency.record(0, congested=True)
+                res.close()
 
-            # wait certain amount of time and retry
-            # the time will be longer for more retry
-            time.sleep(AppConfig.Env.resilient_retry_interval * (i + 1))
+            time.sleep(backoff_delay(attempt))
+
+    def complete_chunk(self, file_object: FileObject, chunk_number: int, size: int, res: httpx.Response) -> None:
+        """
+        Summary:
+            The function is to check the response of chunk PUT, record the
+            etag of chunk and update the progress.
+        Parameter:
+            - file_object(FileObject): the file object of chunk.
+            - chunk_number(int): the number of chunk.
+            - size(int): the size of chunk.
+            - res(httpx.Response): the response of PUT.
+        """
+        if res.status_code != 200:
+            error_msg = f'Fail to upload the chunck {chunk_number}: {str(res.text)}'
+            raise Exception(error_msg)
+        # the etag of single part is the md5 of chunk, keep it for resume
+        chunk_etag = res.headers.get('ETag', '').strip('"')
+        if chunk_etag:
+            self.hash_cache.set(file_object, chunk_number, chunk_etag)
+            if self.journal is not None:
+                self.journal.record_chunk(file_object, chunk_number, chunk_etag)
+
+        # update the progress bar
+        file_object.update_progress(size)
+        if chunk_number == file_object.total_chunks:
+            file_object.close_progress()
 
     def on_succeed(self, file_object: FileObject, tags: list[str], chunk_result: list[ApplyResult]) -> None:
         """
@@ -359,41 +635,128 @@ class UploadClient:
             - None
         """
 
-        # check if all the chunks have been uploaded
-        for res in chunk_result:
-            while res.get() is None:
-                time.sleep(1)
-
-        for i in range(AppConfig.Env.resilient_retry):
-            url = self.base_url + '/v1/files'
-            payload = uf.generate_on_success_form(
-                self.project_code,
-                self.operator,
-                file_object,
-                tags,
-                [],
-                process_pipeline=self.process_pipeline,
-                upload_message=self.upload_message,
+        # check if all the chunks have been uploaded, raise if any failed
+        try:
+            for res in chunk_result:
+                res.get()
+        finally:
+            self.presigned_urls.forget(file_object)
+
+        # combining the chunks of same upload id is safe to repeat, so the
+        # request is marked as idempotent to be retried by pooled client, and
+        # the combine rejected with a json code is retried here with backoff
+        budget = get_retry_budget('finalize')
+        for attempt in range(AppConfig.Env.resilient_retry):
+            request = self.finalize_request(file_object, tags)
+            response = resilient_session(request['url']).post(
+                **request, extensions={'idempotent': True, 'retry_class': 'finalize'}
             )
-            headers = {
-                'Authorization': 'Bearer ' + self.user.access_token,
-                'Refresh-token': self.user.refresh_token,
-                'Session-ID': self.user.session_id,
-            }
-            response = resilient_session().post(url, json=payload, headers=headers)
-            res_json = response.json()
+            can_retry = attempt + 1 < AppConfig.Env.resilient_retry
+            if not self.combine_rejected(response) or not (can_retry and budget.withdraw()):
+                break
+            SrvErrorHandler.default_handle(f'Combine Error: retry number {attempt + 1}')
+            time.sleep(backoff_delay(attempt))
+
+        return self.complete_file(file_object, response)
+
+    def finalize_request(self, file_object: FileObject, tags: list[str]) -> dict[str, Any]:
+        """The url, payload and headers to combine the chunks of file."""
+        payload = uf.generate_on_success_form(
+            self.project_code,
+            self.operator,
+            file_object,
+            tags,
+            [],
+            process_pipeline=self.process_pipeline,
+            upload_message=self.upload_message,
+        )
+        headers = {
+            'Authorization': self.tokens.bearer(),
+            'Refresh-token': self.user.refresh_token,
+            'Session-ID': self.user.session_id,
+        }
+        return {'url': self.base_url + '/v1/files', 'json': payload, 'headers': headers}
+
+    def combine_rejected(self, response: httpx.Response) -> bool:
+        """The combine is answered with HTTP 200 but a failed json `code`, which the transport does not retry."""
+        return response.status_code == 200 and response.json().get('code') != 200
+
+    def complete_file(self, file_object: FileObject, response: httpx.Response) -> dict[str, Any]:
+        """Check the response of finalize, record the file as done and drop its chunk hashes."""
+        res_json = response.json()
+
+        if res_json.get('code') == 200:
+            # mhandler.SrvOutPutHandler.start_finalizing()
+            if self.journal is not None:
+                self.journal.record_done(file_object)
+            self.hash_cache.delete(file_object)
+            MetadataCache().invalidate(self.project_code, self.zone, file_object.object_path, [file_object.item_id])
+            result = res_json['result']
+            return result
+        else:
+            SrvErrorHandler.default_handle('Combine Error')
+            SrvErrorHandler.default_handle(response.content)
 
-            if res_json.get('code') == 200:
-                # mhandler.SrvOutPutHandler.start_finalizing()
-                result = res_json['result']
-                return result
+    async def upload_small_file(self, file_object: FileObject, tags: list[str]) -> dict[str, Any]:
+        """
+        Summary:
+            The coroutine to upload and finalize a single chunk file in
+            transfer engine. The chunk is read in the default executor once
+            the file has a slot of client(--thread) and of `upload` class, so
+            the memory is bounded by the slots instead of the number of files.
+        Parameter:
+            - file_object(FileObject): the file object of single chunk.
+            - tags(list of str): the tag attached with uploaded object.
+        return:
+            - dict: the result of finalize.
+        """
+        engine = TransferEngine()
+        loop = asyncio.get_running_loop()
+        # the --thread of command is the number of small files in flight
+        if self.small_file_slots is None:
+            self.small_file_slots = asyncio.Semaphore(self.concurrency.maximum)
+        async with self.small_file_slots, engine.limit('upload'):
+            chunk = await loop.run_in_executor(None, file_object.read_chunk, 1)
+            file_object.update_progress(0)
+            res = await self.put_chunk_async(file_object, chunk)
+            # the hash cache, journal and metadata cache are written to disk,
+            # so they are recorded in executor instead of blocking the loop
+            await loop.run_in_executor(None, self.complete_chunk, file_object, 1, len(chunk), res)
+
+        budget = get_retry_budget('finalize')
+        for attempt in range(AppConfig.Env.resilient_retry):
+            request = self.finalize_request(file_object, tags)
+            response = await engine.request(
+                'POST', request_class='finalize', extensions={'idempotent': True}, **request
+            )
+            can_retry = attempt + 1 < AppConfig.Env.resilient_retry
+            if not self.combine_rejected(response) or not (can_retry and budget.withdraw()):
+                break
+            SrvErrorHandler.default_handle(f'Combine Error: retry number {attempt + 1}')
+            await asyncio.sleep(backoff_delay(attempt))
+
+        return await loop.run_in_executor(None, self.complete_file, file_object, response)
+
+    async def put_chunk_async(self, file_object: FileObject, chunk: bytes) -> httpx.Response:
+        """The coroutine of put_chunk for the single chunk file, each attempt requests a new presigned url."""
+        engine = TransferEngine()
+        budget = get_retry_budget('chunk')
+        for attempt in range(AppConfig.Env.resilient_retry):
+            presigned_chunk_url, _ = await self.presigned_urls.request_url_async(file_object, 1)
+            can_retry = attempt + 1 < AppConfig.Env.resilient_retry
+            try:
+                res = await engine.request(
+                    'PUT', presigned_chunk_url, request_class='chunk', content=chunk, extensions={'max_retries': 0}
+                )
+            except httpx.TransportError:
+                if not (can_retry and budget.withdraw()):
+                    raise
             else:
-                SrvErrorHandler.default_handle(f'Combine Error: retry number {i}')
-                SrvErrorHandler.default_handle(response.content)
-                if i == 2:
-                    SrvErrorHandler.default_handle('retry over 3 times')
+                if res.status_code not in AppConfig.Env.chunk_retry_code or not (can_retry and budget.withdraw()):
+                    return res
+                await res.aclose()
 
-            time.sleep(AppConfig.Env.resilient_retry_interval * (i + 1))
+            await asyncio.sleep(backoff_delay(attempt))
 
     @require_valid_token()
     def create_file_lineage(self, source_file: dict, new_file_object: FileObject):
@@ -421,7 +784,7 @@ class UploadClient:
                 'project_code': self.project_code,
                 'action_type': self.process_pipeline,
                 'operator': self.operator,
-                'token': self.user.access_token,
+                'token': self.tokens.access_token,
             }
             create_lineage(lineage_event)
 
@@ -447,16 +810,15 @@ class UploadClient:
 
     def set_finish_upload(self):
         self.finish_upload = True
+        self.tokens.stop()
+        self.finalizer.shutdown(wait=False)
+        self.presigned_urls.close()
+        if self.hash_pool is not None:
+            self.hash_pool.close()
+        self.hash_cache.close()
+        if self.journal is not None:
+            self.journal.close()
 
     def upload_token_refresh(self, azp: str = AppConfig.Env.keycloak_device_client_id):
-        token_manager = SrvTokenManager()
-        DEFAULT_INTERVAL = 2  # seconds to check if the upload is finished
-        total_count = 0  # when total_count equals token_refresh_interval, refresh token
-        while self.finish_upload is not True:
-            if total_count >= AppConfig.Env.token_refresh_interval:
-                token_manager.refresh(azp)
-                total_count = 0
-
-            # if not then sleep for DEFAULT_INTERVAL seconds
-            time.sleep(DEFAULT_INTERVAL)
-            total_count = total_count + DEFAULT_INTERVAL
+        """Refresh the token before it expires until the upload is finished, in a thread of its own."""
+        self.tokens.start(azp)
@@ -0,0 +1,130 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import concurrent.futures
+import threading
+from concurrent.futures import Future
+from typing import Any
+
+from app.configs.app_config import AppConfig
+from app.utils.aggregated import search_item
+from app.utils.aggregated import search_items
+
+
+class PathResolver:
+    """
+    Summary:
+        The resolver of project paths for one command. Each distinct lookup
+        of (project code, path, item type) is sent to server at most once
+        and the result is memoized, so eg. the parent folders shared by the
+        uploaded files are only searched once. The lookups of a call are
+        resolved together:
+         - with the batch endpoint, one request per `search_batch_size` paths.
+         - otherwise, `search_workers` search requests in parallel.
+    """
+
+    def __init__(self, zone: str, max_workers: int = None):
+        self.zone = zone
+        self.max_workers = max_workers or AppConfig.Env.search_workers
+        self.batch_supported = None if AppConfig.Env.search_batch else False
+        self.lookups: dict[tuple[str, str, str], Future] = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, project_code: str, path: str, item_type: str) -> dict[str, Any]:
+        """Return the search response of one path."""
+        return self.resolve_many([(project_code, path, item_type)])[0]
+
+    def resolve_many(self, lookups: list[tuple[str, str, str]]) -> list[dict[str, Any]]:
+        """
+        Summary:
+            The function is to search the paths which are not resolved yet,
+            and return the responses of all lookups in the same order.
+        Parameter:
+            - lookups(list of tuple): the project code, relative path and
+                item type of each lookup.
+        return:
+            - list of dict: the search response of each lookup.
+        """
+        pending = {}
+        futures = []
+        with self.lock:
+            for lookup in lookups:
+                future = self.lookups.get(lookup)
+                if future is None:
+                    future = self.lookups[lookup] = Future()
+                    pending[lookup] = future
+                futures.append(future)
+
+        if pending:
+            self.search(pending)
+        return [future.result() for future in futures]
+
+    def search(self, pending: dict[tuple[str, str, str], Future]) -> None:
+        remaining = list(pending)
+        if len(remaining) == 1:
+            self.fill(pending[remaining[0]], remaining[0])
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            if self.batch_supported is not False:
+                batches = []
+                by_project = {}
+                for lookup in remaining:
+                    by_project.setdefault(lookup[0], []).append(lookup)
+                size = AppConfig.Env.search_batch_size
+                for project_lookups in by_project.values():
+                    batches.extend(project_lookups[i : i + size] for i in range(0, len(project_lookups), size))
+                results = executor.map(self.fill_batch, batches, [pending] * len(batches))
+                remaining = [lookup for batch_remaining in results for lookup in batch_remaining]
+
+            for lookup in remaining:
+                executor.submit(self.fill, pending[lookup], lookup)
+
+    def fill_batch(
+        self, batch: list[tuple[str, str, str]], pending: dict[tuple[str, str, str], Future]
+    ) -> list[tuple[str, str, str]]:
+        """
+        Summary:
+            The function is to search the lookups of one project in one call.
+        Parameter:
+            - batch(list of tuple): the lookups of same project.
+            - pending(dict): the mapping of lookup and its future.
+        return:
+            - list of tuple: the lookups to be searched one by one, since the
+                server does not support the batch endpoint or the call fails.
+                Then the batch endpoint is not used again.
+        """
+        if len(batch) == 1:
+            return batch
+
+        try:
+            responses = self.search_batch(batch)
+        except Exception:
+            responses = None
+        if responses is None or len(responses) != len(batch):
+            self.batch_supported = False
+            return batch
+
+        for lookup, response in zip(batch, responses):
+            pending[lookup].set_result(response)
+        return []
+
+    def search_batch(self, batch: list[tuple[str, str, str]]) -> list[dict[str, Any]]:
+        if self.batch_supported is False:
+            return None
+
+        project_code = batch[0][0]
+        responses = search_items(project_code, self.zone, [(path, item_type) for _, path, item_type in batch])
+        self.batch_supported = responses is not None
+        return responses
+
+    def fill(self, future: Future, lookup: tuple[str, str, str]) -> None:
+        project_code, path, item_type = lookup
+        try:
+            future.set_result(search_item(project_code, self.zone, path, item_type))
+        except BaseException as e:
+            # the exit of permission denied is raised in the caller thread
+            future.set_exception(e)
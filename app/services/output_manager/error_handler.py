@@ -46,6 +46,7 @@ class ECustomizedError(enum.Enum):
     # the error when chunk md5 is not match
     INVALID_CHUNK_UPLOAD = 'INVALID_CHUNK_UPLOAD'
     UNSUPPORT_TAG_MANIFEST = 'UNSUPPORT_TAG_MANIFEST'
+    ZSTD_UNAVAILABLE = 'ZSTD_UNAVAILABLE'
     MANIFEST_NOT_FOUND = 'MANIFEST_NOT_FOUND'
     INVALID_INPUT = 'INVALID_INPUT'
     UNSUPPORTED_PROJECT = 'UNSUPPORTED_PROJECT'
@@ -75,6 +75,9 @@ class FileHELP(enum.Enum):
     FILE_SYNC_ZIP = 'FILE_SYNC_ZIP'
     FILE_SYNC_I = 'FILE_SYNC_I'
     FILE_SYNC_Z = 'FILE_SYNC_Z'
+    FILE_SYNC_PARALLEL = 'FILE_SYNC_PARALLEL'
+    FILE_SYNC_BANDWIDTH = 'FILE_SYNC_BANDWIDTH'
+    FILE_NO_CACHE = 'FILE_NO_CACHE'
     FILE_UPLOAD_P = 'FILE_UPLOAD_P'
     FILE_UPLOAD_G = 'FILE_UPLOAD_G'
     FILE_UPLOAD_A = 'FILE_UPLOAD_A'
@@ -83,6 +86,8 @@ class FileHELP(enum.Enum):
     FILE_UPLOAD_S = 'FILE_UPLOAD_S'
     FILE_UPLOAD_PIPELINE = 'FILE_UPLOAD_PIPELINE'
     FILE_UPLOAD_ZIP = 'FILE_UPLOAD_ZIP'
+    FILE_UPLOAD_ZIP_LEVEL = 'FILE_UPLOAD_ZIP_LEVEL'
+    FILE_UPLOAD_ZIP_FORMAT = 'FILE_UPLOAD_ZIP_FORMAT'
 
 
 def file_help_page(FileHELP: FileHELP):
@@ -6,8 +6,6 @@
 
 import io
 
-import qrcode
-
 import app.services.logger_services.log_functions as logger
 from app.models.service_meta_class import MetaService
 
@@ -16,6 +14,8 @@ class SrvOutPutHandler(metaclass=MetaService):
     @staticmethod
     def login_device_code_qrcode(url: str):
         """Print QRCode with login url!"""
+        import qrcode
+
         qr = qrcode.QRCode(version=1, border=1)
         qr.add_data(url)
         f = io.StringIO()
@@ -184,6 +184,17 @@ class SrvOutPutHandler(metaclass=MetaService):
     def download_success(file_name):
         logger.succeed(f'File has been downloaded successfully and saved to: {file_name}')
 
+    @staticmethod
+    def download_summary(results):
+        """Print the result of each item downloaded in parallel."""
+        failed = [label for label, saved_filename in results if not saved_filename]
+        logger.info(f'Downloaded {len(results) - len(failed)} of {len(results)} items')
+        for label, saved_filename in results:
+            if saved_filename:
+                logger.succeed(f'{label}: saved to {saved_filename}')
+            else:
+                logger.error(f'{label}: failed')
+
     @staticmethod
     def dataset_current_version(version):
         logger.succeed(f'Looking for dataset version: {version}')
@@ -4,42 +4,81 @@
 # Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
 # You may not use this file except in compliance with the License.
 
+import inspect
 from functools import wraps
 
 from app.configs.app_config import AppConfig
 from app.services.output_manager.error_handler import ECustomizedError
 from app.services.output_manager.error_handler import SrvErrorHandler
 
-from .token_manager import SrvTokenManager
-from .user_login_logout import check_is_active
-from .user_login_logout import check_is_login
-from .user_set_config import check_config
+# the services of session are imported on first call, the decorators are
+# applied to the command groups at start, and `--help` does not need them
+
+
+def validate_token(azp: str = AppConfig.Env.keycloak_device_client_id) -> None:
+    """
+    Summary:
+        The function is to make sure the access token is valid for the
+        client, it is refreshed when it is about to expire. The refresh is
+        a http call and waits for the refresh lock of other processes.
+    Parameter:
+        - azp(str): the required client of token.
+    """
+    from .token_provider import TokenProvider
+
+    token_provider = TokenProvider()
+    # the threads finding the same token too old share one refresh
+    token = token_provider.access_token
+    if token_provider.is_valid(token, azp):
+        return
+
+    from .token_manager import SrvTokenManager
+    from .user_login_logout import check_is_login
+
+    check_is_login()
+    token_mgr = SrvTokenManager()
+    token_validation = token_mgr.check_valid(azp)
+
+    def is_valid_callback():
+        pass
+
+    def need_login_callback():
+        SrvErrorHandler.customized_handle(ECustomizedError.LOGIN_SESSION_INVALID, True)
+
+    def need_refresh_callback():
+        token_provider.refresh(azp, token)
+
+    switch_case = {
+        '0': is_valid_callback,
+        '1': need_refresh_callback,
+        '2': need_login_callback,
+    }
+    to_exe = switch_case.get(str(token_validation), is_valid_callback)
+    to_exe()
 
 
 def require_valid_token(azp=AppConfig.Env.keycloak_device_client_id):
     def decorate(func):
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def decorated_async(*args, **kwargs):
+                import asyncio
+
+                from .token_provider import TokenProvider
+
+                # the coroutine runs on the loop of transfer engine, the full
+                # check is in executor so it does not stall other transfers
+                token_provider = TokenProvider()
+                if not token_provider.is_valid(token_provider.access_token, azp):
+                    await asyncio.get_running_loop().run_in_executor(None, validate_token, azp)
+                return await func(*args, **kwargs)
+
+            return decorated_async
+
         @wraps(func)
         def decorated(*args, **kwargs):
-            check_is_login()
-            token_mgr = SrvTokenManager()
-            token_validation = token_mgr.check_valid(azp)
-
-            def is_valid_callback():
-                pass
-
-            def need_login_callback():
-                SrvErrorHandler.customized_handle(ECustomizedError.LOGIN_SESSION_INVALID, True)
-
-            def need_refresh_callback():
-                token_mgr.refresh(azp)
-
-            switch_case = {
-                '0': is_valid_callback,
-                '1': need_refresh_callback,
-                '2': need_login_callback,
-            }
-            to_exe = switch_case.get(str(token_validation), is_valid_callback)
-            to_exe()
+            validate_token(azp)
             return func(*args, **kwargs)
 
         return decorated
@@ -50,6 +89,9 @@ def require_valid_token(azp=AppConfig.Env.keycloak_device_client_id):
 def require_login_session(func):
     @wraps(func)
     def decorated(*args, **kwargs):
+        from .user_login_logout import check_is_active
+        from .user_login_logout import check_is_login
+
         check_is_active()
         check_is_login()
         return func(*args, **kwargs)
@@ -60,6 +102,8 @@ def require_login_session(func):
 def require_config(func):
     @wraps(func)
     def decorated(*args, **kwargs):
+        from .user_set_config import check_config
+
         check_config()
         return func(*args, **kwargs)
 
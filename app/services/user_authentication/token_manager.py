@@ -7,12 +7,12 @@
 import time
 
 import jwt
-import requests
 
 from app.configs.app_config import AppConfig
 from app.configs.user_config import UserConfig
 from app.models.service_meta_class import MetaService
 from app.services.output_manager.error_handler import SrvErrorHandler
+from app.utils.http_pool import HttpClientPool
 
 
 class SrvTokenManager(metaclass=MetaService):
@@ -79,7 +79,7 @@ class SrvTokenManager(metaclass=MetaService):
             payload.update({'client_id': AppConfig.Env.harbor_client_secret})
 
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
-        response = requests.post(url, data=payload, headers=headers)
+        response = HttpClientPool().get_client(url).post(url, data=payload, headers=headers)
         if response.status_code == 200:
             self.update_token(response.json()['access_token'], response.json()['refresh_token'])
         else:
@@ -0,0 +1,152 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import threading
+import time
+
+import jwt
+
+import app.services.logger_services.log_functions as logger
+from app.configs.app_config import AppConfig
+from app.configs.user_config import UserConfig
+from app.models.singleton import Singleton
+from app.utils.file_lock import FileLock
+
+from .token_manager import SrvTokenManager
+
+
+class TokenProvider(metaclass=Singleton):
+    """
+    Summary:
+        The process wide holder of the access token. The workers read the
+        bearer token from memory, and the refresh is single flight: the
+        threads asking to refresh the same token wait for one request and
+        share its result. It is single flight across the processes too:
+        the refresh is done under a file lock by the first process, the
+        others waiting for the lock find the new tokens in config file and
+        use them, so a refresh token is never used after it is rotated.
+        While a long transfer runs, a daemon thread refreshes the token
+        `token_warn_need_refresh` seconds before the `exp` of the token,
+        instead of polling at a fixed interval.
+    """
+
+    def __init__(self):
+        self.token = None
+        self.decoded = (None, {})
+        self.refresh_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    @property
+    def access_token(self) -> str:
+        if self.token is None:
+            self.token = UserConfig().access_token
+        return self.token
+
+    def bearer(self) -> str:
+        return 'Bearer ' + self.access_token
+
+    def claims(self, token: str) -> dict:
+        """The claims of the token, empty if it is not a jwt. They are decoded once per token."""
+        if self.decoded[0] != token:
+            try:
+                claims = jwt.decode(token, verify=False)
+            except (jwt.InvalidTokenError, TypeError, ValueError):
+                claims = {}
+            self.decoded = (token, claims)
+        return self.decoded[1]
+
+    def expires_at(self, token: str) -> float | None:
+        """The `exp` of the token, None if it is unknown."""
+        try:
+            return float(self.claims(token)['exp'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def is_valid(self, token: str, azp: str) -> bool:
+        """
+        Summary:
+            The fast path of token validation with the memoized claims. The
+            token is valid if it is issued for the client and is more than
+            `token_warn_need_refresh` seconds before its `exp`, the same as
+            `SrvTokenManager.check_valid` returning 0.
+        Parameter:
+            - token(str): the access token.
+            - azp(str): the required client of token.
+        return:
+            - bool: True if valid, False if it needs the full check.
+        """
+        expires_at = self.expires_at(token)
+        if expires_at is None or self.claims(token).get('azp') not in [azp, AppConfig.Env.keycloak_device_client_id]:
+            return False
+        return expires_at - time.time() > AppConfig.Env.token_warn_need_refresh
+
+    def refresh(self, azp: str = AppConfig.Env.keycloak_device_client_id, stale_token: str = None) -> str:
+        """
+        Summary:
+            The function is to refresh the access token once for all the
+            threads and processes holding the same stale token. The one
+            waiting for the lock returns the token refreshed before it.
+        Parameter:
+            - azp(str): the client of token.
+            - stale_token(str): optional, the token the caller found too
+                old, default is the current token.
+        return:
+            - str: the current access token.
+        """
+        stale_token = stale_token or self.access_token
+        with self.refresh_lock:
+            if self.access_token != stale_token:
+                return self.access_token
+            with FileLock(f'{AppConfig.Env.user_config_file}.refresh.lock'):
+                user_config = UserConfig()
+                user_config.reload()
+                self.token = user_config.access_token
+                if self.token == stale_token:
+                    SrvTokenManager().refresh(azp)
+                    self.token = user_config.access_token
+        self.wakeup.set()
+        return self.token
+
+    def refresh_delay(self) -> float | None:
+        """The seconds until the token should be refreshed, None if its expiry is unknown."""
+        expires_at = self.expires_at(self.access_token)
+        if expires_at is None:
+            return None
+        return expires_at - AppConfig.Env.token_warn_need_refresh - time.time()
+
+    def run(self, azp: str) -> None:
+        while not self.stopped.is_set():
+            token = self.access_token
+            delay = self.refresh_delay()
+            if delay is None or delay > 0:
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                continue
+
+            try:
+                refreshed = self.refresh(azp, token) != token
+            except Exception as e:
+                logger.warning(f'Failed to refresh the token: {e}')
+                refreshed = False
+            if not refreshed:
+                self.stopped.wait(AppConfig.Env.token_refresh_retry_delay)
+
+    def start(self, azp: str = AppConfig.Env.keycloak_device_client_id) -> None:
+        """Start refreshing the token before it expires, the thread is not one of the transfer workers."""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, args=(azp,), name='token-refresh', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
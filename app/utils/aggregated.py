@@ -10,28 +10,32 @@ import re
 import shutil
 
 import httpx
-import requests
 
 from app.configs.app_config import AppConfig
 from app.configs.user_config import UserConfig
 from app.services.output_manager.error_handler import ECustomizedError
 from app.services.output_manager.error_handler import SrvErrorHandler
 from app.services.user_authentication.decorator import require_valid_token
-from env import ConfigClass
+from app.utils.http_pool import HttpClientPool
+from app.utils.metadata_cache import MetadataCache
 
 
 def get_current_datetime():
     return datetime.datetime.now().isoformat()
 
 
-def resilient_session():
-    headers = {'VM-Info': ConfigClass.VM_INFO}
-    client = httpx.Client(headers=headers, timeout=None)
-    return client
+def resilient_session(url: str = None) -> httpx.Client:
+    """Return the pooled keep-alive client for the host of url, default is the bff host."""
+    return HttpClientPool().get_client(url or AppConfig.Connections.url_bff)
 
 
 @require_valid_token()
 def search_item(project_code, zone, folder_relative_path, item_type, container_type='project'):
+    cache = MetadataCache()
+    cached = cache.get_item(project_code, zone, folder_relative_path, item_type, container_type)
+    if cached is not None:
+        return cached
+
     token = UserConfig().access_token
     url = AppConfig.Connections.url_bff + f'/v1/project/{project_code}/search'
     params = {
@@ -42,21 +46,82 @@ def search_item(project_code, zone, folder_relative_path, item_type, container_t
         'container_type': container_type,
     }
     headers = {'Authorization': 'Bearer ' + token}
-    res = requests.get(url, params=params, headers=headers)
+    res = resilient_session(url).get(url, params=params, headers=headers)
     if res.status_code == 403:
         SrvErrorHandler.customized_handle(ECustomizedError.PERMISSION_DENIED, project_code)
 
-    return res.json()
+    response = res.json()
+    cache.set_item(project_code, zone, folder_relative_path, item_type, container_type, response)
+    return response
 
 
 @require_valid_token()
-def get_file_info_by_geid(geid: list):
+def search_items(project_code, zone, items, container_type='project'):
+    """
+    Summary:
+        The function is to search multiple items of project in one call.
+    Parameter:
+        - project_code(str): the unique identifier of project.
+        - zone(str): the zone of items.
+        - items(list of tuple): the relative path and item type of each item.
+        - container_type(str): default project.
+    return:
+        - list of dict: the response of each item, same as search_item. None
+            if the batch endpoint is not supported by server.
+    """
+    cache = MetadataCache()
+    responses = [cache.get_item(project_code, zone, path, item_type, container_type) for path, item_type in items]
+    missing = [item for item, response in zip(items, responses) if response is None]
+    if not missing:
+        return responses
+
     token = UserConfig().access_token
-    payload = {'geid': geid}
+    url = AppConfig.Connections.url_bff + f'/v1/project/{project_code}' + AppConfig.Env.search_batch_path
+    payload = {
+        'zone': zone,
+        'project_code': project_code,
+        'container_type': container_type,
+        'items': [{'path': path, 'item_type': item_type} for path, item_type in missing],
+    }
     headers = {'Authorization': 'Bearer ' + token}
-    url = AppConfig.Connections.url_bff + '/v1/query/geid'
-    res = resilient_session().post(url, headers=headers, json=payload)
-    return res.json()['result']
+    res = resilient_session(url).post(url, json=payload, headers=headers, extensions={'idempotent': True})
+    if res.status_code in [404, 405, 501]:
+        return None
+    if res.status_code == 403:
+        SrvErrorHandler.customized_handle(ECustomizedError.PERMISSION_DENIED, project_code)
+
+    res.raise_for_status()
+    fetched = iter(res.json().get('result') or [])
+    for index, (path, item_type) in enumerate(items):
+        if responses[index] is None:
+            responses[index] = next(fetched, None)
+            if responses[index] is None:
+                return None
+            cache.set_item(project_code, zone, path, item_type, container_type, responses[index])
+    return responses
+
+
+@require_valid_token()
+def get_file_info_by_geid(geid: list):
+    cache = MetadataCache()
+    cached = cache.get_items_by_geid(list(geid))
+    missing = [x for x in geid if x not in cached]
+    result = []
+    if missing:
+        token = UserConfig().access_token
+        payload = {'geid': missing}
+        headers = {'Authorization': 'Bearer ' + token}
+        url = AppConfig.Connections.url_bff + '/v1/query/geid'
+        res = resilient_session(url).post(url, headers=headers, json=payload)
+        result = res.json()['result']
+        cache.set_items_by_geid(result)
+    if not cached:
+        return result
+
+    # keep the order of queried geids when some of them are from cache
+    fetched = {(item.get('result') or {}).get('id') or item.get('geid'): item for item in result}
+    items = [cached.get(x) or fetched.pop(x, None) for x in geid]
+    return [item for item in items if item is not None] + list(fetched.values())
 
 
 def fit_terminal_width(string_to_format):
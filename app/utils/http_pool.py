@@ -0,0 +1,156 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import atexit
+import importlib.util
+import ipaddress
+import threading
+import urllib.request
+from typing import Any
+
+import httpx
+
+from app.configs.app_config import AppConfig
+from app.models.singleton import Singleton
+from app.utils.http_retry import AsyncRetryTransport
+from app.utils.http_retry import RetryTransport
+from env import ConfigClass
+
+
+def http2_available() -> bool:
+    """HTTP/2 is only negotiated when it is enabled and the `h2` package is installed."""
+    return AppConfig.Env.http2 and importlib.util.find_spec('h2') is not None
+
+
+def environment_proxies() -> dict[str, httpx.Proxy | None]:
+    """
+    Summary:
+        The function is to find the proxies from environment(HTTP_PROXY,
+        HTTPS_PROXY, ALL_PROXY and NO_PROXY) by the url patterns of mounts,
+        the same as httpx finds them for the client without a transport.
+    return:
+        - dict: the url pattern and its proxy, None means no proxy.
+    """
+    proxy_info = urllib.request.getproxies()
+    proxies = {}
+    for scheme in ['http', 'https', 'all']:
+        url = proxy_info.get(scheme)
+        if url:
+            proxies[f'{scheme}://'] = httpx.Proxy(url if '://' in url else f'http://{url}')
+
+    for hostname in proxy_info.get('no', '').split(','):
+        hostname = hostname.strip()
+        if hostname == '*':
+            return {}
+        if not hostname:
+            continue
+        if '://' in hostname:
+            proxies[hostname] = None
+            continue
+        try:
+            address = ipaddress.ip_address(hostname)
+        except ValueError:
+            proxies['all://localhost' if hostname.lower() == 'localhost' else f'all://*{hostname}'] = None
+        else:
+            proxies[f'all://[{hostname}]' if address.version == 6 else f'all://{hostname}'] = None
+    return proxies
+
+
+def client_options(transport_class: type, retry_transport_class: type) -> dict[str, Any]:
+    """
+    Summary:
+        The options of pooled clients, shared by the sync and async ones.
+        The transport is built explicitly and wrapped by the retry one, and
+        so are the transports of proxies from environment. The hosts of
+        NO_PROXY share the transport without proxy.
+    Parameter:
+        - transport_class(type): httpx.HTTPTransport or httpx.AsyncHTTPTransport.
+        - retry_transport_class(type): RetryTransport or AsyncRetryTransport.
+    return:
+        - dict: the keyword arguments of httpx.Client or httpx.AsyncClient.
+    """
+    transport_options = {
+        'limits': httpx.Limits(
+            max_connections=AppConfig.Env.http_max_connections,
+            max_keepalive_connections=AppConfig.Env.http_max_keepalive_connections,
+            keepalive_expiry=AppConfig.Env.http_keepalive_expiry,
+        ),
+        'http2': http2_available(),
+    }
+    transport = retry_transport_class(transport_class(**transport_options))
+    mounts = {}
+    for pattern, proxy in environment_proxies().items():
+        if proxy is None:
+            mounts[pattern] = transport
+        else:
+            mounts[pattern] = retry_transport_class(transport_class(proxy=proxy, **transport_options))
+    return {
+        'headers': {'VM-Info': ConfigClass.VM_INFO},
+        'timeout': None,
+        'transport': transport,
+        'mounts': mounts,
+    }
+
+
+def retry_client() -> httpx.Client:
+    """The httpx.Client whose transports, including the proxy ones from environment, retry by RetryTransport."""
+    return httpx.Client(**client_options(httpx.HTTPTransport, RetryTransport))
+
+
+def async_retry_client() -> httpx.AsyncClient:
+    """The httpx.AsyncClient whose transports, including the proxy ones, retry by AsyncRetryTransport."""
+    return httpx.AsyncClient(**client_options(httpx.AsyncHTTPTransport, AsyncRetryTransport))
+
+
+def client_origin(url: str) -> str:
+    target = httpx.URL(url)
+    return f'{target.scheme}://{target.host}:{target.port}'
+
+
+class HttpClientPool(metaclass=Singleton):
+    """
+    Summary:
+        The process wide connection pool manager. It keeps one keep-alive
+        httpx.Client per host(eg. bff, upload service, minio presigned host)
+        so the TCP/TLS handshake is paid once per host instead of once per
+        request. The httpx.Client is thread safe, so the same client is
+        shared by all the worker threads. The failed requests are retried
+        by RetryTransport.
+    """
+
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def get_client(self, url: str) -> httpx.Client:
+        """
+        Summary:
+            The function is to get the pooled client of the url's host. the
+            client is created on first use.
+        Parameter:
+            - url(str): any url of the target host.
+        return:
+            - httpx.Client: the shared client.
+        """
+        origin = client_origin(url)
+        client = self.clients.get(origin)
+        if client is not None:
+            return client
+
+        with self.lock:
+            client = self.clients.get(origin)
+            if client is None:
+                client = retry_client()
+                self.clients[origin] = client
+        return client
+
+    def close(self) -> None:
+        """Close all the pooled clients and their connections."""
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients = {}
@@ -0,0 +1,242 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from app.configs.app_config import AppConfig
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS', 'TRACE'}
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Summary:
+        The function is to calculate the wait time before next retry with
+        exponential backoff and full jitter, so the parallel workers which
+        fail at same time will not retry in lockstep.
+    Parameter:
+        - attempt(int): the number of retries already done, start from 0.
+    return:
+        - float: the seconds to wait.
+    """
+    ceiling = min(AppConfig.Env.resilient_backoff_max, AppConfig.Env.resilient_backoff * 2**attempt)
+    return random.uniform(0, ceiling)
+
+
+def retry_after_delay(response: httpx.Response) -> float:
+    """
+    Summary:
+        The function is to read the Retry-After header of response. The
+        header can be either seconds or a http date.
+    Parameter:
+        - response(httpx.Response): the response from server.
+    return:
+        - float: the seconds to wait. None if header is missing or invalid.
+    """
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryBudget:
+    """
+    Summary:
+        The retry budget of one request class. Every request deposits
+        `ratio` token and every retry withdraws one, with `reserve` tokens
+        at the beginning. When the service is down, the retries are limited
+        to a ratio of requests instead of multiplying the load.
+    """
+
+    def __init__(self, ratio: float, reserve: float):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.balance = reserve
+        self.lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self.lock:
+            self.balance = min(self.balance + self.ratio, self.reserve)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            return True
+
+
+retry_budgets = {}
+retry_budgets_lock = threading.Lock()
+
+
+def get_retry_budget(request_class: str) -> RetryBudget:
+    """
+    Summary:
+        The function is to get the process wide retry budget of a request
+        class(eg. presign, chunk, finalize). The ratio of class is from
+        `resilient_retry_budget` config and falls back to `default`.
+    Parameter:
+        - request_class(str): the name of request class.
+    return:
+        - RetryBudget: the shared budget.
+    """
+    with retry_budgets_lock:
+        budget = retry_budgets.get(request_class)
+        if budget is None:
+            ratios = AppConfig.Env.resilient_retry_budget
+            ratio = ratios.get(request_class, ratios['default'])
+            budget = RetryBudget(ratio, AppConfig.Env.resilient_retry_budget_reserve)
+            retry_budgets[request_class] = budget
+        return budget
+
+
+class RetryPolicy:
+    """
+    Summary:
+        The retry policy shared by the sync and async transports. The
+        failed requests are retried with exponential backoff and full
+        jitter. The Retry-After header from server is respected.
+         - the responses with `resilient_retry_code` are retried for the
+           idempotent requests.
+         - the connection failures are retried for all requests since the
+           request did not reach the server.
+         - the other transport errors are retried for idempotent requests.
+        A request can be marked as idempotent, be assigned to a retry
+        budget class and limit its retries by extensions, eg.
+            client.post(url, extensions={'idempotent': True, 'retry_class': 'finalize'})
+            client.put(presigned_url, extensions={'retry_class': 'chunk', 'max_retries': 0})
+    """
+
+    def is_idempotent(self, request: httpx.Request) -> bool:
+        return request.method in IDEMPOTENT_METHODS or bool(request.extensions.get('idempotent'))
+
+    def max_retries(self, request: httpx.Request) -> int:
+        return request.extensions.get('max_retries', AppConfig.Env.resilient_retry)
+
+    def retry_delay(
+        self,
+        request: httpx.Request,
+        attempt: int,
+        budget: RetryBudget,
+        response: httpx.Response = None,
+        error: httpx.TransportError = None,
+    ) -> float:
+        """
+        Summary:
+            The function is to decide if the failed attempt is retried.
+        Parameter:
+            - request(httpx.Request): the request.
+            - attempt(int): the number of retries already done.
+            - budget(RetryBudget): the retry budget of request class.
+            - response(httpx.Response): the response of attempt, if any.
+            - error(httpx.TransportError): the error of attempt, if any.
+        return:
+            - float: the seconds to wait before retry. None if the response
+                is returned or the error is raised to caller.
+        """
+        idempotent = self.is_idempotent(request)
+        if error is not None:
+            connect_error = isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
+            if (not connect_error and not idempotent) or attempt >= self.max_retries(request):
+                return None
+            return backoff_delay(attempt) if budget.withdraw() else None
+
+        if (
+            response.status_code not in AppConfig.Env.resilient_retry_code
+            or not idempotent
+            or attempt >= self.max_retries(request)
+        ):
+            return None
+
+        # server asks to wait longer than we accept, return the response
+        # to caller instead of holding the worker
+        retry_after = retry_after_delay(response)
+        if retry_after is not None and retry_after > AppConfig.Env.resilient_retry_after_max:
+            return None
+        if not budget.withdraw():
+            return None
+        return max(retry_after or 0, backoff_delay(attempt))
+
+
+class RetryTransport(RetryPolicy, httpx.BaseTransport):
+    """The transport wraps another transport and retries the failed requests by RetryPolicy."""
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        budget = get_retry_budget(request.extensions.get('retry_class', 'default'))
+        budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                response = self.transport.handle_request(request)
+            except httpx.TransportError as e:
+                delay = self.retry_delay(request, attempt, budget, error=e)
+                if delay is None:
+                    raise
+            else:
+                # let caller know the service was struggling, eg. to adjust concurrency
+                response.extensions['retries'] = attempt
+                delay = self.retry_delay(request, attempt, budget, response=response)
+                if delay is None:
+                    return response
+                response.close()
+
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRetryTransport(RetryPolicy, httpx.AsyncBaseTransport):
+    """The async transport wraps another async transport and retries the failed requests by RetryPolicy."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        budget = get_retry_budget(request.extensions.get('retry_class', 'default'))
+        budget.deposit()
+
+        attempt = 0
+        while True:
+            try:
+                response = await self.transport.handle_async_request(request)
+            except httpx.TransportError as e:
+                delay = self.retry_delay(request, attempt, budget, error=e)
+                if delay is None:
+                    raise
+            else:
+                response.extensions['retries'] = attempt
+                delay = self.retry_delay(request, attempt, budget, response=response)
+                if delay is None:
+                    return response
+                await response.aclose()
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
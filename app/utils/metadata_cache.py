@@ -0,0 +1,201 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from app.configs.app_config import AppConfig
+from app.configs.user_config import UserConfig
+from app.models.singleton import Singleton
+
+# the version of tables, the tables of older version are dropped
+SCHEMA_VERSION = 1
+
+
+class MetadataCache(metaclass=Singleton):
+    """
+    Summary:
+        The process wide cache of item metadata from bff in a sqlite file
+        under the cli config folder, so the repeated searches of one
+        command(eg. the parent folders of files in `file sync`) are sent
+        once, and the repeated commands on same project can skip them. The
+        items are keyed by (project, zone, path, type) from search_item and
+        by geid from get_file_info_by_geid, and expire after the short
+        `metadata_cache_ttl`, since they can be changed by other users or
+        the web portal.
+        Only the settled items are cached: the found items of search and
+        the ACTIVE items of geid query, so the status polling of upload is
+        never served from cache. The items under a path are invalidated
+        when cli writes there(upload, folder creation). The cache is best
+        effort, any error of it is ignored. It can be disabled by the
+        `--no-cache` option of commands.
+        The items are scoped by the user and the bff url, since they are
+        only cached once the user has the permission to read them, so
+        the items of other user or platform are never returned.
+    """
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or AppConfig.Env.metadata_cache_path
+        self.ttl = AppConfig.Env.metadata_cache_ttl
+        self.enabled = AppConfig.Env.metadata_cache
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self.connection = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            if self.connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                self.connection.execute('DROP TABLE IF EXISTS item')
+                self.connection.execute('DROP TABLE IF EXISTS item_geid')
+                self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS item ('
+                'scope TEXT, project_code TEXT, zone TEXT, path TEXT, item_type TEXT, container_type TEXT, '
+                'response TEXT, expires REAL, PRIMARY KEY (scope, project_code, zone, path, item_type, container_type))'
+            )
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS item_geid ('
+                'scope TEXT, geid TEXT, item TEXT, expires REAL, PRIMARY KEY (scope, geid))'
+            )
+            now = time.time()
+            self.connection.execute('DELETE FROM item WHERE expires < ?', (now,))
+            self.connection.execute('DELETE FROM item_geid WHERE expires < ?', (now,))
+        return self.connection
+
+    def scope(self) -> str:
+        """The user and platform of cached items."""
+        return f'{UserConfig().username}@{AppConfig.Connections.url_bff}'
+
+    def get_item(
+        self, project_code: str, zone: str, path: str, item_type: str, container_type: str
+    ) -> dict[str, Any] | None:
+        """
+        Summary:
+            The function is to get the cached response of search_item.
+        return:
+            - dict: the response, None if it is not cached or expired.
+        """
+        if not self.enabled:
+            return None
+        try:
+            with self.lock:
+                row = (
+                    self.connect()
+                    .execute(
+                        'SELECT response FROM item WHERE scope = ? AND project_code = ? AND zone = ? AND path = ? '
+                        'AND item_type = ? AND container_type = ? AND expires >= ?',
+                        (self.scope(), project_code, str(zone).lower(), path, item_type, container_type, time.time()),
+                    )
+                    .fetchone()
+                )
+            return json.loads(row[0]) if row else None
+        except (OSError, sqlite3.Error, ValueError):
+            return None
+
+    def set_item(
+        self, project_code: str, zone: str, path: str, item_type: str, container_type: str, response: dict[str, Any]
+    ) -> None:
+        """Cache the response of search_item if the item is found."""
+        if not self.enabled or response.get('code') != 200 or not response.get('result'):
+            return
+        try:
+            with self.lock:
+                self.connect().execute(
+                    'INSERT OR REPLACE INTO item VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        self.scope(),
+                        project_code,
+                        str(zone).lower(),
+                        path,
+                        item_type,
+                        container_type,
+                        json.dumps(response),
+                        time.time() + self.ttl,
+                    ),
+                )
+        except (OSError, sqlite3.Error, ValueError):
+            pass
+
+    def get_items_by_geid(self, geids: list[str]) -> dict[str, dict[str, Any]]:
+        """
+        Summary:
+            The function is to get the cached items of get_file_info_by_geid.
+        Parameter:
+            - geids(list of str): the geids to query.
+        return:
+            - dict: the mapping of geid and item, for the cached geids only.
+        """
+        if not self.enabled or not geids:
+            return {}
+        try:
+            with self.lock:
+                rows = (
+                    self.connect()
+                    .execute(
+                        f'SELECT geid, item FROM item_geid WHERE scope = ? AND geid IN ({", ".join("?" * len(geids))}) '
+                        'AND expires >= ?',
+                        (self.scope(), *geids, time.time()),
+                    )
+                    .fetchall()
+                )
+            return {geid: json.loads(item) for geid, item in rows}
+        except (OSError, sqlite3.Error, ValueError):
+            return {}
+
+    def set_items_by_geid(self, items: list[dict[str, Any]]) -> None:
+        """Cache the ACTIVE items of get_file_info_by_geid."""
+        if not self.enabled:
+            return
+        scope, expires = self.scope(), time.time() + self.ttl
+        rows = [
+            (scope, item['result']['id'], json.dumps(item), expires)
+            for item in items
+            if item.get('status') == 'success' and item.get('result', {}).get('status') == 'ACTIVE'
+        ]
+        try:
+            with self.lock:
+                self.connect().executemany('INSERT OR REPLACE INTO item_geid VALUES (?, ?, ?, ?)', rows)
+        except (OSError, sqlite3.Error, ValueError):
+            pass
+
+    def invalidate(self, project_code: str, zone: str, path: str, geids: list[str] = None) -> None:
+        """
+        Summary:
+            The function is to remove the cached items at the path and
+            under it, since cli is writing there.
+        Parameter:
+            - project_code(str): the unique identifier of project.
+            - zone(str): the zone of path.
+            - path(str): the relative path in project.
+            - geids(list of str): optional, the geids of written items.
+        """
+        # the writes are invalidated even if cache is disabled for the reads
+        path = path.strip('/')
+        prefix = path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '/%' if path else '%'
+        try:
+            with self.lock:
+                connection = self.connect()
+                connection.execute(
+                    "DELETE FROM item WHERE project_code = ? AND zone = ? AND (path = ? OR path LIKE ? ESCAPE '\\')",
+                    (project_code, str(zone).lower(), path, prefix),
+                )
+                if geids:
+                    connection.executemany('DELETE FROM item_geid WHERE geid = ?', [(geid,) for geid in geids])
+        except (OSError, sqlite3.Error):
+            pass
+
+    def close(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,142 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import asyncio
+import atexit
+import concurrent.futures
+import threading
+from contextlib import asynccontextmanager
+from typing import Any
+from typing import AsyncIterator
+from typing import Coroutine
+
+import httpx
+
+from app.configs.app_config import AppConfig
+from app.models.singleton import Singleton
+from app.utils.http_pool import async_retry_client
+from app.utils.http_pool import client_origin
+
+
+class TransferEngine(metaclass=Singleton):
+    """
+    Summary:
+        The process wide asyncio engine of transfers. One event loop runs
+        in a daemon thread and the transfers are coroutines on it, so
+        thousands of small files can be in flight with one thread instead
+        of a thread each. The requests of each class(eg. presign, chunk,
+        finalize, status, download) are bounded by a semaphore sized from
+        `transfer_engine_limits` instead of a thread count. The keep-alive
+        clients are pooled per host like HttpClientPool, and the failed
+        requests are retried by AsyncRetryTransport.
+        The sync services submit the coroutines by `submit` or `run`, so
+        they keep their sync interface.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        # the clients and semaphores are only used in the loop thread
+        self.clients = {}
+        self.semaphores = {}
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Start the event loop thread on first use."""
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name='transfer-engine', daemon=True)
+                self.thread.start()
+            return self.loop
+
+    def submit(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        """Schedule the coroutine in engine, return the future of its result."""
+        future = concurrent.futures.Future()
+
+        async def run() -> None:
+            # the SystemExit of error handler is given to the caller, it
+            # would stop the loop of engine if raised from the task
+            try:
+                result = await coroutine
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+        asyncio.run_coroutine_threadsafe(run(), self.start())
+        return future
+
+    def run(self, coroutine: Coroutine) -> Any:
+        """Run the coroutine in engine and wait for its result."""
+        return self.submit(coroutine).result()
+
+    def limit(self, request_class: str) -> asyncio.Semaphore:
+        """The semaphore of request class, the size is from `transfer_engine_limits` and falls back to `default`."""
+        semaphore = self.semaphores.get(request_class)
+        if semaphore is None:
+            limits = AppConfig.Env.transfer_engine_limits
+            semaphore = asyncio.Semaphore(limits.get(request_class, limits['default']))
+            self.semaphores[request_class] = semaphore
+        return semaphore
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        origin = client_origin(url)
+        client = self.clients.get(origin)
+        if client is None:
+            client = async_retry_client()
+            self.clients[origin] = client
+        return client
+
+    async def request(self, method: str, url: str, request_class: str = 'default', **kwargs: Any) -> httpx.Response:
+        """
+        Summary:
+            The function is to send the request once the request class has
+            a free slot. The class is also the retry budget class.
+        Parameter:
+            - method(str): the http method.
+            - url(str): the url of request.
+            - request_class(str): the class of request eg. presign, chunk.
+            - kwargs: the other arguments of httpx.AsyncClient.request.
+        return:
+            - httpx.Response: the response.
+        """
+        extensions = {'retry_class': request_class, **kwargs.pop('extensions', {})}
+        async with self.limit(request_class):
+            return await self.get_client(url).request(method, url, extensions=extensions, **kwargs)
+
+    @asynccontextmanager
+    async def stream(
+        self, method: str, url: str, request_class: str = 'download', **kwargs: Any
+    ) -> AsyncIterator[httpx.Response]:
+        """Send the request and hold the slot of request class until its response is consumed."""
+        extensions = {'retry_class': request_class, **kwargs.pop('extensions', {})}
+        async with self.limit(request_class):
+            async with self.get_client(url).stream(method, url, extensions=extensions, **kwargs) as response:
+                yield response
+
+    async def aclose_clients(self) -> None:
+        for client in self.clients.values():
+            await client.aclose()
+        self.clients = {}
+
+    def close(self) -> None:
+        """Close the clients and stop the event loop."""
+        with self.lock:
+            if self.loop is None:
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self.aclose_clients(), self.loop).result(timeout=5)
+            except Exception:
+                pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
+            if not self.loop.is_running():
+                self.loop.close()
+            self.loop = None
+            self.thread = None
+            self.semaphores = {}
@@ -30,6 +30,11 @@ class Settings(BaseSettings):
 
     VM_INFO: str = ''
 
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    http2: bool = True
+
     def modify_values(self, settings):
         settings.url_authn = settings.base_url + 'portal/users/auth'
         settings.url_refresh_token = settings.base_url + 'portal/users/refresh'
@@ -6,11 +6,15 @@
 
 import click
 
+from app.commands.file import file_download
+from app.commands.file import file_list
 from app.commands.file import file_put
 from app.commands.file import file_resume
 from app.services.file_manager.file_upload.models import FileObject
 from app.services.output_manager.error_handler import ECustomizedError
 from app.services.output_manager.error_handler import customized_error_msg
+from app.utils.metadata_cache import MetadataCache
+from tests.conftest import decoded_token
 
 
 def test_file_upload_command_success_with_attribute(mocker, cli_runner):
@@ -61,3 +65,59 @@ def test_resumable_upload_command_failed_with_file_not_exists(mocker, cli_runner
     result = cli_runner.invoke(file_resume, ['--resumable-manifest', 'test.json', '--thread', 1])
     assert result.exit_code == 0
     assert result.output == customized_error_msg(ECustomizedError.INVALID_RESUMABLE) + '\n'
+
+
+def test_resumable_upload_command_with_auto_thread(mocker, cli_runner):
+    mocker.patch('os.path.exists', return_value=True)
+    mocker.patch('builtins.open', mocker.mock_open(read_data='test'))
+    mocker.patch('json.load', return_value={'resumable_manifest': 'test.json'})
+    mocker.patch('app.commands.file.validate_upload_event', return_value=None)
+    resume_upload_mock = mocker.patch('app.commands.file.resume_upload', return_value=None)
+
+    result = cli_runner.invoke(file_resume, ['--resumable-manifest', 'test.json', '--thread', 'auto'])
+    assert result.exit_code == 0
+    resume_upload_mock.assert_called_once_with({'resumable_manifest': 'test.json'}, 'auto', False, 'test.json')
+
+
+def test_resumable_upload_command_failed_with_invalid_thread(mocker, cli_runner):
+    resume_upload_mock = mocker.patch('app.commands.file.resume_upload', return_value=None)
+
+    result = cli_runner.invoke(file_resume, ['--resumable-manifest', 'test.json', '--thread', '0'])
+    assert result.exit_code == 2
+    assert 'should be at least 1' in result.output
+    resume_upload_mock.assert_not_called()
+
+
+def test_file_sync_command_downloads_in_parallel(mocker, cli_runner, tmp_path):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+    item = {'code': 200, 'result': {'id': 'geid', 'name': 'file'}}
+    mocker.patch('app.services.file_manager.path_resolver.search_items', return_value=None)
+    mocker.patch('app.services.file_manager.path_resolver.search_item', return_value=item)
+    parallel_mock = mocker.patch('app.commands.file.download_items_in_parallel', return_value=[])
+
+    result = cli_runner.invoke(
+        file_download,
+        ['test_project/file_1', 'test_project/file_2', str(tmp_path), '--parallel', 2, '--bandwidth-limit', 10],
+    )
+
+    assert result.exit_code == 0
+    output_path, item_res, zone, num_of_parallel, limiter = parallel_mock.call_args.args
+    assert len(item_res) == 2 and num_of_parallel == 2
+    assert limiter.rate == 10 * 1024 * 1024
+
+
+def test_file_list_command_skips_metadata_cache(mocker, cli_runner):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+    list_mock = mocker.patch('app.commands.file.SrvFileList.list_files_without_pagination', return_value=None)
+
+    result = cli_runner.invoke(file_list, ['test_project/admin', '--detached', '--no-cache'])
+
+    assert result.exit_code == 0
+    list_mock.assert_called_once()
+    assert MetadataCache().enabled is False
@@ -0,0 +1,203 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from app.configs.app_config import AppConfig
+from app.configs.user_config import UserConfig
+from app.models.singleton import Singleton
+from app.services.crypto import crypto
+
+
+@pytest.fixture
+def user_config(monkeypatch, tmp_path):
+    # restore the real token properties which are mocked in conftest
+    monkeypatch.undo()
+    monkeypatch.setattr(AppConfig.Env, 'user_config_path', str(tmp_path))
+    monkeypatch.setattr(AppConfig.Env, 'user_config_file', str(tmp_path / 'config.ini'))
+    monkeypatch.setattr(Singleton, '_instances', {})
+    crypto.derive_key.cache_clear()
+    yield UserConfig()
+
+
+def reload_user_config(monkeypatch) -> UserConfig:
+    """The user config of another process."""
+    monkeypatch.setattr(Singleton, '_instances', {})
+    return UserConfig()
+
+
+def save_worker_fields(config_path: str, worker: int, rounds: int) -> None:
+    AppConfig.Env.user_config_path = config_path
+    AppConfig.Env.user_config_file = os.path.join(config_path, 'config.ini')
+    user_config = UserConfig()
+    for i in range(rounds):
+        user_config.config['USER'][f'worker_{worker}'] = str(i)
+        user_config.save()
+
+
+def test_derive_key_is_cached_per_secret():
+    crypto.derive_key.cache_clear()
+    secret = crypto.generate_secret()
+
+    key = crypto.derive_key(secret)
+
+    assert crypto.derive_key(secret) == key
+    assert crypto.derive_key(crypto.generate_secret()) != key
+    assert crypto.derive_key.cache_info().hits == 1
+
+
+def test_encrypted_field_decrypts_only_once(user_config, mocker):
+    user_config.access_token = 'test-access-token'
+    user_config.save()
+    decryption_spy = mocker.spy(crypto, 'decryption')
+    mocker.patch('app.configs.user_config.decryption', decryption_spy)
+
+    for _ in range(10):
+        assert user_config.access_token == 'test-access-token'
+
+    assert decryption_spy.call_count == 1
+
+
+def test_setter_refreshes_cached_value(user_config):
+    user_config.refresh_token = 'old-token'
+    assert user_config.refresh_token == 'old-token'
+
+    user_config.refresh_token = 'new-token'
+
+    assert user_config.refresh_token == 'new-token'
+
+
+def test_clear_invalidates_cached_value(user_config, mocker):
+    user_config.username = 'test-user'
+    assert user_config.username == 'test-user'
+
+    user_config.clear()
+
+    handle_mock = mocker.patch('app.services.crypto.crypto.ehandler.SrvErrorHandler.customized_handle')
+    assert user_config.username is None
+    handle_mock.assert_called_once()
+
+
+def test_access_token_property_micro_benchmark(user_config):
+    user_config.access_token = 'test-access-token'
+    user_config.save()
+    crypto.derive_key.cache_clear()
+
+    start = time.perf_counter()
+    user_config.access_token
+    first_access = time.perf_counter() - start
+
+    rounds = 1000
+    start = time.perf_counter()
+    for _ in range(rounds):
+        user_config.access_token
+    cached_access = (time.perf_counter() - start) / rounds
+
+    # the first read pays the key derivation, the rest are dictionary lookups
+    assert cached_access * 100 < first_access
+
+
+def test_last_active_is_written_at_coarse_granularity(user_config, mocker):
+    replace_spy = mocker.spy(os, 'replace')
+    last_active = int(user_config.last_active)
+
+    user_config.last_active = str(last_active + 10)
+    user_config.save()
+    assert replace_spy.call_count == 0
+
+    user_config.last_active = str(last_active + AppConfig.Env.session_active_granularity)
+    user_config.save()
+    assert replace_spy.call_count == 1
+
+
+def test_save_keeps_fields_written_by_other_process(user_config, monkeypatch):
+    user_config.access_token = 'old-token'
+    user_config.save()
+
+    other_config = reload_user_config(monkeypatch)
+    other_config.access_token = 'refreshed-token'
+    other_config.save()
+
+    last_active = str(int(user_config.last_active) + AppConfig.Env.session_active_granularity)
+    user_config.last_active = last_active
+    user_config.save()
+
+    assert reload_user_config(monkeypatch).access_token == 'refreshed-token'
+    assert user_config.access_token == 'refreshed-token'
+    assert user_config.last_active == last_active
+
+
+def test_save_after_other_login_keeps_new_session(user_config, monkeypatch):
+    user_config.username = 'old-user'
+    user_config.access_token = 'old-token'
+    user_config.session_id = 'old-session'
+    user_config.save()
+
+    other_config = reload_user_config(monkeypatch)
+    other_config.username = 'new-user'
+    other_config.access_token = 'new-token'
+    other_config.session_id = 'new-session'
+    other_config.save()
+
+    # the long running process refreshes its token of the old session
+    user_config.access_token = 'refreshed-old-token'
+    user_config.last_active = str(int(user_config.last_active) + AppConfig.Env.session_active_granularity)
+    user_config.save()
+
+    reloaded = reload_user_config(monkeypatch)
+    assert (reloaded.username, reloaded.access_token, reloaded.session_id) == ('new-user', 'new-token', 'new-session')
+    assert user_config.access_token == 'new-token'
+
+
+def test_save_after_other_logout_keeps_logout(user_config, monkeypatch):
+    user_config.access_token = 'old-token'
+    user_config.save()
+
+    other_config = reload_user_config(monkeypatch)
+    other_config.clear()
+
+    user_config.refresh_token = 'new-refresh-token'
+    user_config.save()
+
+    reloaded = reload_user_config(monkeypatch)
+    assert reloaded.config['USER']['access_token'] == ''
+    assert reloaded.config['USER']['refresh_token'] == ''
+
+
+def test_login_replaces_session_of_other_process(user_config, monkeypatch):
+    user_config.session_id = 'old-session'
+    user_config.save()
+
+    other_config = reload_user_config(monkeypatch)
+    other_config.clear()
+
+    user_config.access_token = 'login-token'
+    user_config.session_id = 'login-session'
+    user_config.save()
+
+    reloaded = reload_user_config(monkeypatch)
+    assert (reloaded.access_token, reloaded.session_id) == ('login-token', 'login-session')
+
+
+def test_concurrent_processes_do_not_lose_updates(user_config, tmp_path):
+    workers, rounds = 4, 20
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=save_worker_fields, args=(str(tmp_path), worker, rounds)) for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+
+    assert [process.exitcode for process in processes] == [0] * workers
+    user_config.config.read(AppConfig.Env.user_config_file)
+    assert [user_config.config['USER'][f'worker_{worker}'] for worker in range(workers)] == [str(rounds - 1)] * workers
+    assert not os.path.exists(f'{AppConfig.Env.user_config_file}.tmp')
@@ -0,0 +1,75 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Object storage serving `server.content` at any path.
+
+    The `Range` header is honoured unless `server.ranges` is False, or the
+    `If-Range` is not `server.etag`. Each connection is throttled to
+    `server.rate` bytes per second to act like a single TCP stream over
+    WAN. When `server.fail_after` is set, the connection is closed after
+    sending that many bytes. The requests are recorded in `requests`.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        content = server.content
+        with server.lock:
+            server.requests.append(self.headers.get('Range'))
+
+        matched = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+        if_range = self.headers.get('If-Range')
+        if matched and server.ranges and if_range in [None, server.etag]:
+            first_byte = int(matched.group(1))
+            last_byte = min(int(matched.group(2) or len(content) - 1), len(content) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {first_byte}-{last_byte}/{len(content)}')
+        else:
+            first_byte, last_byte = 0, len(content) - 1
+            self.send_response(200)
+        self.send_header('Content-Length', str(last_byte - first_byte + 1))
+        self.send_header('ETag', server.etag)
+        self.end_headers()
+
+        block = 64 * 1024
+        for offset in range(first_byte, last_byte + 1, block):
+            if server.fail_after is not None and offset - first_byte >= server.fail_after:
+                self.close_connection = True
+                return
+            self.wfile.write(content[offset : min(offset + block, last_byte + 1)])
+            if server.rate:
+                time.sleep(block / server.rate)
+
+
+@pytest.fixture
+def range_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    server.content = b''
+    server.ranges = True
+    server.rate = 0
+    server.etag = '"etag"'
+    server.fail_after = None
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
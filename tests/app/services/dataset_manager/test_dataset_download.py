@@ -3,3 +3,55 @@
 # Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
 # Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
 # You may not use this file except in compliance with the License.
+
+import os
+
+from app.configs.app_config import AppConfig
+from app.services.dataset_manager.dataset_download import SrvDatasetDownloadManager
+from app.services.file_manager.file_download.partial_download import PartialDownload
+from tests.conftest import decoded_token
+
+
+def test_send_download_request_continues_part_file(range_server, mocker, monkeypatch, tmp_path):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+    monkeypatch.setattr(AppConfig.Env, 'download_segment_min_size', 1024)
+    range_server.content = os.urandom(1024 * 8)
+
+    # the previous run downloaded the first half
+    partial = PartialDownload(str(tmp_path / 'testdataset_v1.zip'))
+    partial.load('"etag"', len(range_server.content))
+    with open(partial.part_path, 'wb') as f:
+        f.write(range_server.content[: 1024 * 4])
+    partial.record(0, 1024 * 4 - 1)
+    partial.close()
+
+    download_manager = SrvDatasetDownloadManager(str(tmp_path), 'testdataset', 'geid')
+    download_manager.version = 'v1'
+    download_manager.download_url = range_server.base_url + '/dataset.zip?signature=test'
+    saved_filename = download_manager.send_download_request()
+
+    assert os.path.basename(saved_filename).startswith('testdataset_v1_')
+    with open(saved_filename, 'rb') as f:
+        assert f.read() == range_server.content
+    assert all(not request.startswith('bytes=0-') for request in range_server.requests[1:])
+    assert os.listdir(tmp_path) == [os.path.basename(saved_filename)]
+
+
+def test_send_download_request_streams_without_ranges(range_server, mocker, tmp_path):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+    range_server.content = os.urandom(1024 * 1024 * 5 + 7)
+    range_server.ranges = False
+
+    download_manager = SrvDatasetDownloadManager(str(tmp_path), 'testdataset', 'geid')
+    download_manager.download_url = range_server.base_url + '/dataset.zip'
+    saved_filename = download_manager.send_download_request()
+
+    with open(saved_filename, 'rb') as f:
+        assert f.read() == range_server.content
+    assert range_server.requests == ['bytes=0-0', None]
@@ -0,0 +1,135 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import asyncio
+import os
+import threading
+import time
+
+from app.configs.app_config import AppConfig
+from app.services.file_manager.file_download.batch_download import download_items_in_parallel
+from app.services.file_manager.file_download.download_client import SrvFileDownload
+from app.services.file_manager.file_download.download_sink import DownloadSink
+from app.services.file_manager.file_download.download_sink import ThrottledProgress
+from app.services.output_manager.error_handler import ECustomizedError
+from app.services.output_manager.error_handler import SrvErrorHandler
+from app.utils.transfer_engine import TransferEngine
+from tests.conftest import decoded_token
+
+
+def test_items_are_downloaded_in_parallel_with_summary(mocker, tmp_path):
+    mocker.patch.object(AppConfig.Env, 'download_async', False)
+    item_res = [{'status': 'success', 'result': {'name': f'file_{i}'}, 'geid': f'geid_{i}'} for i in range(8)]
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def simple_download_file(self, output_path, items):
+        assert self.progress is not None and self.interactive is False
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.1)
+        with lock:
+            running[0] -= 1
+
+        name = items[0]['result']['name']
+        if name == 'file_3':
+            raise Exception('connection reset')
+        if name == 'file_5':
+            return None
+        return f'{output_path}/{name}'
+
+    mocker.patch.object(SrvFileDownload, 'simple_download_file', simple_download_file)
+    summary_mock = mocker.patch('app.services.output_manager.message_handler.SrvOutPutHandler.download_summary')
+
+    results = download_items_in_parallel(str(tmp_path), item_res, 'core', 4)
+
+    assert running[1] == 4
+    assert sorted(results) == sorted((f'file_{i}', None if i in [3, 5] else f'{tmp_path}/file_{i}') for i in range(8))
+    summary_mock.assert_called_once_with(results)
+
+
+def test_items_are_downloaded_as_coroutines(mocker, tmp_path):
+    item_res = [{'status': 'success', 'result': {'name': f'file_{i}'}, 'geid': f'geid_{i}'} for i in range(8)]
+    running = [0, 0]
+    threads = set()
+
+    async def simple_download_file_async(self, output_path, items):
+        assert self.progress is not None and self.interactive is False
+        threads.add(threading.current_thread().name)
+        running[0] += 1
+        running[1] = max(running)
+        await asyncio.sleep(0.1)
+        running[0] -= 1
+
+        name = items[0]['result']['name']
+        if name == 'file_3':
+            raise Exception('connection reset')
+        if name == 'file_5':
+            SrvErrorHandler.customized_handle(ECustomizedError.DOWNLOAD_FAIL, True)
+        return f'{output_path}/{name}'
+
+    mocker.patch.object(SrvFileDownload, 'simple_download_file_async', simple_download_file_async)
+    summary_mock = mocker.patch('app.services.output_manager.message_handler.SrvOutPutHandler.download_summary')
+
+    results = download_items_in_parallel(str(tmp_path), item_res, 'core', 4)
+
+    # the items run in the loop thread of engine, the exit of one item does not stop the engine
+    assert running[1] == 4
+    assert threads == {'transfer-engine'}
+    assert sorted(results) == sorted((f'file_{i}', None if i in [3, 5] else f'{tmp_path}/file_{i}') for i in range(8))
+    summary_mock.assert_called_once_with(results)
+
+
+def test_small_file_is_streamed_in_engine(range_server, mocker, tmp_path):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+    bar = mocker.Mock(total=0)
+    range_server.content = os.urandom(1024 * 100)
+    srv_download = SrvFileDownload('core', interactive=False)
+    srv_download.progress = ThrottledProgress(bar, interval=0)
+    srv_download.total_size = len(range_server.content)
+    download_file_mock = mocker.patch.object(SrvFileDownload, 'download_file')
+    # the file is written out of the loop of engine
+    write_threads = set()
+    write_buffer = DownloadSink.write_buffer
+
+    def record(self):
+        write_threads.add(threading.current_thread().name)
+        return write_buffer(self)
+
+    mocker.patch.object(DownloadSink, 'write_buffer', record)
+
+    local_filename = str(tmp_path / 'small')
+    saved = TransferEngine().run(srv_download.download_file_async(range_server.base_url + '/small', local_filename))
+
+    download_file_mock.assert_not_called()
+    assert saved == local_filename
+    with open(local_filename, 'rb') as f:
+        assert f.read() == range_server.content
+    assert bar.total == len(range_server.content)
+    assert write_threads and 'transfer-engine' not in write_threads
+
+
+def test_download_file_joins_shared_progress(range_server, mocker, tmp_path):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+    bar = mocker.Mock(total=0)
+    progress = ThrottledProgress(bar, interval=0)
+    range_server.content = os.urandom(1024 * 100)
+
+    for name in ['first', 'second']:
+        srv_download = SrvFileDownload('core', interactive=False)
+        srv_download.progress = progress
+        srv_download.download_file(range_server.base_url + f'/{name}', str(tmp_path / name))
+
+    progress.flush()
+    assert bar.total == len(range_server.content) * 2
+    assert sum(call.args[0] for call in bar.update.call_args_list) == len(range_server.content) * 2
@@ -0,0 +1,119 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import io
+import os
+import time
+
+import pytest
+from tqdm import tqdm
+
+from app.services.file_manager.file_download.download_sink import BandwidthLimiter
+from app.services.file_manager.file_download.download_sink import DownloadSink
+from app.services.file_manager.file_download.download_sink import ThrottledProgress
+from app.utils.aggregated import resilient_session
+
+
+def test_sink_writes_once_per_buffer():
+    writes = []
+    progress = []
+    sink = DownloadSink(lambda data: writes.append(bytes(data)), progress.append, buffer_size=1024)
+
+    sink.write_all(b'x' * 100 for _ in range(25))
+
+    assert [len(data) for data in writes] == [1024, 1024, 452]
+    assert b''.join(writes) == b'x' * 2500
+    assert progress == [1024, 1024, 452]
+
+
+def test_sink_reads_into_buffer_from_raw_stream():
+    content = os.urandom(10000)
+    output = io.BytesIO()
+
+    DownloadSink.to_file(output, buffer_size=4096).readfrom(io.BytesIO(content))
+
+    assert output.getvalue() == content
+
+
+def test_sink_retries_partial_write():
+    output = bytearray()
+
+    def write(data):
+        output.extend(data[:10])
+        return min(len(data), 10)
+
+    sink = DownloadSink(write, buffer_size=64)
+    sink.write_all([b'y' * 100])
+
+    assert output == b'y' * 100
+
+
+def test_progress_is_throttled_by_time(mocker):
+    bar = mocker.Mock()
+    progress = ThrottledProgress(bar, interval=3600)
+
+    for _ in range(1000):
+        progress.update(1)
+    progress.flush()
+
+    bar.update.assert_called_once_with(1000)
+
+
+def test_download_sink_cpu_time_per_gb(range_server, tmp_path, record_property):
+    """Benchmark: CPU time of client thread per GB, 1KiB iteration with per-KiB progress vs download sink."""
+    range_server.content = os.urandom(1024 * 1024 * 32)
+    url = range_server.base_url + '/object'
+    size_in_gb = len(range_server.content) / 1024**3
+
+    def legacy(response, file, bar):
+        for data in response.iter_bytes(chunk_size=1024):
+            bar.update(file.write(data))
+
+    def buffered(response, file, bar):
+        progress = ThrottledProgress(bar)
+        DownloadSink.to_file(file, progress.update).write_all(response.iter_bytes())
+        progress.flush()
+
+    cpu_per_gb = {}
+    for name, consume, buffering in [('legacy', legacy, -1), ('sink', buffered, 0)]:
+        local_filename = tmp_path / name
+        start = time.thread_time()
+        with resilient_session(url).stream('GET', url) as response:
+            with open(local_filename, 'wb', buffering=buffering) as file, tqdm(
+                total=len(range_server.content), file=io.StringIO()
+            ) as bar:
+                consume(response, file, bar)
+        cpu_per_gb[name] = (time.thread_time() - start) / size_in_gb
+        assert local_filename.read_bytes() == range_server.content
+
+    record_property('cpu_seconds_per_gb', cpu_per_gb)
+    assert cpu_per_gb['sink'] < cpu_per_gb['legacy'] / 1.5
+
+
+def test_bandwidth_limiter_caps_rate(mocker):
+    clock = [0.0]
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    mocker.patch('app.services.file_manager.file_download.download_sink.time.monotonic', side_effect=lambda: clock[0])
+    mocker.patch('app.services.file_manager.file_download.download_sink.time.sleep', side_effect=sleep)
+    limiter = BandwidthLimiter(rate=1000)
+
+    for _ in range(30):
+        limiter.consume(100)
+
+    # one second of burst, then the rest is paced at the rate
+    assert clock[0] == pytest.approx(2)
+
+
+def test_sink_is_paced_by_limiter(mocker):
+    limiter = mocker.Mock()
+    sink = DownloadSink(lambda data: len(data), buffer_size=1024, limiter=limiter)
+
+    sink.write_all([b'z' * 3000])
+
+    assert [call.args[0] for call in limiter.consume.call_args_list] == [1024, 1024, 952]
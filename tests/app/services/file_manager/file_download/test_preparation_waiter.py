@@ -0,0 +1,152 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import asyncio
+import time
+
+import pytest
+
+from app.services.dataset_manager.dataset_download import SrvDatasetDownloadManager
+from app.services.dataset_manager.model import EFileStatus as EDatasetStatus
+from app.services.file_manager.file_download.download_client import SrvFileDownload
+from app.services.file_manager.file_download.model import EFileStatus
+from app.services.file_manager.file_download.preparation_waiter import PreparationWaiter
+from app.services.file_manager.file_download.preparation_waiter import Spinner
+
+
+@pytest.fixture
+def fake_clock(mocker):
+    """The clock is only advanced by sleep and by the status checks."""
+    clock = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(round(seconds, 3))
+        clock[0] += seconds
+
+    mocker.patch(
+        'app.services.file_manager.file_download.preparation_waiter.time.monotonic', side_effect=lambda: clock[0]
+    )
+    mocker.patch('app.services.file_manager.file_download.preparation_waiter.time.sleep', side_effect=sleep)
+    return clock, sleeps
+
+
+def test_small_file_is_ready_without_dead_time():
+    statuses = iter([EFileStatus.WAITING, EFileStatus.RUNNING, EFileStatus.SUCCEED])
+
+    start = time.monotonic()
+    status = PreparationWaiter(timeout=10).wait(lambda wait: next(statuses), 'checking status')
+
+    assert status == EFileStatus.SUCCEED
+    # 0.05s and 0.1s of backoff, the spinner does not delay the result
+    assert time.monotonic() - start < 0.5
+
+
+def test_backoff_is_capped_and_times_out(fake_clock):
+    _, sleeps = fake_clock
+
+    with pytest.raises(TimeoutError):
+        PreparationWaiter(timeout=10, initial_delay=0.05, max_delay=2).wait(lambda wait: EFileStatus.RUNNING)
+
+    assert sleeps[:7] == [0.05, 0.1, 0.2, 0.4, 0.8, 1.6, 2]
+    assert sum(sleeps) == pytest.approx(10)
+
+
+def test_long_poll_time_counts_toward_delay(fake_clock):
+    clock, sleeps = fake_clock
+    waits = []
+    statuses = iter([EFileStatus.RUNNING] * 3 + [EFileStatus.SUCCEED])
+
+    def check_status(wait):
+        # the server holds the request until the status changes or wait elapses
+        waits.append(wait)
+        clock[0] += wait
+        return next(statuses)
+
+    status = PreparationWaiter(timeout=60, initial_delay=0.05, max_delay=2, long_poll=1).wait(check_status)
+
+    assert status == EFileStatus.SUCCEED
+    assert waits == [1, 1, 1, 1]
+    assert sleeps == [0, 0, 0]
+
+
+def test_async_wait_shares_backoff(fake_clock, mocker):
+    clock, sleeps = fake_clock
+    statuses = iter([EFileStatus.WAITING, EFileStatus.RUNNING, EFileStatus.SUCCEED])
+
+    async def sleep(seconds):
+        sleeps.append(round(seconds, 3))
+        clock[0] += seconds
+
+    async def check_status(wait):
+        return next(statuses)
+
+    mocker.patch('app.services.file_manager.file_download.preparation_waiter.asyncio.sleep', side_effect=sleep)
+    status = asyncio.run(PreparationWaiter(timeout=10, initial_delay=0.05, max_delay=2).wait_async(check_status))
+
+    assert status == EFileStatus.SUCCEED
+    assert sleeps == [0.05, 0.1]
+
+
+def test_unknown_status_is_checked_again(fake_clock):
+    statuses = iter([None, EFileStatus.FAILED])
+
+    assert PreparationWaiter(timeout=10).wait(lambda wait: next(statuses)) == EFileStatus.FAILED
+
+
+def test_spinner_stops_without_waiting_for_frame():
+    start = time.monotonic()
+    with Spinner('checking status', interval=5):
+        time.sleep(0.05)
+
+    assert time.monotonic() - start < 1
+
+
+def test_file_download_reports_failed_preparation(mocker):
+    mocker.patch.object(SrvFileDownload, 'download_status', return_value=EFileStatus.FAILED)
+    handle_mock = mocker.patch('app.services.output_manager.error_handler.SrvErrorHandler.customized_handle')
+
+    srv_download = SrvFileDownload('core', interactive=False)
+    srv_download.progress = mocker.Mock()
+
+    assert srv_download.check_download_preparing_status() == EFileStatus.FAILED
+    handle_mock.assert_called_once()
+
+
+def test_dataset_download_shares_preparation_policy(fake_clock, mocker):
+    download_status_mock = mocker.patch.object(
+        SrvDatasetDownloadManager,
+        'download_status',
+        side_effect=[EDatasetStatus.WAITING, EDatasetStatus.RUNNING, EDatasetStatus.SUCCEED],
+    )
+    _, sleeps = fake_clock
+
+    download_manager = SrvDatasetDownloadManager('.', 'testdataset', 'geid')
+    status = download_manager.check_download_preparing_status('hash_code')
+
+    assert status == EDatasetStatus.SUCCEED
+    assert sleeps == [0.05, 0.1]
+    download_status_mock.assert_called_with('hash_code', 0)
+
+
+def test_dataset_download_keeps_minute_bound(fake_clock, mocker):
+    mocker.patch.object(SrvDatasetDownloadManager, 'download_status', return_value=EDatasetStatus.RUNNING)
+    _, sleeps = fake_clock
+
+    download_manager = SrvDatasetDownloadManager('.', 'testdataset', 'geid')
+    with pytest.raises(TimeoutError):
+        download_manager.check_download_preparing_status('hash_code')
+
+    assert sum(sleeps) == pytest.approx(60)
+
+
+def test_spinner_shows_seconds_waited_against_timeout(mocker):
+    secho_mock = mocker.patch('app.services.file_manager.file_download.preparation_waiter.click.secho')
+
+    with Spinner('preparing download', interval=0.01, timeout=60):
+        time.sleep(0.05)
+
+    assert any('0s (at most 60s)' in call.args[0] for call in secho_mock.call_args_list)
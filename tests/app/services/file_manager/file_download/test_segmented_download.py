@@ -0,0 +1,191 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import os
+import time
+
+import pytest
+
+from app.configs.app_config import AppConfig
+from app.services.file_manager.file_download.download_client import SrvFileDownload
+from app.services.file_manager.file_download.partial_download import PartialDownload
+from app.services.file_manager.file_download.segmented_download import download_segments
+from app.services.file_manager.file_download.segmented_download import probe_range_support
+from app.services.file_manager.file_download.segmented_download import split_ranges
+from tests.conftest import decoded_token
+
+
+@pytest.fixture
+def segment_size(monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'download_segment_min_size', 64 * 1024)
+    return 64 * 1024
+
+
+def test_split_ranges_covers_object(segment_size):
+    assert split_ranges(10, 4) == [(0, 9)]
+    ranges = split_ranges(segment_size * 10 + 1, 4)
+    assert len(ranges) == 4
+    assert ranges[0][0] == 0 and ranges[-1][1] == segment_size * 10
+    assert all(ranges[i][1] + 1 == ranges[i + 1][0] for i in range(3))
+
+
+def test_split_ranges_skips_completed(segment_size):
+    completed = [(0, segment_size - 1), (segment_size * 2, segment_size * 3 - 1)]
+
+    assert split_ranges(segment_size * 4, 1, completed) == [
+        (segment_size, segment_size * 2 - 1),
+        (segment_size * 3, segment_size * 4 - 1),
+    ]
+    assert split_ranges(segment_size * 4, 4, [(0, segment_size * 4 - 1)]) == []
+
+
+def test_probe_range_support(range_server):
+    range_server.content = b'0' * 1000
+    assert probe_range_support(range_server.base_url + '/object') == (1000, '"etag"')
+
+    range_server.ranges = False
+    assert probe_range_support(range_server.base_url + '/object') == (None, None)
+
+
+def test_download_segments_writes_ranges_by_offset(range_server, segment_size, tmp_path):
+    range_server.content = os.urandom(segment_size * 8 + 123)
+    partial = PartialDownload(str(tmp_path / 'object'))
+    partial.load('"etag"', len(range_server.content))
+    progress = []
+
+    download_segments(
+        range_server.base_url + '/object', partial, len(range_server.content), '"etag"', 8, progress.append
+    )
+
+    with open(partial.complete(), 'rb') as f:
+        assert f.read() == range_server.content
+    assert sum(progress) == len(range_server.content)
+    assert len(range_server.requests) == 8
+
+
+def test_download_file_in_segments(range_server, segment_size, mocker, tmp_path):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+    range_server.content = os.urandom(segment_size * 4)
+    local_filename = str(tmp_path / 'object')
+
+    SrvFileDownload('greenroom').download_file(range_server.base_url + '/object', local_filename)
+
+    with open(local_filename, 'rb') as f:
+        assert f.read() == range_server.content
+    # the probe and the segments
+    assert range_server.requests[0] == 'bytes=0-0'
+    assert len(range_server.requests) == 1 + AppConfig.Env.download_segments
+
+
+def test_download_file_falls_back_to_single_stream(range_server, segment_size, mocker, tmp_path):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+    range_server.content = os.urandom(segment_size * 4)
+    range_server.ranges = False
+    local_filename = str(tmp_path / 'object')
+
+    downloader = SrvFileDownload('greenroom')
+    downloader.total_size = len(range_server.content)
+    downloader.download_file(range_server.base_url + '/object', local_filename)
+
+    with open(local_filename, 'rb') as f:
+        assert f.read() == range_server.content
+    assert range_server.requests == ['bytes=0-0', None]
+
+
+def test_download_file_does_not_probe_small_file(range_server, segment_size, mocker, tmp_path):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+    range_server.content = os.urandom(segment_size - 1)
+    local_filename = str(tmp_path / 'object')
+
+    downloader = SrvFileDownload('greenroom')
+    downloader.total_size = len(range_server.content)
+    downloader.download_file(range_server.base_url + '/object', local_filename)
+
+    with open(local_filename, 'rb') as f:
+        assert f.read() == range_server.content
+    # a single stream without the probe of range support
+    assert range_server.requests == [None]
+
+
+@pytest.mark.benchmark
+def test_segmented_download_throughput(range_server, monkeypatch, tmp_path, record_property):
+    """Benchmark: download 8MB from a server limiting each stream to 8MB/s with 1, 4 and 16 segments."""
+    monkeypatch.setattr(AppConfig.Env, 'download_segment_min_size', 256 * 1024)
+    range_server.content = os.urandom(1024 * 1024 * 8)
+    range_server.rate = 1024 * 1024 * 8
+    url = range_server.base_url + '/object'
+
+    throughput = {}
+    for num_of_segment in [1, 4, 16]:
+        partial = PartialDownload(str(tmp_path / f'object_{num_of_segment}'))
+        partial.load('"etag"', len(range_server.content))
+        start = time.perf_counter()
+        download_segments(url, partial, len(range_server.content), '"etag"', num_of_segment, lambda size: None)
+        throughput[num_of_segment] = len(range_server.content) / (time.perf_counter() - start)
+        with open(partial.complete(), 'rb') as f:
+            assert f.read() == range_server.content
+
+    record_property('bytes_per_second', throughput)
+    assert throughput[4] > throughput[1] * 2
+    assert throughput[16] > throughput[4]
+
+
+def test_download_file_resumes_interrupted_download(range_server, segment_size, mocker, monkeypatch, tmp_path):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+    monkeypatch.setattr(AppConfig.Env, 'download_segments', 1)
+    monkeypatch.setattr(AppConfig.Env, 'download_journal_interval', segment_size)
+    range_server.content = os.urandom(segment_size * 8)
+    range_server.fail_after = segment_size * 3
+    local_filename = str(tmp_path / 'object')
+    url = range_server.base_url + '/object'
+
+    SrvFileDownload('greenroom').download_file(url, local_filename)
+
+    assert not os.path.exists(local_filename)
+    assert os.path.exists(f'{local_filename}.part')
+
+    range_server.fail_after = None
+    range_server.requests.clear()
+    SrvFileDownload('greenroom').download_file(url, local_filename)
+
+    with open(local_filename, 'rb') as f:
+        assert f.read() == range_server.content
+    # only the missing bytes are downloaded again
+    assert range_server.requests == ['bytes=0-0', f'bytes={segment_size * 3}-{segment_size * 8 - 1}']
+    assert os.listdir(tmp_path) == ['object']
+
+
+def test_download_file_restarts_when_source_changed(range_server, segment_size, mocker, tmp_path):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+    range_server.content = os.urandom(segment_size * 2)
+    local_filename = str(tmp_path / 'object')
+    partial = PartialDownload(local_filename)
+    partial.load('"old-etag"', len(range_server.content))
+    with open(partial.part_path, 'wb') as f:
+        f.write(b'0' * segment_size)
+    partial.record(0, segment_size - 1)
+    partial.close()
+
+    SrvFileDownload('greenroom').download_file(range_server.base_url + '/object', local_filename)
+
+    with open(local_filename, 'rb') as f:
+        assert f.read() == range_server.content
+    assert f'bytes=0-{segment_size - 1}' in range_server.requests
@@ -0,0 +1,115 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import pytest
+
+
+class FakeUploadHandler(BaseHTTPRequestHandler):
+    """Upload service and object storage in one local server.
+
+    The chunk body is read and dropped, only the size is recorded and its
+    md5 is the ETag. The bodies are kept in `objects` by path if
+    `keep_objects` is set. The
+    batch presigned endpoint answers 404 unless `batch_supported` is set.
+    The finalized files are counted by `finalize_calls`, the first
+    `finalize_rejections` of them are answered with a failed json code.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, body: dict, status_code: int = 200):
+        content = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        server = self.server
+        with server.lock:
+            server.presign_calls += 1
+        if url.path == '/v1/files/chunks/presigned':
+            chunk_number = parse_qs(url.query)['chunk_number'][0]
+            self.send_json({'result': f'{server.base_url}/object/{chunk_number}'})
+        else:
+            self.send_json({}, 404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        if url.path == '/v1/files':
+            with server.lock:
+                server.finalize_calls += 1
+                rejected = server.finalize_calls <= server.finalize_rejections
+            if rejected:
+                self.send_json({'code': 500, 'error_msg': 'combine failed'})
+            else:
+                self.send_json({'code': 200, 'result': {'id': payload.get('item_id')}})
+            return
+
+        with server.lock:
+            server.batch_calls += 1
+        if url.path == '/v1/files/chunks/presigned/batch' and server.batch_supported:
+            urls = {str(number): f'{server.base_url}/object/{number}' for number in payload['chunk_numbers']}
+            self.send_json({'result': urls})
+        else:
+            self.send_json({}, 404)
+
+    def do_PUT(self):
+        remaining = int(self.headers.get('Content-Length', 0))
+        received = 0
+        md5 = hashlib.md5()
+        body = bytearray()
+        while remaining:
+            data = self.rfile.read(min(remaining, 1024 * 1024))
+            md5.update(data)
+            if self.server.keep_objects:
+                body += data
+            received += len(data)
+            remaining -= len(data)
+        with self.server.lock:
+            self.server.put_calls += 1
+            self.server.received_bytes += received
+            if self.server.keep_objects:
+                self.server.objects[urlparse(self.path).path] = bytes(body)
+        self.send_response(200)
+        self.send_header('ETag', f'"{md5.hexdigest()}"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+@pytest.fixture
+def fake_upload_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeUploadHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    server.presign_calls = 0
+    server.batch_calls = 0
+    server.batch_supported = False
+    server.put_calls = 0
+    server.received_bytes = 0
+    server.finalize_calls = 0
+    server.finalize_rejections = 0
+    server.keep_objects = False
+    server.objects = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
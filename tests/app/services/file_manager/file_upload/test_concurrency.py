@@ -0,0 +1,93 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import threading
+
+import pytest
+
+from app.configs.app_config import AppConfig
+from app.services.file_manager.file_upload.concurrency import ChunkConcurrency
+
+
+@pytest.fixture
+def clock(mocker):
+    now = [0.0]
+    mocker.patch('app.services.file_manager.file_upload.concurrency.time.monotonic', side_effect=lambda: now[0])
+    return now
+
+
+def run_round(concurrency: ChunkConcurrency, clock: list, seconds: float, congested: bool = False):
+    """Finish one round of chunks(1 MB each) in given seconds."""
+    clock[0] += seconds
+    for _ in range(concurrency.limit):
+        concurrency.record(1024 * 1024, congested=congested)
+        if congested:
+            break
+
+
+def test_fixed_thread_is_not_adjusted(clock):
+    concurrency = ChunkConcurrency.from_thread(4)
+
+    run_round(concurrency, clock, 1)
+    run_round(concurrency, clock, 10, congested=True)
+
+    assert concurrency.limit == 4
+    assert concurrency.summary() == '4'
+
+
+def test_auto_thread_increases_additively_while_throughput_grows(clock, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'upload_thread_auto_initial', 2)
+    monkeypatch.setattr(AppConfig.Env, 'upload_thread_auto_max', 5)
+    concurrency = ChunkConcurrency.from_thread('auto')
+
+    # each round of `limit` chunks takes one second, the throughput grows
+    for limit in [3, 4, 5, 5]:
+        run_round(concurrency, clock, 1)
+        assert concurrency.limit == limit
+
+    assert concurrency.summary() == 'auto, final 5 (range 2-5)'
+
+
+def test_auto_thread_decreases_multiplicatively_on_server_error(clock, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'upload_thread_auto_initial', 16)
+    monkeypatch.setattr(AppConfig.Env, 'upload_thread_auto_min', 2)
+    concurrency = ChunkConcurrency.from_thread('auto')
+
+    run_round(concurrency, clock, 1, congested=True)
+    assert concurrency.limit == 8
+    run_round(concurrency, clock, 1, congested=True)
+    run_round(concurrency, clock, 1, congested=True)
+    run_round(concurrency, clock, 1, congested=True)
+    assert concurrency.limit == 2
+
+
+def test_auto_thread_decreases_when_throughput_drops(clock, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'upload_thread_auto_initial', 8)
+    concurrency = ChunkConcurrency.from_thread('auto')
+
+    run_round(concurrency, clock, 1)
+    assert concurrency.limit == 9
+    # the link is saturated, more chunks in flight make the round much slower
+    run_round(concurrency, clock, 3)
+    assert concurrency.limit == 4
+
+
+def test_in_flight_chunks_are_bounded_by_limit():
+    concurrency = ChunkConcurrency(2, 2, 2)
+    concurrency.acquire()
+    concurrency.acquire()
+
+    acquired = threading.Event()
+
+    def acquire():
+        concurrency.acquire()
+        acquired.set()
+
+    threading.Thread(target=acquire, daemon=True).start()
+    assert not acquired.wait(0.1)
+
+    concurrency.release()
+    assert acquired.wait(1)
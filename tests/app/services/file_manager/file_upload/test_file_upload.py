@@ -4,12 +4,26 @@
 # Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
 # You may not use this file except in compliance with the License.
 
+import concurrent.futures
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+
+import pytest
+
 from app.configs.app_config import AppConfig
 from app.services.file_manager.file_upload.file_upload import assemble_path
+from app.services.file_manager.file_upload.file_upload import pre_upload_in_batches
 from app.services.file_manager.file_upload.file_upload import resume_upload
 from app.services.file_manager.file_upload.file_upload import simple_upload
+from app.services.file_manager.file_upload.folder_zip import stream_folder_archive
+from app.services.file_manager.file_upload.manifest_journal import ManifestJournal
 from app.services.file_manager.file_upload.models import FileObject
 from app.services.file_manager.file_upload.models import ItemStatus
+from app.services.file_manager.file_upload.upload_client import UploadClient
 from app.services.output_manager.error_handler import ECustomizedError
 from app.services.output_manager.error_handler import customized_error_msg
 
@@ -21,8 +35,9 @@ def test_assemble_path_at_name_folder(mocker):
     zone = 0
     resumable_id = None
 
+    mocker.patch('app.services.file_manager.path_resolver.search_items', return_value=None)
     mocker.patch(
-        'app.services.file_manager.file_upload.file_upload.search_item',
+        'app.services.file_manager.path_resolver.search_item',
         return_value={
             'result': {
                 'id': 'test',
@@ -70,7 +85,11 @@ def test_assemble_path_at_exsting_folder(mocker):
         },
     ]
 
-    mocker.patch('app.services.file_manager.file_upload.file_upload.search_item', side_effect=node_list)
+    mocker.patch('app.services.file_manager.path_resolver.search_items', return_value=None)
+    mocker.patch(
+        'app.services.file_manager.path_resolver.search_item',
+        side_effect=lambda project_code, zone, path, item_type: node_list[path.count('/')],
+    )
 
     current_file_path, parent_folder, create_folder_flag, _ = assemble_path(
         local_file_path, target_folder, project_code, zone, resumable_id
@@ -100,7 +119,11 @@ def test_assemble_path_at_non_existing_folder(mocker):
         {'result': {}},
     ]
 
-    mocker.patch('app.services.file_manager.file_upload.file_upload.search_item', side_effect=node_list)
+    mocker.patch('app.services.file_manager.path_resolver.search_items', return_value=None)
+    mocker.patch(
+        'app.services.file_manager.path_resolver.search_item',
+        side_effect=lambda project_code, zone, path, item_type: node_list[path.count('/')],
+    )
     mocker.patch('app.services.file_manager.file_upload.file_upload.click.confirm', return_value=None)
 
     current_file_path, parent_folder, create_folder_flag, _ = assemble_path(
@@ -189,3 +212,175 @@ def test_resume_upload(mocker):
 
     get_mock.assert_called_once()
     resume_upload_mock.assert_called_once()
+
+
+def test_pre_upload_batches_run_in_parallel_with_bound(mocker, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'upload_batch_size', 2)
+    monkeypatch.setattr(AppConfig.Env, 'upload_pre_upload_workers', 3)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.generate_meta', return_value=(1, 1))
+    file_objects = [FileObject(f'object/{i}', f'local/{i}') for i in range(20)]
+
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def pre_upload(file_batch, output_path):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return file_batch
+
+    upload_client = mocker.Mock(pre_upload=pre_upload)
+    batches = list(pre_upload_in_batches(upload_client, file_objects, 'manifest.json'))
+
+    assert len(batches) == 10
+    assert sorted(x.object_path for batch in batches for x in batch) == sorted(x.object_path for x in file_objects)
+    # the requests overlap, but no more than the workers
+    assert running[1] == 3
+
+
+def test_simple_upload_streams_before_all_batches_pre_uploaded(mocker, monkeypatch, tmp_path):
+    monkeypatch.setattr(AppConfig.Env, 'upload_batch_size', 1)
+    monkeypatch.setattr(AppConfig.Env, 'upload_pre_upload_workers', 1)
+    for i in range(3):
+        (tmp_path / f'file_{i}').write_bytes(b'0')
+
+    events = []
+
+    def pre_upload(self, file_batch, output_path):
+        time.sleep(0.05)
+        events.append(('pre_upload', file_batch[0].file_name))
+        return file_batch
+
+    def upload_file(self, file_object, pool, tags):
+        events.append(('upload', file_object.file_name))
+        future = concurrent.futures.Future()
+        future.set_result(None)
+        return future
+
+    mocker.patch('app.services.file_manager.file_upload.upload_client.UploadClient.pre_upload', pre_upload)
+    mocker.patch('app.services.file_manager.file_upload.upload_client.UploadClient.upload_file', upload_file)
+    mocker.patch('app.services.file_manager.file_upload.upload_client.UploadClient.upload_token_refresh')
+
+    upload_event = {'file': str(tmp_path), 'project_code': 'test_project', 'zone': 'greenroom'}
+    simple_upload(upload_event, output_path=str(tmp_path / 'manifest.json'))
+
+    assert len(events) == 6
+    # the first file is uploading before the last batch is pre-uploaded
+    first_upload = min(i for i, event in enumerate(events) if event[0] == 'upload')
+    last_pre_upload = max(i for i, event in enumerate(events) if event[0] == 'pre_upload')
+    assert first_upload < last_pre_upload
+
+
+def test_resume_upload_from_journal_skips_server_query(mocker, tmp_path):
+    local_path = tmp_path / 'file'
+    local_path.write_bytes(b'0')
+    manifest_path = str(tmp_path / 'manifest.json')
+    finished = FileObject('object/finished', str(local_path), 'resumable_1', 'job_1', 'item_1')
+    journaled = FileObject('object/journaled', str(local_path), 'resumable_2', 'job_2', 'item_2')
+    manifest_json = {'project_code': 'project_code', 'zone': AppConfig.Env.green_zone, 'file_objects': {}}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest_json, f)
+
+    journal = ManifestJournal(manifest_path)
+    journal.record_files([finished, journaled])
+    journal.record_chunk(journaled, 1, 'etag')
+    journal.record_done(finished)
+    journal.close()
+
+    get_mock = mocker.patch(
+        'app.services.file_manager.file_upload.file_upload.get_file_info_by_geid',
+        return_value=[{'result': {'id': 'item_2', 'status': ItemStatus.REGISTERED}}],
+    )
+    resume_upload_mock = mocker.patch('app.services.file_manager.file_upload.file_upload.UploadClient.resume_upload')
+    uploaded = []
+
+    def upload_file(self, file_object, pool, tags):
+        uploaded.append(file_object)
+        future = concurrent.futures.Future()
+        future.set_result(None)
+        return future
+
+    mocker.patch('app.services.file_manager.file_upload.upload_client.UploadClient.upload_file', upload_file)
+    mocker.patch('app.services.file_manager.file_upload.upload_client.UploadClient.upload_token_refresh')
+
+    resume_upload(manifest_json, 1, manifest_path=manifest_path)
+
+    # the finalized file is not queried, and the chunks are not queried
+    get_mock.assert_called_once_with(['item_2'])
+    resume_upload_mock.assert_not_called()
+    assert [x.item_id for x in uploaded] == ['item_2']
+    assert uploaded[0].trusted_chunks == {'1': 'etag'}
+    assert not os.path.exists(journal.journal_path)
+
+
+def test_interrupted_zip_stream_upload_is_resumed(fake_upload_server, mocker, monkeypatch, tmp_path):
+    monkeypatch.setattr(AppConfig.Env, 'chunk_size', 1024)
+    monkeypatch.setattr(AppConfig.Env, 'upload_zip_workers', 1)
+    monkeypatch.setattr(AppConfig.Connections, 'url_upload_greenroom', fake_upload_server.base_url)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.update_progress')
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.close_progress')
+    mocker.patch('app.services.file_manager.file_upload.upload_client.UploadClient.upload_token_refresh')
+    fake_upload_server.keep_objects = True
+    folder = tmp_path / 'folder'
+    folder.mkdir()
+    contents = {f'file_{i}': os.urandom(2500) for i in range(3)}
+    for name, content in contents.items():
+        (folder / name).write_bytes(content)
+    manifest_path = str(tmp_path / 'manifest.json')
+
+    def pre_upload(self, file_batch, output_path):
+        for file_object in file_batch:
+            file_object.resumable_id, file_object.job_id, file_object.item_id = 'resumable_id', 'job_id', 'item_id'
+        self.record_pre_upload(file_batch, output_path)
+        return file_batch
+
+    mocker.patch('app.services.file_manager.file_upload.upload_client.UploadClient.pre_upload', pre_upload)
+
+    # the process is killed after the first 3 parts of archive are given to upload
+    class Interrupted(Exception):
+        pass
+
+    def interrupted_stream(path, on_part, **kwargs):
+        parts = []
+
+        def on_part_until_killed(chunk):
+            if len(parts) == 3:
+                raise Interrupted()
+            parts.append(chunk)
+            on_part(chunk)
+
+        return stream_folder_archive(path, on_part_until_killed, **kwargs)
+
+    module = 'app.services.file_manager.file_upload.file_upload'
+    monkeypatch.setattr(f'{module}.stream_folder_archive', interrupted_stream)
+    upload_event = {'file': str(folder), 'project_code': 'test', 'zone': 'greenroom', 'compress_zip': True}
+    with pytest.raises(Interrupted):
+        simple_upload(upload_event, output_path=manifest_path)
+
+    # the chunk in flight is still recorded in journal
+    journal = ManifestJournal(manifest_path)
+    deadline = time.monotonic() + 10
+    while len(journal.load({})['file_objects']['item_id']['uploaded_chunks']) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not os.path.exists(str(folder) + '.zip')
+
+    monkeypatch.setattr(f'{module}.stream_folder_archive', stream_folder_archive)
+    item = {'id': 'item_id', 'status': ItemStatus.REGISTERED}
+    mocker.patch(f'{module}.get_file_info_by_geid', return_value=[{'result': item}])
+    verify_chunk_spy = mocker.spy(UploadClient, 'verify_chunk')
+    put_calls = fake_upload_server.put_calls
+    with open(manifest_path) as f:
+        resume_upload(json.load(f), 1, manifest_path=manifest_path)
+
+    # the archive is compressed again, the uploaded chunks are verified instead of uploaded
+    num_of_chunks = len(fake_upload_server.objects)
+    assert verify_chunk_spy.call_count == 3
+    assert fake_upload_server.put_calls - put_calls == num_of_chunks - 3
+    assert fake_upload_server.finalize_calls == 1
+    archive = b''.join(fake_upload_server.objects[f'/object/{number}'] for number in range(1, num_of_chunks + 1))
+    with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+        assert zip_file.testzip() is None
+        assert {os.path.basename(name): zip_file.read(name) for name in zip_file.namelist()} == contents
@@ -0,0 +1,211 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import io
+import os
+import struct
+import tarfile
+import time
+import zipfile
+
+import pytest
+
+from app.configs.app_config import AppConfig
+from app.services.file_manager.file_upload.file_upload import compress_folder_to_zip
+from app.services.file_manager.file_upload import folder_zip
+from app.services.file_manager.file_upload.file_upload import simple_upload
+from app.services.file_manager.file_upload.folder_zip import ParallelZipWriter
+from app.services.file_manager.file_upload.folder_zip import stream_folder_archive
+from app.services.file_manager.file_upload.folder_zip import write_folder_archive
+
+
+def make_folder(path):
+    (path / 'sub').mkdir(parents=True)
+    (path / 'table.csv').write_bytes(b'id,value\n' * 20000)
+    (path / 'sub' / 'image.raw').write_bytes(os.urandom(300 * 1024))
+    (path / 'empty').write_bytes(b'')
+
+
+def test_zip_stream_has_same_members_as_zip_file(monkeypatch, tmp_path):
+    folder = tmp_path / 'folder'
+    make_folder(folder)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(AppConfig.Env, 'chunk_size', 64 * 1024)
+    parts = []
+
+    size = stream_folder_archive('folder', parts.append)
+    compress_folder_to_zip('folder')
+
+    assert all(len(part) == 64 * 1024 for part in parts[:-1])
+    assert sum(len(part) for part in parts) == size
+    streamed = zipfile.ZipFile(io.BytesIO(b''.join(parts)))
+    with zipfile.ZipFile('folder.zip') as archived:
+        assert sorted(streamed.namelist()) == sorted(archived.namelist())
+        for name in archived.namelist():
+            assert streamed.read(name) == archived.read(name)
+
+
+def test_zip_folder_is_uploaded_without_temporary_zip(fake_upload_server, mocker, monkeypatch, tmp_path):
+    monkeypatch.setattr(AppConfig.Env, 'chunk_size', 64 * 1024)
+    monkeypatch.setattr(AppConfig.Connections, 'url_upload_greenroom', fake_upload_server.base_url)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.update_progress')
+    mocker.patch('app.services.file_manager.file_upload.upload_client.UploadClient.upload_token_refresh')
+    mocker.patch(
+        'app.services.file_manager.file_upload.upload_client.UploadClient.pre_upload',
+        side_effect=lambda file_objects, output_path: file_objects,
+    )
+    folder = tmp_path / 'folder'
+    make_folder(folder)
+    put_calls = []
+
+    # the compression is still running when the first parts are uploaded
+    def write_stream(path, on_part, archive_format, level):
+        size = stream_folder_archive(path, on_part, archive_format, level)
+        put_calls.append(fake_upload_server.put_calls)
+        return size
+
+    mocker.patch('app.services.file_manager.file_upload.file_upload.stream_folder_archive', write_stream)
+
+    upload_event = {'file': str(folder), 'project_code': 'test_project', 'zone': 'greenroom', 'compress_zip': True}
+    simple_upload(upload_event, num_of_thread=2, output_path=str(tmp_path / 'manifest.json'))
+
+    assert not os.path.exists(f'{folder}.zip')
+    assert fake_upload_server.put_calls == -(-fake_upload_server.received_bytes // (64 * 1024))
+    assert put_calls[0] > 0
+    assert fake_upload_server.finalize_calls == 1
+
+
+def make_imaging_folder(path, scale=1):
+    """The mixed tree of compressed images, raw volumes and tables."""
+    for subject in range(4):
+        folder = path / f'sub-{subject}'
+        folder.mkdir(parents=True)
+        # the gzipped nifti and jpg are random bytes, like the compressed data
+        (folder / 'anat.nii.gz').write_bytes(os.urandom(512 * 1024 * scale))
+        (folder / 'preview.jpg').write_bytes(os.urandom(128 * 1024 * scale))
+        # the raw volume is smooth, it is compressible but not trivially
+        volume = bytes((i // 7 + (i * 31) % 5) % 256 for i in range(1024 * 1024 * scale))
+        (folder / 'volume.raw').write_bytes(volume)
+        rows = ''.join(f'{subject},{row},{row * 0.37:.3f},{"AB"[row % 2]}\n' for row in range(20000 * scale))
+        (folder / 'measures.csv').write_text(rows)
+
+
+def read_zip(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        return {info.filename: info for info in archive.infolist()}, {
+            name: archive.read(name) for name in archive.namelist()
+        }
+
+
+def test_parallel_zip_stores_incompressible_members(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(AppConfig.Env, 'upload_zip_workers', 2)
+    monkeypatch.setattr(AppConfig.Env, 'upload_zip_segment_size', 64 * 1024)
+    make_imaging_folder(tmp_path / 'study')
+
+    output = io.BytesIO()
+    write_folder_archive(output, 'study')
+
+    infos, contents = read_zip(output.getvalue())
+    assert len(infos) == 16
+    for name, info in infos.items():
+        expected = zipfile.ZIP_STORED if name.endswith(('.gz', '.jpg')) else zipfile.ZIP_DEFLATED
+        assert info.compress_type == expected
+        with open(name, 'rb') as f:
+            assert contents[name] == f.read()
+    assert infos['study/sub-0/measures.csv'].compress_size < infos['study/sub-0/measures.csv'].file_size / 3
+
+
+def test_zip_level_zero_stores_all_members(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    make_folder(tmp_path / 'folder')
+
+    output = io.BytesIO()
+    write_folder_archive(output, 'folder', level=0)
+
+    infos, _ = read_zip(output.getvalue())
+    assert {info.compress_type for info in infos.values()} == {zipfile.ZIP_STORED}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_zip64_members_are_read_by_zipfile(workers, monkeypatch, tmp_path):
+    # the small limits write the zip64 records for every member and the end of archive
+    monkeypatch.setattr(folder_zip, 'ZIP64_LIMIT', 1024)
+    monkeypatch.setattr(folder_zip, 'ZIP_FILECOUNT_LIMIT', 2)
+    monkeypatch.setattr(AppConfig.Env, 'upload_zip_workers', workers)
+    monkeypatch.setattr(AppConfig.Env, 'upload_zip_segment_size', 64 * 1024)
+    monkeypatch.chdir(tmp_path)
+    make_folder(tmp_path / 'folder')
+    (tmp_path / 'folder' / 'small.txt').write_bytes(b'small')
+    parts = []
+
+    stream_folder_archive('folder', parts.append)
+
+    data = b''.join(parts)
+    infos, contents = read_zip(data)
+    assert sorted(contents) == ['folder/empty', 'folder/small.txt', 'folder/sub/image.raw', 'folder/table.csv']
+    for name, content in contents.items():
+        with open(name, 'rb') as f:
+            assert content == f.read()
+    assert infos['folder/table.csv'].compress_type == zipfile.ZIP_DEFLATED
+    assert struct.pack('<L', folder_zip.ZIP64_END_SIGNATURE) in data[-100:]
+
+
+def test_zip_member_name_is_utf8(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'folder').mkdir()
+    (tmp_path / 'folder' / 'résumé.txt').write_bytes(b'text' * 100)
+
+    output = io.BytesIO()
+    write_folder_archive(output, 'folder')
+
+    infos, contents = read_zip(output.getvalue())
+    assert contents == {'folder/résumé.txt': b'text' * 100}
+    assert infos['folder/résumé.txt'].flag_bits & 0x800
+
+
+def test_tar_zst_has_same_members(monkeypatch, tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    monkeypatch.chdir(tmp_path)
+    make_folder(tmp_path / 'folder')
+    parts = []
+
+    stream_folder_archive('folder', parts.append, archive_format='tar.zst')
+
+    data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(b''.join(parts))).read()
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert sorted(tar.getnames()) == ['folder/empty', 'folder/sub/image.raw', 'folder/table.csv']
+
+
+def test_parallel_zip_benchmark(monkeypatch, tmp_path, record_property):
+    """Benchmark: zip a mixed imaging/tabular tree on one core and in the process pool."""
+    monkeypatch.chdir(tmp_path)
+    make_imaging_folder(tmp_path / 'study', scale=4)
+    total_size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk('study') for f in files)
+
+    results = {}
+    for name, workers, stored_extensions in [
+        ('deflate all, 1 core', 1, []),
+        ('stored, 1 core', 1, AppConfig.Env.upload_zip_stored_extensions),
+        ('stored, pool', max(2, os.cpu_count()), AppConfig.Env.upload_zip_stored_extensions),
+    ]:
+        monkeypatch.setattr(AppConfig.Env, 'upload_zip_stored_extensions', stored_extensions)
+        output = io.BytesIO()
+        start_time = time.perf_counter()
+        writer = ParallelZipWriter(output, workers=workers)
+        for root, _, files in os.walk('study'):
+            for file in files:
+                writer.add(os.path.join(root, file))
+        writer.close()
+        results[name] = (time.perf_counter() - start_time, len(output.getvalue()))
+        read_zip(output.getvalue())
+
+    record_property('total_size', total_size)
+    record_property('seconds_and_size', results)
+    # the segments deflated apart are about as small as one stream
+    assert results['stored, pool'][1] < results['stored, 1 core'][1] * 1.02
+    assert results['stored, 1 core'][0] < results['deflate all, 1 core'][0]
@@ -0,0 +1,63 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import os
+
+from app.services.file_manager.file_upload.hash_cache import ChunkHashCache
+from app.services.file_manager.file_upload.models import FileObject
+
+
+def test_hash_cache_is_persisted(tmp_path):
+    local_path = tmp_path / 'file'
+    local_path.write_bytes(b'0' * 100)
+    file_object = FileObject('object/file', str(local_path))
+
+    cache = ChunkHashCache(str(tmp_path / 'cache.db'))
+    cache.set(file_object, 1, 'md5-1')
+    cache.set(file_object, 2, 'md5-2')
+    cache.close()
+
+    assert ChunkHashCache(str(tmp_path / 'cache.db')).get(file_object) == {1: 'md5-1', 2: 'md5-2'}
+
+
+def test_hash_cache_is_invalid_after_file_changed(tmp_path):
+    local_path = tmp_path / 'file'
+    local_path.write_bytes(b'0' * 100)
+    file_object = FileObject('object/file', str(local_path))
+    cache = ChunkHashCache(str(tmp_path / 'cache.db'))
+    cache.set(file_object, 1, 'md5-1')
+
+    stat = os.stat(local_path)
+    os.utime(local_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+    assert cache.get(file_object) == {}
+
+
+def test_hash_cache_error_is_ignored(tmp_path):
+    local_path = tmp_path / 'file'
+    local_path.write_bytes(b'0' * 100)
+    file_object = FileObject('object/file', str(local_path))
+    # the parent of cache is a file, the database cannot be created
+    cache = ChunkHashCache(str(local_path / 'cache.db'))
+
+    cache.set(file_object, 1, 'md5-1')
+    assert cache.get(file_object) == {}
+
+
+def test_hash_cache_delete_keeps_other_files(tmp_path):
+    file_objects = []
+    for name in ['done', 'other']:
+        local_path = tmp_path / name
+        local_path.write_bytes(b'0' * 100)
+        file_objects.append(FileObject(f'object/{name}', str(local_path)))
+    cache = ChunkHashCache(str(tmp_path / 'cache.db'))
+    for file_object in file_objects:
+        cache.set(file_object, 1, 'md5-1')
+
+    cache.delete(file_objects[0])
+
+    assert cache.get(file_objects[0]) == {}
+    assert cache.get(file_objects[1]) == {1: 'md5-1'}
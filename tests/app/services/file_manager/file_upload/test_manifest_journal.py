@@ -0,0 +1,121 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from app.services.file_manager.file_upload.manifest_journal import ManifestJournal
+from app.services.file_manager.file_upload.models import FileObject
+
+
+def write_manifest(manifest_path, file_objects: dict = None):
+    with open(manifest_path, 'w') as f:
+        json.dump({'project_code': 'test_project', 'file_objects': file_objects or {}}, f)
+
+
+def test_journal_load_merges_files_chunks_and_done(mocker, tmp_path):
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.generate_meta', return_value=(1, 1))
+    manifest_path = str(tmp_path / 'manifest.json')
+    journal = ManifestJournal(manifest_path)
+    file_1 = FileObject('object/1', 'local/1', 'resumable_1', 'job_1', 'item_1')
+    file_2 = FileObject('object/2', 'local/2', 'resumable_2', 'job_2', 'item_2')
+
+    journal.record_files([file_1, file_2])
+    journal.record_chunk(file_1, 1, 'etag_1')
+    journal.record_chunk(file_1, 2, 'etag_2')
+    journal.record_done(file_2)
+    journal.close()
+
+    file_objects = journal.load({'file_objects': {}})['file_objects']
+
+    assert file_objects['item_1']['uploaded_chunks'] == {'1': 'etag_1', '2': 'etag_2'}
+    assert file_objects['item_1']['resumable_id'] == 'resumable_1'
+    assert not file_objects['item_1'].get('finalized')
+    assert file_objects['item_2']['finalized'] is True
+
+
+def test_journal_load_ignores_torn_last_line(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    journal = ManifestJournal(manifest_path)
+    journal.append({'op': 'file', 'file': {'item_id': 'item_1'}})
+    journal.append({'op': 'chunk', 'item_id': 'item_1', 'chunk': 1, 'etag': 'etag_1', 'mtime_ns': 1})
+    journal.close()
+    with open(journal.journal_path, 'a') as f:
+        f.write('{"op": "chunk", "item_id": "item_1", "ch')
+
+    file_objects = journal.load({})['file_objects']
+
+    assert file_objects['item_1']['uploaded_chunks'] == {'1': 'etag_1'}
+
+
+def test_journal_does_not_trust_chunks_from_changed_file(tmp_path):
+    journal = ManifestJournal(str(tmp_path / 'manifest.json'))
+    journal.append({'op': 'file', 'file': {'item_id': 'item_1'}})
+    journal.append({'op': 'chunk', 'item_id': 'item_1', 'chunk': 1, 'etag': 'etag_1', 'mtime_ns': 1})
+    journal.append({'op': 'chunk', 'item_id': 'item_1', 'chunk': 2, 'etag': 'etag_2', 'mtime_ns': 2})
+    journal.close()
+
+    file_info = journal.load({})['file_objects']['item_1']
+
+    assert file_info['uploaded_chunks'] == {'1': 'etag_1', '2': 'etag_2'}
+    assert file_info['mtime_ns'] is None
+
+
+def test_journal_compact_into_manifest(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    write_manifest(manifest_path)
+    journal = ManifestJournal(manifest_path)
+    journal.append({'op': 'file', 'file': {'item_id': 'item_1'}})
+    journal.append({'op': 'done', 'item_id': 'item_1'})
+
+    journal.compact()
+
+    assert not os.path.exists(journal.journal_path)
+    with open(manifest_path) as f:
+        manifest_json = json.load(f)
+    assert manifest_json['project_code'] == 'test_project'
+    assert manifest_json['file_objects']['item_1']['finalized'] is True
+    # compact again is no-op
+    assert journal.compact() == manifest_json
+
+
+def test_journal_survives_sigkill(tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    write_manifest(manifest_path)
+    writer = (
+        'import sys\n'
+        'from app.services.file_manager.file_upload.manifest_journal import ManifestJournal\n'
+        'journal = ManifestJournal(sys.argv[1])\n'
+        'journal.append({"op": "file", "file": {"item_id": "item_1"}})\n'
+        'number = 0\n'
+        'while True:\n'
+        '    number += 1\n'
+        '    journal.append({"op": "chunk", "item_id": "item_1", "chunk": number, "etag": "e" * 1000})\n'
+    )
+    process = subprocess.Popen([sys.executable, '-c', writer, manifest_path], cwd=os.getcwd())
+    journal = ManifestJournal(manifest_path)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if os.path.exists(journal.journal_path) and os.path.getsize(journal.journal_path) > 1024 * 1024:
+            break
+        time.sleep(0.01)
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+
+    with open(manifest_path) as f:
+        uploaded_chunks = journal.load(json.load(f))['file_objects']['item_1']['uploaded_chunks']
+
+    # every chunk before the last recorded one is there
+    assert len(uploaded_chunks) > 1000
+    assert set(uploaded_chunks) == {str(number) for number in range(1, len(uploaded_chunks) + 1)}
+
+    journal.compact()
+    with open(manifest_path) as f:
+        assert json.load(f)['file_objects']['item_1']['uploaded_chunks'] == uploaded_chunks
@@ -0,0 +1,161 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.pool import ThreadPool
+
+import httpx
+import pytest
+
+from app.configs.app_config import AppConfig
+from app.services.file_manager.file_upload.models import FileObject
+from app.services.file_manager.file_upload.presigned_cache import PresignedUrlCache
+from app.services.file_manager.file_upload.presigned_cache import presigned_url_expiry
+from app.services.file_manager.file_upload.upload_client import UploadClient
+
+
+@pytest.fixture
+def upload_file(fake_upload_server, mocker, monkeypatch, tmp_path):
+    monkeypatch.setattr(AppConfig.Env, 'chunk_size', 1024)
+    monkeypatch.setattr(AppConfig.Env, 'presigned_url_window', 16)
+    monkeypatch.setattr(AppConfig.Env, 'presigned_url_batch', True)
+    monkeypatch.setattr(AppConfig.Connections, 'url_upload_greenroom', fake_upload_server.base_url)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.update_progress')
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.close_progress')
+
+    local_path = tmp_path / 'file'
+    local_path.write_bytes(b'0' * 1024 * 40)
+
+    def upload(num_of_thread: int = 4):
+        upload_client = UploadClient('test', 'test', 'test', num_of_thread=num_of_thread)
+        file_object = FileObject('test', str(local_path), 'resumable_id', 'job_id', 'item_id')
+        pool = ThreadPool(num_of_thread)
+        chunk_result = upload_client.stream_upload(file_object, pool)
+        [res.get() for res in chunk_result]
+        pool.close()
+        pool.join()
+        return upload_client
+
+    return upload
+
+
+def test_presigned_urls_are_requested_per_window_with_batch_endpoint(fake_upload_server, upload_file):
+    fake_upload_server.batch_supported = True
+
+    upload_client = upload_file()
+
+    assert fake_upload_server.put_calls == 40
+    assert fake_upload_server.presign_calls == 0
+    # 40 chunks, the window of 16 is refilled once half of it is used
+    assert fake_upload_server.batch_calls <= 6
+    assert upload_client.presigned_urls.batch_supported is True
+
+
+def test_presigned_urls_fall_back_to_pipelined_requests(fake_upload_server, upload_file):
+    upload_client = upload_file()
+
+    assert fake_upload_server.put_calls == 40
+    assert fake_upload_server.presign_calls == 40
+    # the batch endpoint is probed only once
+    assert fake_upload_server.batch_calls == 1
+    assert upload_client.presigned_urls.batch_supported is False
+
+
+def test_round_trip_savings_of_batch_presigned_urls(fake_upload_server, upload_file):
+    upload_file()
+    round_trips_without_batch = fake_upload_server.presign_calls + fake_upload_server.batch_calls
+
+    fake_upload_server.presign_calls = fake_upload_server.batch_calls = 0
+    fake_upload_server.batch_supported = True
+    upload_file()
+    round_trips_with_batch = fake_upload_server.presign_calls + fake_upload_server.batch_calls
+
+    assert round_trips_with_batch * 5 <= round_trips_without_batch
+
+
+@pytest.mark.parametrize('batch_error', [httpx.Response(500), Exception('connection reset')])
+def test_failed_batch_probe_falls_back_to_single_requests(mocker, monkeypatch, batch_error):
+    monkeypatch.setattr(AppConfig.Env, 'presigned_url_batch', True)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.generate_meta', return_value=(1, 2))
+    file_object = FileObject('test', 'test', 'resumable_id', 'job_id', 'item_id')
+    session_mock = mocker.patch('app.services.file_manager.file_upload.presigned_cache.resilient_session')
+    if isinstance(batch_error, Exception):
+        session_mock.return_value.post.side_effect = batch_error
+    else:
+        session_mock.return_value.post.return_value = batch_error
+    cache = PresignedUrlCache('http://upload_gr', 'gr-test')
+    mocker.patch.object(cache, 'request_url', return_value=('http://minio/url', time.time() + 3600))
+
+    assert cache.get(file_object, 1) == 'http://minio/url'
+    assert cache.batch_supported is False
+    assert cache.get(file_object, 2) == 'http://minio/url'
+    session_mock.return_value.post.assert_called_once()
+
+
+def test_expired_presigned_url_is_requested_again(mocker):
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.generate_meta', return_value=(1, 1))
+    file_object = FileObject('test', 'test', 'resumable_id', 'job_id', 'item_id')
+    cache = PresignedUrlCache('http://upload_gr', 'gr-test')
+    cache.batch_supported = False
+    request_url_mock = mocker.patch.object(
+        cache, 'request_url', return_value=('http://minio/new-url', time.time() + 3600)
+    )
+    expired = Future()
+    expired.set_result(('http://minio/old-url', time.time() - 1))
+    cache.urls[('resumable_id', 1)] = expired
+
+    assert cache.get(file_object, 1) == 'http://minio/new-url'
+    request_url_mock.assert_called_once_with(file_object, 1)
+
+
+def test_forget_drops_only_keys_of_finalized_file(mocker):
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.generate_meta', return_value=(1, 3))
+    cache = PresignedUrlCache('http://upload_gr', 'gr-test')
+    cache.consumed = {('done', 1), ('done', 2), ('other', 1)}
+    cache.urls = {('done', 3): Future(), ('other', 2): Future()}
+
+    cache.forget(FileObject('test', 'test', 'done', 'job_id', 'item_id'))
+
+    assert cache.consumed == {('other', 1)}
+    assert list(cache.urls) == [('other', 2)]
+
+
+def test_close_cancels_the_pending_prefetches(mocker, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'presigned_url_prefetch_workers', 1)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.generate_meta', return_value=(1, 4))
+    file_object = FileObject('test', 'test', 'resumable_id', 'job_id', 'item_id')
+    cache = PresignedUrlCache('http://upload_gr', 'gr-test')
+    cache.batch_supported = False
+    requested = threading.Event()
+    release = threading.Event()
+
+    def request_url(file_object, chunk_number):
+        requested.set()
+        release.wait(5)
+        return f'http://minio/url-{chunk_number}', time.time() + 3600
+
+    request_url_mock = mocker.patch.object(cache, 'request_url', side_effect=request_url)
+    with cache.lock:
+        cache.prefetch(file_object, 1)
+    futures = list(cache.urls.values())
+    requested.wait(5)
+    executor = cache.executor
+
+    cache.close()
+    release.set()
+    executor.shutdown(wait=True)
+
+    assert cache.executor is None and cache.urls == {}
+    request_url_mock.assert_called_once_with(file_object, 1)
+    assert all(future.cancelled() for future in futures[1:])
+
+
+def test_presigned_url_expiry_from_signature():
+    url = 'http://minio/bucket/key?X-Amz-Date=20240101T000000Z&X-Amz-Expires=600&X-Amz-Signature=abc'
+
+    assert presigned_url_expiry(url) == 1704067200 + 600
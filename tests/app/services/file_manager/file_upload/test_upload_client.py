@@ -4,15 +4,26 @@
 # Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
 # You may not use this file except in compliance with the License.
 
+import concurrent.futures
+import hashlib
+import os
 import re
+import threading
+import time
+import tracemalloc
 from functools import wraps
-from multiprocessing import TimeoutError
 from multiprocessing.pool import ThreadPool
-from time import sleep
+
+import jwt
+import pytest
 
 from app.configs.app_config import AppConfig
+from app.configs.user_config import UserConfig
+from app.services.file_manager.file_upload.exception import INVALID_CHUNK_ETAG
+from app.services.file_manager.file_upload.manifest_journal import ManifestJournal
 from app.services.file_manager.file_upload.models import FileObject
 from app.services.file_manager.file_upload.upload_client import UploadClient
+from app.utils.metadata_cache import MetadataCache
 from tests.conftest import decoded_token
 
 
@@ -81,29 +92,50 @@ def test_chunk_upload(httpx_mock, mocker):
     assert res.status_code == 200
 
 
+def test_chunk_upload_retry_gets_new_presigned_url(httpx_mock, mocker, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'resilient_backoff', 0)
+    monkeypatch.setattr(AppConfig.Env, 'presigned_url_batch', False)
+    upload_client = UploadClient('test', 'test', 'test')
+
+    url = re.compile('^' + upload_client.base_url + '/v1/files/chunks/presigned.*$')
+    httpx_mock.add_response(method='GET', url=url, json={'result': 'http://test/presigned-1'})
+    httpx_mock.add_response(method='GET', url=url, json={'result': 'http://test/presigned-2'})
+    # the presigned url is used, the second PUT with it would be rejected
+    httpx_mock.add_response(method='PUT', url='http://test/presigned-1', status_code=503)
+    httpx_mock.add_response(method='PUT', url='http://test/presigned-2', json={'result': ''})
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.generate_meta', return_value=(1, 1))
+
+    test_obj = FileObject('test', 'test', 'test', 'test', 'test')
+    res = upload_client.upload_chunk(test_obj, 1, b'1')
+
+    assert res.status_code == 200
+    assert [str(request.url) for request in httpx_mock.get_requests(method='PUT')] == [
+        'http://test/presigned-1',
+        'http://test/presigned-2',
+    ]
+
+
 def test_token_refresh_auto(mocker):
-    AppConfig.Env.token_refresh_interval = 1
+    expiring_token = jwt.encode({'exp': int(time.time()) + AppConfig.Env.token_warn_need_refresh}, 'secret').decode()
+    mocker.patch.object(UserConfig, 'access_token', expiring_token)
+    refreshed = threading.Event()
+
+    def refresh(azp):
+        mocker.patch.object(UserConfig, 'access_token', jwt.encode({'exp': int(time.time()) + 3600}, 'secret').decode())
+        refreshed.set()
 
     token_refresh_mock = mocker.patch(
-        'app.services.user_authentication.token_manager.SrvTokenManager.refresh', return_value=None
+        'app.services.user_authentication.token_manager.SrvTokenManager.refresh', side_effect=refresh
     )
 
     upload_client = UploadClient('test', 'test', 'test')
-    pool = ThreadPool(2)
-    async_fun = pool.apply_async(upload_client.upload_token_refresh)
-    sleep(3)
+    upload_client.upload_token_refresh()
+    # the token is refreshed by a thread of its own, not a worker of upload
+    assert 'token-refresh' in [thread.name for thread in threading.enumerate()]
+    assert refreshed.wait(5)
     upload_client.set_finish_upload()
 
-    # add the timeout to avoid the test stuck
-    try:
-        async_fun.get(timeout=5)
-    except TimeoutError:
-        raise AssertionError('token refresh failed')
-
-    pool.close()
-    pool.join()
-
-    # make sure the token refresh function is called
+    assert 'token-refresh' not in [thread.name for thread in threading.enumerate()]
     token_refresh_mock.assert_called_once()
 
 
@@ -174,3 +206,325 @@ def test_output_manifest_success(mocker):
     assert file_item.get('item_id') == 'item_id'
 
     json_dump_mocker.assert_called_once()
+
+
+def test_stream_upload_keeps_memory_bounded_for_large_file(fake_upload_server, mocker, monkeypatch, tmp_path):
+    chunk_size = 1024 * 1024 * 64
+    num_of_thread = 2
+    monkeypatch.setattr(AppConfig.Env, 'chunk_size', chunk_size)
+    monkeypatch.setattr(AppConfig.Connections, 'url_upload_greenroom', fake_upload_server.base_url)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.update_progress')
+
+    # sparse file, it does not take the disk space but reads as zeros
+    local_path = tmp_path / 'large_file'
+    with open(local_path, 'wb') as f:
+        f.truncate(1024 * 1024 * 1024 * 2)
+
+    upload_client = UploadClient('test', 'test', 'test', num_of_thread=num_of_thread)
+
+    test_obj = FileObject('test', str(local_path), 'test', 'test', 'test')
+    pool = ThreadPool(num_of_thread)
+    tracemalloc.start()
+    try:
+        chunk_result = upload_client.stream_upload(test_obj, pool)
+        [res.get() for res in chunk_result]
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        pool.close()
+        pool.join()
+
+    assert len(chunk_result) == test_obj.total_chunks == 32
+    assert fake_upload_server.put_calls == 32
+    assert fake_upload_server.received_bytes == test_obj.total_size
+    assert peak_memory < (num_of_thread + 2) * chunk_size
+
+
+def test_finalize_does_not_block_chunk_workers(fake_upload_server, mocker, monkeypatch, tmp_path):
+    monkeypatch.setattr(AppConfig.Env, 'chunk_size', 1024 * 1024)
+    monkeypatch.setattr(AppConfig.Connections, 'url_upload_greenroom', fake_upload_server.base_url)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.update_progress')
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.close_progress')
+    local_path = tmp_path / 'file'
+    local_path.write_bytes(b'0' * 10)
+
+    # a single worker must not wait for the finalization of other files
+    upload_client = UploadClient('test', 'test', 'test', num_of_thread=1)
+    pool = ThreadPool(1)
+    futures = [
+        upload_client.upload_file(FileObject('test', str(local_path), f'id_{i}', 'job_id', f'item_{i}'), pool, [])
+        for i in range(20)
+    ]
+    results = [future.result(timeout=30) for future in futures]
+    pool.close()
+    pool.join()
+
+    assert [result['id'] for result in results] == [f'item_{i}' for i in range(20)]
+    assert fake_upload_server.finalize_calls == 20
+
+
+@pytest.mark.parametrize('upload_async_small_files', [False, True])
+def test_rejected_combine_is_retried(fake_upload_server, mocker, monkeypatch, tmp_path, upload_async_small_files):
+    monkeypatch.setattr(AppConfig.Env, 'upload_async_small_files', upload_async_small_files)
+    monkeypatch.setattr(AppConfig.Env, 'resilient_backoff', 0)
+    monkeypatch.setattr(AppConfig.Connections, 'url_upload_greenroom', fake_upload_server.base_url)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.update_progress')
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.close_progress')
+    fake_upload_server.finalize_rejections = 2
+    local_path = tmp_path / 'file'
+    local_path.write_bytes(b'0' * 10)
+
+    upload_client = UploadClient('test', 'test', 'test', num_of_thread=1)
+    pool = ThreadPool(1)
+    future = upload_client.upload_file(FileObject('test', str(local_path), 'id', 'job_id', 'item_id'), pool, [])
+    result = future.result(timeout=30)
+    pool.close()
+    pool.join()
+
+    assert result['id'] == 'item_id'
+    assert fake_upload_server.finalize_calls == 3
+
+
+def test_small_files_upload_as_coroutines_when_enabled(fake_upload_server, mocker, monkeypatch, tmp_path):
+    monkeypatch.setattr(AppConfig.Env, 'upload_async_small_files', True)
+    monkeypatch.setattr(AppConfig.Env, 'chunk_size', 1024 * 1024)
+    monkeypatch.setattr(AppConfig.Connections, 'url_upload_greenroom', fake_upload_server.base_url)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.update_progress')
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.close_progress')
+    stream_upload = mocker.spy(UploadClient, 'stream_upload')
+    # the records written to disk are not done on the loop of engine
+    record_threads = set()
+    for name in ['complete_chunk', 'complete_file']:
+        method = getattr(UploadClient, name)
+
+        def record(*args, method=method):
+            record_threads.add(threading.current_thread().name)
+            return method(*args)
+
+        mocker.patch.object(UploadClient, name, record)
+    local_path = tmp_path / 'file'
+    local_path.write_bytes(b'0' * 10)
+
+    upload_client = UploadClient('test', 'test', 'test', num_of_thread=1)
+    pool = ThreadPool(1)
+    futures = [
+        upload_client.upload_file(FileObject('test', str(local_path), f'id_{i}', 'job_id', f'item_{i}'), pool, [])
+        for i in range(20)
+    ]
+    results = [future.result(timeout=30) for future in futures]
+    pool.close()
+    pool.join()
+
+    assert [result['id'] for result in results] == [f'item_{i}' for i in range(20)]
+    assert fake_upload_server.finalize_calls == 20
+    stream_upload.assert_not_called()
+    assert record_threads and 'transfer-engine' not in record_threads
+
+
+@pytest.mark.benchmark
+def test_small_files_throughput_is_stable_across_threads(
+    fake_upload_server, mocker, monkeypatch, tmp_path, record_property
+):
+    """Benchmark: upload a thousand small files with --thread 1..32."""
+    num_of_file = 1000
+    monkeypatch.setattr(AppConfig.Env, 'upload_async_small_files', False)
+    monkeypatch.setattr(AppConfig.Env, 'chunk_size', 1024 * 1024)
+    monkeypatch.setattr(AppConfig.Connections, 'url_upload_greenroom', fake_upload_server.base_url)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.update_progress')
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.close_progress')
+    local_path = tmp_path / 'file'
+    local_path.write_bytes(b'0' * 1024)
+    file_objects = [FileObject('test', str(local_path), f'id_{i}', 'job_id', f'item_{i}') for i in range(num_of_file)]
+
+    files_per_second = {}
+    for num_of_thread in [1, 2, 4, 8, 16, 32]:
+        fake_upload_server.finalize_calls = 0
+        upload_client = UploadClient('test', 'test', 'test', num_of_thread=num_of_thread)
+        pool = ThreadPool(num_of_thread)
+        start_time = time.perf_counter()
+        futures = [upload_client.upload_file(file_object, pool, []) for file_object in file_objects]
+        concurrent.futures.wait(futures, timeout=120)
+        files_per_second[num_of_thread] = num_of_file / (time.perf_counter() - start_time)
+        upload_client.set_finish_upload()
+        pool.close()
+        pool.join()
+
+        assert fake_upload_server.finalize_calls == num_of_file
+        assert all(future.exception() is None for future in futures)
+
+    record_property('files_per_second', files_per_second)
+    # more threads never collapses the throughput
+    assert min(files_per_second.values()) >= files_per_second[1] * 0.5
+
+
+@pytest.mark.benchmark
+def test_small_files_upload_as_coroutines(fake_upload_server, mocker, monkeypatch, tmp_path, record_property):
+    """Benchmark: upload a thousand small files by 64 threads and by 64 coroutines of transfer engine."""
+    num_of_file = 1000
+    num_in_flight = 64
+    monkeypatch.setattr(AppConfig.Env, 'chunk_size', 1024 * 1024)
+    monkeypatch.setattr(AppConfig.Env, 'transfer_engine_limits', {'default': num_in_flight})
+    monkeypatch.setattr(AppConfig.Connections, 'url_upload_greenroom', fake_upload_server.base_url)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.update_progress')
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.close_progress')
+    local_path = tmp_path / 'file'
+    local_path.write_bytes(b'0' * 1024)
+
+    def client_threads():
+        # the threads of fake server are not counted
+        return sum('process_request_thread' not in thread.name for thread in threading.enumerate())
+
+    files_per_second = {}
+    peak_threads = {}
+    for engine in ['threads', 'coroutines']:
+        monkeypatch.setattr(AppConfig.Env, 'upload_async_small_files', engine == 'coroutines')
+        fake_upload_server.finalize_calls = 0
+        file_objects = [
+            FileObject('test', str(local_path), f'id_{i}', 'job_id', f'item_{i}') for i in range(num_of_file)
+        ]
+        baseline = client_threads()
+        peak = [0]
+        done = threading.Event()
+
+        def sample(done=done, peak=peak, baseline=baseline):
+            while not done.wait(0.005):
+                peak[0] = max(peak[0], client_threads() - baseline - 1)
+
+        sampler = threading.Thread(target=sample)
+        sampler.start()
+        upload_client = UploadClient('test', 'test', 'test', num_of_thread=num_in_flight)
+        pool = ThreadPool(num_in_flight if engine == 'threads' else 1)
+        start_time = time.perf_counter()
+        futures = [upload_client.upload_file(file_object, pool, []) for file_object in file_objects]
+        concurrent.futures.wait(futures, timeout=120)
+        files_per_second[engine] = num_of_file / (time.perf_counter() - start_time)
+        done.set()
+        sampler.join()
+        peak_threads[engine] = peak[0]
+        upload_client.set_finish_upload()
+        pool.close()
+        pool.join()
+
+        assert fake_upload_server.finalize_calls == num_of_file
+        assert all(future.exception() is None for future in futures)
+
+    record_property('files_per_second', files_per_second)
+    record_property('peak_threads', peak_threads)
+    # the same number of transfers in flight without a thread each
+    assert peak_threads['coroutines'] < peak_threads['threads'] / 2
+
+
+@pytest.fixture
+def resumable_file(fake_upload_server, mocker, monkeypatch, tmp_path):
+    monkeypatch.setattr(AppConfig.Env, 'chunk_size', 1024)
+    monkeypatch.setattr(AppConfig.Connections, 'url_upload_greenroom', fake_upload_server.base_url)
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.update_progress')
+    mocker.patch('app.services.file_manager.file_upload.models.FileObject.close_progress')
+    local_path = tmp_path / 'file'
+    local_path.write_bytes(os.urandom(1024 * 10))
+
+    file_object = FileObject('test', str(local_path), 'resumable_id', 'job_id', 'item_id')
+    # the first 6 chunks have been uploaded
+    file_object.uploaded_chunks = {
+        str(number): hashlib.md5(file_object.read_chunk(number)).hexdigest() for number in range(1, 7)
+    }
+    return file_object
+
+
+def upload_resumable_file(upload_client: UploadClient, file_object: FileObject) -> concurrent.futures.Future:
+    pool = ThreadPool(2)
+    future = upload_client.upload_file(file_object, pool, [])
+    concurrent.futures.wait([future], timeout=30)
+    upload_client.set_finish_upload()
+    pool.close()
+    pool.join()
+    return future
+
+
+def test_resume_verifies_uploaded_chunks_in_hash_pool(fake_upload_server, resumable_file):
+    upload_client = UploadClient('test', 'test', 'test', num_of_thread=2)
+    verify_threads = set()
+    verify_chunk = upload_client.verify_chunk
+
+    def verify_chunk_spy(*args):
+        verify_threads.add(threading.current_thread().name)
+        return verify_chunk(*args)
+
+    upload_client.verify_chunk = verify_chunk_spy
+    future = upload_resumable_file(upload_client, resumable_file)
+
+    assert future.exception() is None
+    assert fake_upload_server.put_calls == 4
+    assert fake_upload_server.finalize_calls == 1
+    assert verify_threads and threading.main_thread().name not in verify_threads
+    # the hashes of finalized file are not kept
+    assert upload_client.hash_cache.get(resumable_file) == {}
+
+
+def test_resume_does_not_finalize_changed_file(fake_upload_server, resumable_file):
+    resumable_file.uploaded_chunks['3'] = 'different-etag'
+    upload_client = UploadClient('test', 'test', 'test', num_of_thread=2)
+
+    future = upload_resumable_file(upload_client, resumable_file)
+
+    assert isinstance(future.exception(), INVALID_CHUNK_ETAG)
+    assert fake_upload_server.finalize_calls == 0
+
+
+def test_resume_trusts_hash_cache(fake_upload_server, resumable_file, mocker):
+    cache = UploadClient('test', 'test', 'test').hash_cache
+    for number, etag in resumable_file.uploaded_chunks.items():
+        cache.set(resumable_file, int(number), etag)
+    cache.close()
+
+    upload_client = UploadClient('test', 'test', 'test', num_of_thread=2, trust_hash_cache=True)
+    verify_chunk_spy = mocker.spy(upload_client, 'verify_chunk')
+    future = upload_resumable_file(upload_client, resumable_file)
+
+    assert future.exception() is None
+    verify_chunk_spy.assert_not_called()
+    assert fake_upload_server.put_calls == 4
+
+
+def test_upload_records_chunks_and_finalize_in_journal(fake_upload_server, resumable_file, tmp_path):
+    manifest_path = str(tmp_path / 'manifest.json')
+    journal = ManifestJournal(manifest_path)
+    upload_client = UploadClient('test', 'test', 'test', num_of_thread=2, journal=journal)
+    upload_client.output_manifest([resumable_file], manifest_path)
+
+    future = upload_resumable_file(upload_client, resumable_file)
+
+    assert future.exception() is None
+    file_info = journal.load({'file_objects': {'item_id': {'item_id': 'item_id'}}})['file_objects']['item_id']
+    assert file_info['uploaded_chunks'] == {
+        str(number): hashlib.md5(resumable_file.read_chunk(number)).hexdigest() for number in range(7, 11)
+    }
+    assert file_info['mtime_ns'] == os.stat(resumable_file.local_path).st_mtime_ns
+    assert file_info['finalized'] is True
+
+
+def test_resume_skips_trusted_chunks(fake_upload_server, resumable_file, mocker):
+    resumable_file.trusted_chunks = resumable_file.uploaded_chunks
+    upload_client = UploadClient('test', 'test', 'test', num_of_thread=2)
+    verify_chunk_spy = mocker.spy(upload_client, 'verify_chunk')
+    read_chunk_spy = mocker.spy(resumable_file, 'read_chunk')
+
+    future = upload_resumable_file(upload_client, resumable_file)
+
+    assert future.exception() is None
+    verify_chunk_spy.assert_not_called()
+    assert sorted(call.args[0] for call in read_chunk_spy.call_args_list) == [7, 8, 9, 10]
+    assert fake_upload_server.put_calls == 4
+
+
+def test_finalize_invalidates_metadata_cache(fake_upload_server, resumable_file):
+    cache = MetadataCache()
+    cache.set_item('test', 'greenroom', 'test', 'file', 'project', {'code': 200, 'result': {'id': 'item_id'}})
+    cache.set_items_by_geid([{'status': 'success', 'result': {'id': 'item_id', 'status': 'ACTIVE'}}])
+    upload_client = UploadClient('test', 'test', 'test', num_of_thread=2)
+
+    future = upload_resumable_file(upload_client, resumable_file)
+
+    assert future.exception() is None
+    assert cache.get_item('test', 'greenroom', 'test', 'file', 'project') is None
+    assert cache.get_items_by_geid(['item_id']) == {}
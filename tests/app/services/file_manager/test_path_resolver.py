@@ -0,0 +1,148 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import json
+import re
+import threading
+import time
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+from app.configs.app_config import AppConfig
+from app.services.file_manager.file_upload.file_upload import assemble_path
+from app.services.file_manager.path_resolver import PathResolver
+from tests.conftest import decoded_token
+
+
+@pytest.fixture(autouse=True)
+def valid_token(mocker):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+
+
+def folder_response(path: str) -> dict:
+    return {'code': 200, 'result': {'id': path, 'name': path.split('/')[-1]}}
+
+
+def test_assemble_path_searches_shared_folders_once(mocker, monkeypatch, tmp_path):
+    monkeypatch.setattr(AppConfig.Env, 'search_batch', True)
+    search_items_mock = mocker.patch('app.services.file_manager.path_resolver.search_items', return_value=None)
+    search_item_mock = mocker.patch(
+        'app.services.file_manager.path_resolver.search_item',
+        side_effect=lambda project_code, zone, path, item_type: folder_response(path),
+    )
+
+    resolver = PathResolver('greenroom')
+    for index in range(500):
+        local_file = tmp_path / f'file_{index}.txt'
+        local_file.write_text('test')
+        current_folder_node, parent_folder, create_folder_flag, _ = assemble_path(
+            str(local_file), 'admin/a/b/c/d', 'test_project', 'greenroom', False, resolver
+        )
+        assert current_folder_node == 'admin/a/b/c/d'
+        assert parent_folder['id'] == 'admin/a/b/c/d'
+        assert create_folder_flag is False
+
+    # the name folder and 4 parent folders, the batch endpoint is probed once
+    assert search_item_mock.call_count == 5
+    assert search_items_mock.call_count == 1
+
+
+def test_resolve_many_uses_batch_endpoint(httpx_mock, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'search_batch', True)
+    monkeypatch.setattr(AppConfig.Env, 'search_batch_size', 100)
+
+    def batch_response(request: httpx.Request) -> httpx.Response:
+        items = json.loads(request.content)['items']
+        return httpx.Response(200, json={'code': 200, 'result': [folder_response(item['path']) for item in items]})
+
+    httpx_mock.add_callback(batch_response, method='POST', url='http://bff_cli/v1/project/test_project/search/batch')
+
+    paths = [f'admin/folder/file_{index}' for index in range(250)]
+    responses = PathResolver('greenroom').resolve_many([('test_project', path, '') for path in paths])
+
+    assert [response['result']['id'] for response in responses] == paths
+    assert len(httpx_mock.get_requests(method='POST')) == 3
+    assert not httpx_mock.get_requests(method='GET')
+
+
+@pytest.fixture
+def search_response(httpx_mock):
+    def search_response(request: httpx.Request) -> httpx.Response:
+        path = parse_qs(request.url.query.decode())['path'][0]
+        return httpx.Response(200, json=folder_response(path))
+
+    httpx_mock.add_callback(
+        search_response, method='GET', url=re.compile(r'^http://bff_cli/v1/project/test_project/search\?.*$')
+    )
+
+
+def test_resolve_many_falls_back_to_search_in_parallel(httpx_mock, monkeypatch, search_response):
+    monkeypatch.setattr(AppConfig.Env, 'search_batch', True)
+    httpx_mock.add_response(method='POST', url='http://bff_cli/v1/project/test_project/search/batch', status_code=404)
+
+    resolver = PathResolver('greenroom')
+    paths = [f'admin/folder/file_{index}' for index in range(20)]
+    responses = resolver.resolve_many([('test_project', path, '') for path in paths])
+    # the resolved paths are memoized, and the batch endpoint is not probed again
+    resolver.resolve_many([('test_project', path, '') for path in paths + ['admin/folder/file_20', 'admin/other']])
+
+    assert [response['result']['id'] for response in responses] == paths
+    assert len(httpx_mock.get_requests(method='POST')) == 1
+    assert len(httpx_mock.get_requests(method='GET')) == 22
+
+
+def test_failed_batch_search_is_not_probed_again(httpx_mock, monkeypatch, search_response):
+    monkeypatch.setattr(AppConfig.Env, 'search_batch', True)
+    # the retries of transport are not counted as probes
+    monkeypatch.setattr(AppConfig.Env, 'resilient_retry', 0)
+    httpx_mock.add_response(method='POST', url='http://bff_cli/v1/project/test_project/search/batch', status_code=500)
+
+    resolver = PathResolver('greenroom')
+    for index in range(3):
+        paths = [f'admin/folder_{index}/file_{number}' for number in range(10)]
+        responses = resolver.resolve_many([('test_project', path, '') for path in paths])
+        assert [response['result']['id'] for response in responses] == paths
+
+    assert resolver.batch_supported is False
+    assert len(httpx_mock.get_requests(method='POST')) == 1
+    assert len(httpx_mock.get_requests(method='GET')) == 30
+
+
+def test_resolve_many_limits_the_concurrent_searches(mocker, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'search_batch', False)
+    in_flight = []
+    max_in_flight = []
+    lock = threading.Lock()
+
+    def search_item(project_code, zone, path, item_type):
+        with lock:
+            in_flight.append(path)
+            max_in_flight.append(len(in_flight))
+        time.sleep(0.01)
+        with lock:
+            in_flight.remove(path)
+        return folder_response(path)
+
+    mocker.patch('app.services.file_manager.path_resolver.search_item', side_effect=search_item)
+
+    paths = [f'admin/file_{index}' for index in range(40)]
+    responses = PathResolver('greenroom', max_workers=4).resolve_many([('test_project', path, '') for path in paths])
+
+    assert [response['result']['id'] for response in responses] == paths
+    assert 1 < max(max_in_flight) <= 4
+
+
+def test_resolve_many_raises_exit_of_permission_denied(mocker):
+    mocker.patch('app.services.file_manager.path_resolver.search_items', return_value=None)
+    mocker.patch('app.services.file_manager.path_resolver.search_item', side_effect=SystemExit(1))
+
+    with pytest.raises(SystemExit):
+        PathResolver('greenroom').resolve_many([('test_project', 'admin/a', ''), ('test_project', 'admin/b', '')])
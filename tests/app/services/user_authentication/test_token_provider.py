@@ -0,0 +1,280 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import jwt
+import pytest
+
+from app.configs.app_config import AppConfig
+from app.configs.user_config import UserConfig
+from app.models.singleton import Singleton
+from app.services.user_authentication.decorator import require_valid_token
+from app.services.user_authentication.token_manager import SrvTokenManager
+from app.services.user_authentication.token_provider import TokenProvider
+from app.utils.transfer_engine import TransferEngine
+
+
+def make_token(expires_in: float, azp: str = AppConfig.Env.keycloak_device_client_id) -> str:
+    return jwt.encode({'exp': int(time.time() + expires_in), 'azp': azp}, 'secret').decode()
+
+
+class TokenHandler(BaseHTTPRequestHandler):
+    """The token endpoint of keycloak, the refresh token is rotated by each refresh and can not be used again."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        form = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        with server.lock:
+            if form['refresh_token'] != [server.refresh_token]:
+                server.rejected += 1
+                status, body = 400, {'error': 'invalid_grant'}
+            else:
+                # the refresh takes a while, the other processes are waiting
+                time.sleep(0.3)
+                server.refreshes += 1
+                server.refresh_token = f'refresh-token-{server.refreshes}'
+                status, body = 200, {'access_token': make_token(3600), 'refresh_token': server.refresh_token}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def token_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TokenHandler)
+    server.lock = threading.Lock()
+    server.refresh_token = 'refresh-token-0'
+    server.refreshes = 0
+    server.rejected = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def refresh_in_process(config_path: str, token_url: str, barrier, results) -> None:
+    AppConfig.Env.user_config_path = config_path
+    AppConfig.Env.user_config_file = os.path.join(config_path, 'config.ini')
+    AppConfig.Connections.url_keycloak_token = token_url
+    provider = TokenProvider()
+    stale_token = provider.access_token
+    barrier.wait()
+    results.put((stale_token, provider.refresh()))
+
+
+@pytest.fixture
+def refresh_mock(mocker):
+    """The token endpoint, each refresh takes a while and issues a token valid for an hour."""
+
+    def refresh(azp):
+        time.sleep(0.2)
+        mocker.patch.object(UserConfig, 'access_token', make_token(3600))
+
+    return mocker.patch('app.services.user_authentication.token_manager.SrvTokenManager.refresh', side_effect=refresh)
+
+
+def test_concurrent_refreshes_are_single_flight(refresh_mock):
+    provider = TokenProvider()
+    stale_token = provider.access_token
+    barrier = threading.Barrier(8)
+
+    def refresh():
+        barrier.wait()
+        return provider.refresh()
+
+    with ThreadPoolExecutor(8) as executor:
+        tokens = list(executor.map(lambda _: refresh(), range(8)))
+
+    refresh_mock.assert_called_once()
+    assert set(tokens) == {provider.access_token} and provider.access_token != stale_token
+
+
+def test_decorated_calls_share_one_refresh(refresh_mock, mocker):
+    stale_token = TokenProvider().access_token
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.check_valid',
+        side_effect=lambda azp: 1 if TokenProvider().access_token == stale_token else 0,
+    )
+    mocker.patch('app.services.user_authentication.user_login_logout.check_is_login', return_value=True)
+
+    @require_valid_token()
+    def request():
+        return TokenProvider().bearer()
+
+    with ThreadPoolExecutor(8) as executor:
+        bearers = set(executor.map(lambda _: request(), range(8)))
+
+    refresh_mock.assert_called_once()
+    assert len(bearers) == 1
+
+
+def test_decorated_coroutine_refreshes_off_the_event_loop(refresh_mock, mocker):
+    stale_token = TokenProvider().access_token
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.check_valid',
+        side_effect=lambda azp: 1 if TokenProvider().access_token == stale_token else 0,
+    )
+    mocker.patch('app.services.user_authentication.user_login_logout.check_is_login', return_value=True)
+    refresh_threads = []
+    refresh_mock.side_effect = lambda azp, refresh=refresh_mock.side_effect: (
+        refresh_threads.append(threading.current_thread().name),
+        refresh(azp),
+    )
+
+    @require_valid_token()
+    async def request():
+        return TokenProvider().bearer()
+
+    async def tick():
+        # the other transfers keep running while the token is refreshed
+        ticks = 0
+        while not request_task.done():
+            ticks += 1
+            await asyncio.sleep(0.01)
+        return ticks
+
+    async def run():
+        nonlocal request_task
+        request_task = asyncio.ensure_future(request())
+        return await asyncio.gather(request_task, tick())
+
+    request_task = None
+    bearer, ticks = TransferEngine().run(run())
+
+    refresh_mock.assert_called_once()
+    assert bearer == TokenProvider().bearer() and bearer != 'Bearer ' + stale_token
+    assert refresh_threads and 'transfer-engine' not in refresh_threads
+    assert ticks > 5
+
+
+def test_refresh_is_scheduled_from_expiry(refresh_mock, mocker):
+    mocker.patch.object(UserConfig, 'access_token', make_token(AppConfig.Env.token_warn_need_refresh + 2))
+    provider = TokenProvider()
+
+    provider.start()
+    # not refreshed until the token is close to expire
+    time.sleep(0.5)
+    assert refresh_mock.call_count == 0
+    time.sleep(2)
+    provider.stop()
+
+    # the refreshed token is valid for an hour, so it is not refreshed again
+    refresh_mock.assert_called_once()
+
+
+def test_failed_refresh_is_retried_after_delay(mocker, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'token_refresh_retry_delay', 0.2)
+    mocker.patch.object(UserConfig, 'access_token', make_token(0))
+    refresh_mock = mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.refresh', side_effect=OSError('refused')
+    )
+    provider = TokenProvider()
+
+    provider.start()
+    time.sleep(0.5)
+    provider.stop()
+
+    assert 2 <= refresh_mock.call_count <= 4
+
+
+def test_processes_share_one_refresh(token_server, monkeypatch, tmp_path):
+    # the real config file shared by the processes
+    monkeypatch.undo()
+    monkeypatch.setattr(AppConfig.Env, 'user_config_path', str(tmp_path))
+    monkeypatch.setattr(AppConfig.Env, 'user_config_file', str(tmp_path / 'config.ini'))
+    monkeypatch.setattr(Singleton, '_instances', {})
+    user_config = UserConfig()
+    user_config.username = 'test-user'
+    stale_token = user_config.access_token = make_token(10)
+    user_config.refresh_token = 'refresh-token-0'
+    user_config.save()
+
+    workers = 6
+    context = multiprocessing.get_context('spawn')
+    barrier, results = context.Barrier(workers), context.Queue()
+    token_url = f'http://127.0.0.1:{token_server.server_address[1]}/token'
+    processes = [
+        context.Process(target=refresh_in_process, args=(str(tmp_path), token_url, barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    tokens = [results.get(timeout=60) for _ in range(workers)]
+    for process in processes:
+        process.join(timeout=60)
+
+    assert token_server.refreshes == 1
+    assert token_server.rejected == 0
+    user_config.reload()
+    assert {new_token for _, new_token in tokens} == {user_config.access_token}
+    assert [token for token, _ in tokens] == [stale_token] * workers
+    assert user_config.refresh_token == 'refresh-token-1'
+
+
+def decorator_overhead(rounds: int) -> float:
+    """The seconds spent by require_valid_token per call."""
+
+    @require_valid_token()
+    def request():
+        pass
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        request()
+    return (time.perf_counter() - start) / rounds
+
+
+def test_valid_token_claims_are_memoized(mocker):
+    mocker.patch.object(UserConfig, 'access_token', make_token(3600))
+    decode_spy = mocker.spy(jwt, 'decode')
+    check_valid_spy = mocker.spy(SrvTokenManager, 'check_valid')
+
+    decorator_overhead(100)
+
+    assert decode_spy.call_count == 1
+    assert check_valid_spy.call_count == 0
+
+
+def test_token_for_other_client_is_fully_checked(mocker):
+    mocker.patch.object(UserConfig, 'access_token', make_token(3600, azp='other-client'))
+    check_valid_mock = mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.check_valid', return_value=0
+    )
+    mocker.patch('app.services.user_authentication.user_login_logout.check_is_login', return_value=True)
+
+    decorator_overhead(3)
+
+    assert check_valid_mock.call_count == 3
+
+
+def test_decorator_overhead_micro_benchmark(mocker):
+    mocker.patch.object(UserConfig, 'access_token', make_token(3600))
+    mocker.patch('app.services.user_authentication.user_login_logout.check_is_login', return_value=True)
+    rounds = 1000
+
+    fast_path = decorator_overhead(rounds)
+    mocker.patch.object(TokenProvider, 'is_valid', return_value=False)
+    full_check = decorator_overhead(rounds)
+
+    # the full check builds the token manager and decodes the token per call
+    assert fast_path * 5 < full_check
@@ -0,0 +1,54 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# the cumulative import time of app.pilotcli in microseconds, it was about
+# 190ms when all the commands and their services were imported at start
+STARTUP_IMPORT_BUDGET = 100_000
+HEAVY_MODULES = ['httpx', 'requests', 'jwt', 'questionary', 'qrcode', 'cryptography', 'tqdm', 'app.commands.file']
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, timeout=60)
+
+
+def startup_import_time() -> int:
+    """The cumulative import time of app.pilotcli reported by `python -X importtime`."""
+    result = run_python('-X', 'importtime', '-c', 'import app.pilotcli')
+    for line in result.stderr.splitlines():
+        _, _, cumulative, name = [field.strip() for field in line.replace(':', '|', 1).split('|')]
+        if name == 'app.pilotcli':
+            return int(cumulative)
+    raise AssertionError(result.stderr)
+
+
+@pytest.mark.benchmark
+def test_cold_start_import_time_is_in_budget():
+    # the best of several runs, the time still varies with the machine
+    assert min(startup_import_time() for _ in range(3)) < STARTUP_IMPORT_BUDGET
+
+
+def test_cold_start_does_not_import_heavy_modules():
+    result = run_python('-c', 'import sys, app.pilotcli; print(" ".join(sys.modules))')
+
+    imported = set(result.stdout.split())
+    assert [module for module in HEAVY_MODULES if module in imported] == []
+
+
+def test_group_help_lists_commands_without_importing_them():
+    code = 'import sys\nfrom app.pilotcli import cli\ntry:\n    cli()\nfinally:\n    print(" ".join(sys.modules))'
+    result = run_python('-c', code, 'file', '--help')
+
+    assert 'upload' in result.stdout and 'Resume the upload process' in result.stdout
+    imported = set(result.stdout.splitlines()[-1].split())
+    assert 'app.commands.file' in imported
+    assert 'app.commands.dataset' not in imported and 'questionary' not in imported
@@ -4,15 +4,18 @@
 # Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
 # You may not use this file except in compliance with the License.
 
+import re
+
 from app.utils.aggregated import search_item
 
 test_project_code = 'testproject'
 
 
-def test_search_file_should_return_200(requests_mock, mocker):
+def test_search_file_should_return_200(httpx_mock, mocker):
     mocker.patch('app.services.user_authentication.token_manager.SrvTokenManager.check_valid', return_value=0)
-    requests_mock.get(
-        f'http://bff_cli/v1/project/{test_project_code}/search',
+    httpx_mock.add_response(
+        method='GET',
+        url=re.compile(f'^http://bff_cli/v1/project/{test_project_code}/search.*$'),
         json={
             'code': 200,
             'error_msg': '',
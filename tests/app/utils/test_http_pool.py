@@ -0,0 +1,71 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from app.utils.aggregated import resilient_session
+from app.utils.http_pool import HttpClientPool
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.client_ports.add(self.client_address[1])
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+@pytest.fixture
+def keep_alive_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    server.daemon_threads = True
+    server.client_ports = set()
+    server.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_client_is_shared_per_host():
+    pool = HttpClientPool()
+
+    upload_client = pool.get_client('http://upload_gr/v1/files/chunks/presigned')
+    bff_client = pool.get_client('http://bff_cli/v1/query/geid')
+
+    assert pool.get_client('http://upload_gr/v1/files') is upload_client
+    assert resilient_session() is bff_client
+    assert bff_client is not upload_client
+
+
+def test_client_is_created_once_across_threads():
+    url = 'http://minio.presigned:9000/bucket/object?partNumber=1'
+    thread_pool = ThreadPool(16)
+    clients = thread_pool.map(lambda _: HttpClientPool().get_client(url), range(64))
+    thread_pool.close()
+    thread_pool.join()
+
+    assert len({id(client) for client in clients}) == 1
+
+
+def test_requests_reuse_connection(keep_alive_server):
+    server = keep_alive_server
+    client = resilient_session(server.base_url)
+
+    for _ in range(5):
+        assert client.get(server.base_url + '/ping').status_code == 200
+
+    assert len(server.client_ports) == 1
@@ -0,0 +1,207 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import asyncio
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+from app.configs.app_config import AppConfig
+from app.utils.http_pool import client_options
+from app.utils.http_pool import retry_client
+from app.utils.http_retry import AsyncRetryTransport
+from app.utils.http_retry import RetryBudget
+from app.utils.http_retry import RetryTransport
+from app.utils.http_retry import backoff_delay
+from app.utils.http_retry import retry_after_delay
+from app.utils.http_retry import retry_budgets
+
+test_url = 'http://retry_service/v1/resource'
+
+
+class FakeService:
+    """Reply the queued responses in order, the last one is repeated."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def client(self) -> httpx.Client:
+        return httpx.Client(transport=RetryTransport(httpx.MockTransport(self)))
+
+
+@pytest.fixture(autouse=True)
+def sleep_mock(mocker):
+    retry_budgets.clear()
+    yield mocker.patch('app.utils.http_retry.time.sleep')
+    retry_budgets.clear()
+
+
+def test_idempotent_request_is_retried_on_service_unavailable(sleep_mock):
+    service = FakeService(httpx.Response(503), httpx.Response(200))
+
+    response = service.client().get(test_url)
+
+    assert response.status_code == 200
+    assert len(service.requests) == 2
+    assert sleep_mock.call_count == 1
+
+
+def test_retry_gives_up_after_resilient_retry(sleep_mock):
+    service = FakeService(httpx.Response(502))
+
+    response = service.client().put(test_url, content=b'chunk')
+
+    assert response.status_code == 502
+    assert len(service.requests) == AppConfig.Env.resilient_retry + 1
+    assert all(request.read() == b'chunk' for request in service.requests)
+
+
+def test_retry_after_header_is_respected(sleep_mock):
+    service = FakeService(httpx.Response(429, headers={'Retry-After': '7'}), httpx.Response(200))
+
+    service.client().get(test_url)
+
+    assert sleep_mock.call_args[0][0] >= 7
+
+
+def test_long_retry_after_returns_response(sleep_mock, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'resilient_retry_after_max', 60)
+    service = FakeService(httpx.Response(503, headers={'Retry-After': '3600'}))
+
+    response = service.client().get(test_url)
+
+    assert response.status_code == 503
+    sleep_mock.assert_not_called()
+
+
+def test_non_idempotent_request_is_not_retried_on_server_error(sleep_mock):
+    service = FakeService(httpx.Response(503))
+
+    response = service.client().post(test_url, json={})
+
+    assert response.status_code == 503
+    assert len(service.requests) == 1
+
+
+def test_request_marked_idempotent_is_retried(sleep_mock):
+    service = FakeService(httpx.Response(504), httpx.Response(200))
+
+    response = service.client().post(test_url, json={}, extensions={'idempotent': True})
+
+    assert response.status_code == 200
+    assert len(service.requests) == 2
+
+
+def test_connect_error_is_retried_for_non_idempotent_request(sleep_mock):
+    service = FakeService(httpx.ConnectError('connection refused'), httpx.Response(200))
+
+    response = service.client().post(test_url, json={})
+
+    assert response.status_code == 200
+
+
+def test_read_error_is_not_retried_for_non_idempotent_request(sleep_mock):
+    service = FakeService(httpx.ReadError('connection reset'))
+
+    with pytest.raises(httpx.ReadError):
+        service.client().post(test_url, json={})
+
+    sleep_mock.assert_not_called()
+
+
+def test_client_error_is_not_retried(sleep_mock):
+    service = FakeService(httpx.Response(404))
+
+    response = service.client().get(test_url)
+
+    assert response.status_code == 404
+    assert len(service.requests) == 1
+
+
+def test_retry_budget_is_per_request_class(sleep_mock, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'resilient_retry_budget_reserve', 2)
+    monkeypatch.setattr(AppConfig.Env, 'resilient_retry_budget', {'default': 0, 'chunk': 0})
+    client = FakeService(httpx.Response(503)).client()
+
+    client.put(test_url, content=b'1', extensions={'retry_class': 'chunk'})
+    client.put(test_url, content=b'2', extensions={'retry_class': 'chunk'})
+    assert sleep_mock.call_count == 2
+
+    # other class still has its budget
+    client.put(test_url, content=b'3')
+    assert sleep_mock.call_count == 4
+
+
+def test_pooled_client_retries_through_environment_proxy(monkeypatch):
+    for name in ['HTTPS_PROXY', 'ALL_PROXY', 'https_proxy', 'all_proxy', 'http_proxy', 'no_proxy']:
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv('HTTP_PROXY', 'http://proxy.local:3128')
+    monkeypatch.setenv('NO_PROXY', 'bff.local,127.0.0.1')
+
+    options = client_options(httpx.HTTPTransport, RetryTransport)
+
+    assert isinstance(options['transport'], RetryTransport)
+    assert isinstance(options['mounts']['http://'], RetryTransport)
+    assert options['mounts']['http://'] is not options['transport']
+    # the hosts of NO_PROXY share the transport without proxy
+    assert options['mounts']['all://*bff.local'] is options['transport']
+    assert options['mounts']['all://127.0.0.1'] is options['transport']
+    assert isinstance(retry_client(), httpx.Client)
+
+
+def test_async_transport_retries_without_blocking_loop(sleep_mock, mocker):
+    async_sleep_mock = mocker.patch('app.utils.http_retry.asyncio.sleep')
+    service = FakeService(httpx.Response(503), httpx.ConnectError('connection refused'), httpx.Response(200))
+
+    async def request():
+        async with httpx.AsyncClient(transport=AsyncRetryTransport(httpx.MockTransport(service))) as client:
+            return await client.get(test_url)
+
+    response = asyncio.run(request())
+
+    assert response.status_code == 200
+    assert response.extensions['retries'] == 2
+    assert async_sleep_mock.await_count == 2
+    sleep_mock.assert_not_called()
+
+
+def test_retry_budget_refills_by_requests():
+    budget = RetryBudget(ratio=0.5, reserve=1)
+
+    assert budget.withdraw() is True
+    assert budget.withdraw() is False
+
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw() is True
+
+
+def test_backoff_delay_is_exponential_with_full_jitter(monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'resilient_backoff', 1)
+    monkeypatch.setattr(AppConfig.Env, 'resilient_backoff_max', 30)
+
+    for attempt, ceiling in [(0, 1), (1, 2), (3, 8), (10, 30)]:
+        delays = [backoff_delay(attempt) for _ in range(200)]
+        assert all(0 <= delay <= ceiling for delay in delays)
+        # the workers fail at same time should not wait the same time
+        assert len(set(delays)) > 100
+
+
+def test_retry_after_delay_from_http_date():
+    response = httpx.Response(503, headers={'Retry-After': formatdate(usegmt=True)})
+    assert 0 <= retry_after_delay(response) <= 1
+
+    assert retry_after_delay(httpx.Response(503, headers={'Retry-After': 'soon'})) is None
+    assert retry_after_delay(httpx.Response(503)) is None
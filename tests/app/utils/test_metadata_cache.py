@@ -0,0 +1,141 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import re
+import time
+
+import pytest
+
+from app.configs.app_config import AppConfig
+from app.configs.user_config import UserConfig
+from app.models.singleton import Singleton
+from app.utils.aggregated import get_file_info_by_geid
+from app.utils.aggregated import search_item
+from app.utils.metadata_cache import MetadataCache
+from tests.conftest import decoded_token
+
+test_project_code = 'testproject'
+search_url = re.compile(f'^http://bff_cli/v1/project/{test_project_code}/search.*$')
+
+
+@pytest.fixture(autouse=True)
+def valid_token(mocker):
+    mocker.patch(
+        'app.services.user_authentication.token_manager.SrvTokenManager.decode_access_token',
+        return_value=decoded_token(),
+    )
+
+
+def geid_item(geid: str, status: str = 'ACTIVE') -> dict:
+    return {'status': 'success', 'geid': geid, 'result': {'id': geid, 'status': status}}
+
+
+def test_search_item_is_served_from_cache(httpx_mock):
+    httpx_mock.add_response(method='GET', url=search_url, json={'code': 200, 'result': {'id': 'folder-id'}})
+
+    first = search_item(test_project_code, 'greenroom', 'admin/folder', 'folder')
+    second = search_item(test_project_code, 'Greenroom', 'admin/folder', 'folder')
+
+    assert first == second == {'code': 200, 'result': {'id': 'folder-id'}}
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_search_item_does_not_cache_missing_item(httpx_mock):
+    httpx_mock.add_response(method='GET', url=search_url, json={'code': 404, 'result': {}})
+
+    search_item(test_project_code, 'greenroom', 'admin/folder', 'folder')
+    search_item(test_project_code, 'greenroom', 'admin/folder', 'folder')
+
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_search_item_refetches_expired_item(httpx_mock, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'metadata_cache_ttl', -1)
+    httpx_mock.add_response(method='GET', url=search_url, json={'code': 200, 'result': {'id': 'folder-id'}})
+
+    search_item(test_project_code, 'greenroom', 'admin/folder', 'folder')
+    search_item(test_project_code, 'greenroom', 'admin/folder', 'folder')
+
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_search_item_skips_disabled_cache(httpx_mock):
+    httpx_mock.add_response(method='GET', url=search_url, json={'code': 200, 'result': {'id': 'folder-id'}})
+    MetadataCache().enabled = False
+
+    search_item(test_project_code, 'greenroom', 'admin/folder', 'folder')
+    search_item(test_project_code, 'greenroom', 'admin/folder', 'folder')
+
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_invalidate_removes_path_and_items_under_it():
+    cache = MetadataCache()
+    for path in ['admin/a', 'admin/a/b', 'admin/a/b/file', 'admin/a_b', 'admin']:
+        cache.set_item(test_project_code, 'greenroom', path, 'folder', 'project', {'code': 200, 'result': {'id': path}})
+    cache.set_items_by_geid([geid_item('geid-1'), geid_item('geid-2')])
+
+    cache.invalidate(test_project_code, 'greenroom', 'admin/a/', ['geid-1'])
+
+    cached = [
+        path
+        for path in ['admin/a', 'admin/a/b', 'admin/a/b/file', 'admin/a_b', 'admin']
+        if cache.get_item(test_project_code, 'greenroom', path, 'folder', 'project')
+    ]
+    assert cached == ['admin/a_b', 'admin']
+    assert list(cache.get_items_by_geid(['geid-1', 'geid-2'])) == ['geid-2']
+
+
+def test_get_file_info_by_geid_caches_active_items(httpx_mock):
+    httpx_mock.add_response(
+        method='POST',
+        url='http://bff_cli/v1/query/geid',
+        json={'result': [geid_item('geid-1'), geid_item('geid-2', 'REGISTERED')]},
+    )
+    get_file_info_by_geid(['geid-1', 'geid-2'])
+
+    httpx_mock.reset(assert_all_responses_were_requested=False)
+    httpx_mock.add_response(
+        method='POST', url='http://bff_cli/v1/query/geid', json={'result': [geid_item('geid-2'), geid_item('geid-3')]}
+    )
+    items = get_file_info_by_geid(['geid-1', 'geid-2', 'geid-3'])
+
+    # only the registered and unknown items are queried again
+    request = httpx_mock.get_request()
+    assert request.read() == b'{"geid": ["geid-2", "geid-3"]}'
+    assert [item['geid'] for item in items] == ['geid-1', 'geid-2', 'geid-3']
+
+
+def test_items_are_scoped_by_user_and_platform(monkeypatch):
+    monkeypatch.setattr(UserConfig(), 'username', 'test-user')
+    cache = MetadataCache()
+    cache.set_item(test_project_code, 'greenroom', 'admin/a', 'folder', 'project', {'code': 200, 'result': {'id': 'a'}})
+    cache.set_items_by_geid([geid_item('geid-1')])
+
+    monkeypatch.setattr(UserConfig(), 'username', 'other-user')
+    assert cache.get_item(test_project_code, 'greenroom', 'admin/a', 'folder', 'project') is None
+    assert cache.get_items_by_geid(['geid-1']) == {}
+
+    monkeypatch.setattr(UserConfig(), 'username', 'test-user')
+    monkeypatch.setattr(AppConfig.Connections, 'url_bff', 'http://other_bff')
+    assert cache.get_item(test_project_code, 'greenroom', 'admin/a', 'folder', 'project') is None
+    assert cache.get_items_by_geid(['geid-1']) == {}
+
+
+def test_items_are_shared_by_commands_until_expired(monkeypatch):
+    response = {'code': 200, 'result': {'id': 'a'}}
+    MetadataCache().set_item(test_project_code, 'greenroom', 'admin/a', 'folder', 'project', response)
+    MetadataCache().close()
+
+    # the next command opens the same cache file
+    monkeypatch.delitem(Singleton._instances, MetadataCache)
+    assert MetadataCache().get_item(test_project_code, 'greenroom', 'admin/a', 'folder', 'project') == response
+    MetadataCache().close()
+
+    monkeypatch.delitem(Singleton._instances, MetadataCache)
+    expired = time.time() + AppConfig.Env.metadata_cache_ttl + 1
+    monkeypatch.setattr('app.utils.metadata_cache.time.time', lambda: expired)
+    assert MetadataCache().get_item(test_project_code, 'greenroom', 'admin/a', 'folder', 'project') is None
@@ -0,0 +1,70 @@
+# Copyright (C) 2022-Present Indoc Systems
+#
+# Licensed under the GNU AFFERO GENERAL PUBLIC LICENSE,
+# Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
+# You may not use this file except in compliance with the License.
+
+import asyncio
+import sys
+
+import httpx
+import pytest
+
+from app.configs.app_config import AppConfig
+from app.utils.transfer_engine import TransferEngine
+
+
+def test_request_class_is_bounded_by_semaphore(mocker, monkeypatch):
+    monkeypatch.setattr(AppConfig.Env, 'transfer_engine_limits', {'default': 64, 'status': 3})
+    running = [0, 0]
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        running[0] += 1
+        running[1] = max(running)
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        return httpx.Response(200, json={'class': request.extensions['retry_class']})
+
+    engine = TransferEngine()
+    mocker.patch.object(engine, 'get_client', return_value=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    async def poll_all():
+        return await asyncio.gather(
+            *[engine.request('GET', f'http://download/v1/download/status/{i}', 'status') for i in range(30)]
+        )
+
+    responses = engine.run(poll_all())
+
+    assert running[1] == 3
+    assert all(response.json() == {'class': 'status'} for response in responses)
+
+
+def test_client_is_shared_per_origin():
+    engine = TransferEngine()
+
+    async def get_clients():
+        return [
+            engine.get_client('http://upload_gr/v1/files'),
+            engine.get_client('http://upload_gr/v1/files/chunks/presigned'),
+            engine.get_client('http://minio:9000/bucket/object'),
+        ]
+
+    files_client, presign_client, minio_client = engine.run(get_clients())
+
+    assert files_client is presign_client
+    assert minio_client is not files_client
+
+
+def test_exit_of_coroutine_is_raised_to_caller():
+    engine = TransferEngine()
+
+    async def exit_coroutine():
+        sys.exit(0)
+
+    async def answer():
+        return 42
+
+    with pytest.raises(SystemExit):
+        engine.run(exit_coroutine())
+    # the loop keeps running for other transfers
+    assert engine.run(answer()) == 42
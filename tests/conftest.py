@@ -4,6 +4,7 @@
 # Version 3.0 (the "License") available at https://www.gnu.org/licenses/agpl-3.0.en.html.
 # You may not use this file except in compliance with the License.
 
+import os
 import time
 
 import pytest
@@ -11,6 +12,19 @@ import pytest
 from app.configs.app_config import AppConfig
 from app.configs.user_config import UserConfig
 from app.models.singleton import Singleton
+from app.services.user_authentication.token_provider import TokenProvider
+from app.utils.metadata_cache import MetadataCache
+from app.utils.transfer_engine import TransferEngine
+
+
+def pytest_collection_modifyitems(config, items):
+    # the benchmarks depend on the machine, they only run on demand
+    if os.environ.get('PILOTCLI_BENCHMARK'):
+        return
+    skip_benchmark = pytest.mark.skip(reason='set PILOTCLI_BENCHMARK=1 to run the benchmarks')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
 
 
 @pytest.fixture(autouse=True)
@@ -19,7 +33,17 @@ def reset_singletons():
 
 
 @pytest.fixture(autouse=True)
-def mock_settings(monkeypatch):
+def close_transfer_engine():
+    yield
+    TransferEngine().close()
+
+
+@pytest.fixture(autouse=True)
+def mock_settings(monkeypatch, tmp_path):
+    monkeypatch.setattr(AppConfig.Env, 'upload_hash_cache_path', str(tmp_path / 'chunk_hash.db'))
+    monkeypatch.setattr(AppConfig.Env, 'metadata_cache_path', str(tmp_path / 'metadata_cache.db'))
+    monkeypatch.delitem(Singleton._instances, MetadataCache, raising=False)
+    monkeypatch.delitem(Singleton._instances, TokenProvider, raising=False)
     monkeypatch.setattr(AppConfig.Connections, 'url_authn', 'http://service_auth')
     monkeypatch.setattr(AppConfig.Connections, 'url_bff', 'http://bff_cli')
     monkeypatch.setattr(AppConfig.Connections, 'url_upload_greenroom', 'http://upload_gr')